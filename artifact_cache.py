@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# ================================================================
+# author          :Ghislain Vieilledent
+# email           :ghislain.vieilledent@cirad.fr
+# web             :https://ecology.ghislainv.fr
+# python_version  :>=3.6
+# license         :GPLv3
+# ================================================================
+
+"""Content-addressed cache of pipeline artifacts.
+
+Each stage of the pipeline declares its inputs (files or
+directories), its parameters and its outputs. When a stage is run, a
+record with the content hashes of inputs and outputs and the
+parameters is saved in the ``.deforisk_cache`` folder of the working
+directory. The stage is skipped at the next run only if the
+parameters are the same and the hashes of inputs and outputs have not
+changed. As the outputs of a stage are the inputs of the downstream
+stages, a change upstream invalidates the downstream products.
+
+File hashes are memoized by path, size and modification time so that
+large rasters are hashed only once. Hashes of files which no longer
+exist or have changed are dropped when memoized hashes are saved.
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+# Alias
+opj = os.path.join
+
+# Memoized file hashes shared by all caches of the process
+_HASH_LOCK = threading.Lock()
+_HASH_MEMO = {}
+
+
+def _atomic_dump(obj, ofile):
+    """Write json file atomically."""
+    tmp_file = f"{ofile}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2, sort_keys=True, default=str)
+    os.replace(tmp_file, ofile)
+
+
+def file_hash(ifile, chunk_size=1 << 22):
+    """Compute the blake2b hash of a file content."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(ifile, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_current(key):
+    """Check that a memoized hash key matches the file on disk.
+
+    Keys are ``path|size|mtime``. A key is stale if the file was
+    removed, or rewritten since it was hashed.
+    """
+    (path, size, mtime) = key.rsplit("|", 2)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return f"{stat.st_size}|{stat.st_mtime_ns}" == f"{size}|{mtime}"
+
+
+def list_files(paths):
+    """List files from a list of files and directories.
+
+    Directories are listed (not recursively) and symbolic links are
+    followed. Hidden files (such as cached intermediate arrays) are
+    not listed. Missing paths are kept so that they are reported as
+    missing in the signature.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for fname in sorted(os.listdir(path)):
+                ifile = opj(path, fname)
+                if os.path.isfile(ifile) and not fname.startswith("."):
+                    files.append(ifile)
+        else:
+            files.append(path)
+    return files
+
+
+class ArtifactCache:
+    """Content-addressed cache of pipeline artifacts."""
+
+    CACHE_DIR = ".deforisk_cache"
+    HASH_FILE = "hashes.json"
+
+    def __init__(self, workdir):
+        self.cache_dir = opj(workdir, self.CACHE_DIR)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hash_file = opj(self.cache_dir, self.HASH_FILE)
+        self._load_hashes()
+
+    def _load_hashes(self):
+        """Load memoized hashes from disk."""
+        if not os.path.isfile(self.hash_file):
+            return
+        try:
+            with open(self.hash_file, "r", encoding="utf-8") as f:
+                hashes = json.load(f)
+        except ValueError:
+            return
+        with _HASH_LOCK:
+            for (key, value) in hashes.items():
+                _HASH_MEMO.setdefault(key, value)
+
+    def _save_hashes(self):
+        """Save memoized hashes to disk.
+
+        Hashes of files which were removed or modified are dropped so
+        that the file does not grow with each recomputation.
+        """
+        with _HASH_LOCK:
+            stale = [key for key in _HASH_MEMO if not is_current(key)]
+            for key in stale:
+                del _HASH_MEMO[key]
+            hashes = dict(_HASH_MEMO)
+        _atomic_dump(hashes, self.hash_file)
+
+    def get_hash(self, ifile):
+        """Get the (memoized) hash of a file, None if missing."""
+        if not os.path.isfile(ifile):
+            return None
+        real = os.path.realpath(ifile)
+        stat = os.stat(real)
+        key = f"{real}|{stat.st_size}|{stat.st_mtime_ns}"
+        with _HASH_LOCK:
+            value = _HASH_MEMO.get(key)
+        if value is None:
+            value = file_hash(real)
+            with _HASH_LOCK:
+                _HASH_MEMO[key] = value
+        return value
+
+    def signature(self, paths):
+        """Get the hashes of files in paths."""
+        return {ifile: self.get_hash(ifile) for ifile in list_files(paths)}
+
+    @staticmethod
+    def normalize(params):
+        """Normalize parameters for comparison."""
+        return json.loads(json.dumps(params, sort_keys=True, default=str))
+
+    def record_file(self, stage):
+        """Path to the record file of a stage."""
+        return opj(self.cache_dir, f"{stage}.json")
+
+    def is_fresh(self, stage, inputs, params, outputs):
+        """Check if the outputs of a stage are up to date.
+
+        :param stage: Stage name (unique in the working directory).
+        :param inputs: List of input files or directories.
+        :param params: Dictionary of parameters.
+        :param outputs: List of output files or directories.
+
+        :return: ``True`` if the stage can be skipped.
+
+        """
+        ifile = self.record_file(stage)
+        if not os.path.isfile(ifile):
+            return False
+        try:
+            with open(ifile, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except ValueError:
+            return False
+        if record.get("params") != self.normalize(params):
+            return False
+        output_sig = self.signature(outputs)
+        if (None in output_sig.values()
+                or record.get("outputs") != output_sig):
+            return False
+        fresh = record.get("inputs") == self.signature(inputs)
+        self._save_hashes()
+        return fresh
+
+    def record(self, stage, inputs, params, outputs):
+        """Record the inputs, parameters and outputs of a stage."""
+        record = {
+            "params": self.normalize(params),
+            "inputs": self.signature(inputs),
+            "outputs": self.signature(outputs),
+        }
+        _atomic_dump(record, self.record_file(stage))
+        self._save_hashes()
+
+    def invalidate(self, stage):
+        """Remove the record of a stage."""
+        ifile = self.record_file(stage)
+        if os.path.isfile(ifile):
+            os.remove(ifile)
+
+# End of file
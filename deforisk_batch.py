@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+
+# ================================================================
+# author          :Ghislain Vieilledent
+# email           :ghislain.vieilledent@cirad.fr
+# web             :https://ecology.ghislainv.fr
+# python_version  :>=3.6
+# license         :GPLv3
+# ================================================================
+
+"""Run the deforisk workflow without the QGIS interface.
+
+The batch runner drives the same tasks as the plugin dialog from a
+YAML or JSON configuration file. Tasks are run with a headless QGIS
+application (no display needed) so that the workflow can be run on a
+compute node. Tasks of a same step (periods, models, window sizes)
+are run in parallel in a pool of processes.
+
+Usage, from the directory containing the plugin folder::
+
+    python -m deforisk.deforisk_batch config.yaml --workers 8
+
+Example of configuration file (keys not given take the default values
+of the plugin dialog, see ``DEFAULTS``)::
+
+    workdir: /scratch/deforisk/MTQ
+    aoi: MTQ
+    isocode: MTQ
+    years: 2000, 2010, 2020
+    fcc_source: tmf
+    proj: EPSG:5490
+    gc_project: /home/user/deforisk/deforisk-gee.json
+    wdpa_key: /home/user/deforisk/env.txt
+    steps: [variables, bm, far, mw, validate]
+    far_models: [icar, glm, rf]
+    win_sizes: [11, 21]
+    n_workers: 8
+
+"""
+
+import os
+import sys
+import json
+import inspect
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+
+from qgis.core import Qgis, QgsApplication
+
+# Local import
+from .far_functions import (
+    FarGetFccGridArgsTask,
+    FarGetFccTilesTask,
+    FarGetVariablesTask,
+    FarSampleObsTask,
+    FarCalibrateTask,
+    FarInterpolateRhoTask,
+    FarPredictTask,
+)
+from .rmj_functions import (
+    BmCalibrateTask,
+    BmPredictTask,
+    DistThreshTask,
+    MwCalibrateTask,
+    MwPredictTask,
+)
+from .val_functions import (
+    ValidateTask,
+    combine_model_results,
+)
+from .engines import preview_workdir
+
+# Alias
+opj = os.path.join
+
+# Constants
+FAR_MODELS = ["icar", "glm", "rf"]
+MOD_PERIODS = ["calibration", "historical"]
+PRED_PERIODS = ["calibration", "validation",
+                "historical", "forecast"]
+PRED_BM_PERIODS = ["validation", "forecast"]
+VAL_PERIODS = ["calibration", "validation",
+               "historical"]
+STEPS = ["variables", "bm", "far", "mw", "validate"]
+
+# Default arguments (same as the plugin dialog)
+DEFAULTS = {
+    # Data
+    "workdir": None,
+    "aoi": None,
+    "years": "2000, 2010, 2020",
+    "fcc_source": "tmf",
+    "perc": 50,
+    "tile_size": 1.0,
+    "isocode": None,
+    "gc_project": "",
+    "wdpa_key": "",
+    "proj": None,
+    "tile_workers": 4,
+    "tile_retries": 3,
+    "variable_workers": 4,
+    # Pyramid levels (in m) and preview resolution (0 for full
+    # resolution)
+    "pyramid_levels": "90, 300",
+    "preview_res": 0,
+    # Benchmark and moving window
+    "defor_thresh": 99.5,
+    "max_dist": 2500,
+    "win_sizes": "11, 21",
+    "mw_workers": 4,
+    # FAR sample
+    "nsamp": 10000,
+    "adapt": True,
+    "seed": 1234,
+    "csize": 2.0,
+    "sample_csv": True,
+    "sample_workers": 4,
+    # FAR models
+    "variables": ("C(pa), dist_edge, "
+                  "dist_road, dist_town, dist_river, "
+                  "altitude, slope"),
+    "beta_start": -99.0,
+    "prior_vrho": -1,
+    "mcmc": 1000,
+    "varselection": True,
+    "varselection_mode": "icar",
+    "n_chains": 1,
+    "burnin_max": 0,
+    "csize_interp": 0.1,
+    "predict_workers": 4,
+    "far_models": FAR_MODELS,
+    # Validation
+    "csizes_val": "50, 100",
+    "val_models": None,
+    "val_workers": 4,
+    # Periods
+    "mod_periods": MOD_PERIODS,
+    "pred_periods": PRED_PERIODS,
+    "val_periods": VAL_PERIODS,
+    # Batch
+    "steps": STEPS,
+    "n_workers": 1,
+}
+
+# Required arguments
+REQUIRED = ["workdir", "aoi", "isocode", "proj"]
+
+# Tasks which can be run in worker processes
+TASKS = {
+    "SampleObs": FarSampleObsTask,
+    "FarCalibrate": FarCalibrateTask,
+    "FarInterpolateRho": FarInterpolateRhoTask,
+    "FarPredict": FarPredictTask,
+    "BmCalibrate": BmCalibrateTask,
+    "BmPredict": BmPredictTask,
+    "DistThresh": DistThreshTask,
+    "MwCalibrate": MwCalibrateTask,
+    "MwPredict": MwPredictTask,
+    "Validate": ValidateTask,
+}
+
+# Headless QGIS application of the process
+_QGS_APP = None
+
+
+class BatchIface:
+    """Replacement of the QGIS interface in batch mode.
+
+    Tasks only use the interface to push messages to the message
+    bar. Critical messages are raised as exceptions, other messages
+    are printed.
+    """
+
+    def messageBar(self):  # pylint: disable=invalid-name
+        """Message bar."""
+        return self
+
+    def pushMessage(self, title, text,  # pylint: disable=invalid-name
+                    level=Qgis.Info, duration=None):
+        """Push message."""
+        if level == Qgis.Critical:
+            raise RuntimeError(f"{title}: {text}")
+        print(f"{title}: {text}", flush=True)
+
+
+def print_message(message, tag, level):
+    """Print QGIS log messages."""
+    print(f"[{tag}] {message}", flush=True)
+
+
+def init_qgis():
+    """Initialize a headless QGIS application for the process."""
+    global _QGS_APP  # pylint: disable=global-statement
+    if _QGS_APP is not None:
+        return
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    _QGS_APP = QgsApplication([], False)
+    _QGS_APP.initQgis()
+    QgsApplication.messageLog().messageReceived.connect(print_message)
+
+
+def as_list(value):
+    """Get a list from a comma separated string or a list."""
+    if isinstance(value, str):
+        return [i for i in value.replace(" ", "").split(",") if i]
+    return list(value)
+
+
+def as_str(value):
+    """Get a comma separated string from a list or a string."""
+    if isinstance(value, str):
+        return value
+    return ", ".join(str(i) for i in value)
+
+
+def load_config(config_file):
+    """Load arguments from a YAML or JSON configuration file."""
+    ext = os.path.splitext(config_file)[1].lower()
+    with open(config_file, "r", encoding="utf-8") as f:
+        if ext in [".yaml", ".yml"]:
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    config = config or {}
+    unknown = set(config) - set(DEFAULTS)
+    if unknown:
+        msg = f"Unknown arguments in {config_file}: {sorted(unknown)}"
+        raise ValueError(msg)
+    args = DEFAULTS.copy()
+    args.update(config)
+    missing = [key for key in REQUIRED if not args[key]]
+    if missing:
+        msg = f"Missing arguments in {config_file}: {missing}"
+        raise ValueError(msg)
+    # Same formats as in the plugin
+    args["workdir"] = os.path.abspath(os.path.expanduser(args["workdir"]))
+    # Stages after variables run in the preview working directory
+    args["preview_res"] = float(args["preview_res"] or 0)
+    levels = [float(i) for i in as_list(args["pyramid_levels"])]
+    if args["preview_res"] and args["preview_res"] not in levels:
+        levels.append(args["preview_res"])
+    args["pyramid_levels"] = levels
+    args["data_workdir"] = args["workdir"]
+    args["workdir"] = preview_workdir(args["workdir"], args["preview_res"])
+    args["years"] = as_str(args["years"])
+    args["win_sizes"] = [int(i) for i in as_list(args["win_sizes"])]
+    args["csizes_val"] = [int(i) for i in as_list(args["csizes_val"])]
+    for key in ["far_models", "mod_periods", "pred_periods",
+                "val_periods", "steps"]:
+        args[key] = as_list(args[key])
+    if args["val_models"] is None:
+        val_models = ["bm"]
+        val_models.extend(f"mw_{i}" for i in args["win_sizes"])
+        val_models.extend(args["far_models"])
+        args["val_models"] = val_models
+    else:
+        args["val_models"] = as_list(args["val_models"])
+    args["get_fcc_args"] = {
+        "aoi": args["aoi"], "years": args["years"],
+        "fcc_source": args["fcc_source"], "perc": int(args["perc"]),
+        "tile_size": float(args["tile_size"])}
+    return args
+
+
+def get_date(period):
+    """Get date from period."""
+    date = None
+    if period in ["calibration", "historical"]:
+        date = "t1"
+    elif period == "validation":
+        date = "t2"
+    elif period == "forecast":
+        date = "t3"
+    return date
+
+
+def get_interp_periods(args):
+    """Get model periods for which rho must be interpolated."""
+    interp_periods = []
+    pred_periods = args["pred_periods"]
+    for (p, period) in enumerate(MOD_PERIODS):
+        if any(i in pred_periods for i in PRED_PERIODS[2 * p: 2 * p + 2]):
+            interp_periods.append(period)
+    return interp_periods
+
+
+def task_description(args, task_name, model=None, period=None,
+                     date=None, csize_val=None):
+    """Write down task description (same as in the plugin)."""
+    years = args["years"].replace(" ", "").replace(",", "_")
+    mod_desc = f"_{model}" if model else ""
+    period_desc = f"_{period}" if period else ""
+    date_desc = f"_{date}" if date else ""
+    csize_desc = f"_{csize_val}" if csize_val else ""
+    description = (f"{task_name}_{args['isocode']}_"
+                   f"{years}_{args['fcc_source']}"
+                   + mod_desc + period_desc + date_desc + csize_desc)
+    return description
+
+
+def run_task(task):
+    """Run a task in the current thread.
+
+    The ``finished()`` method is called on success so that figures
+    are produced as in the plugin.
+    """
+    result = task.run()
+    if not result:
+        exc = task.exception
+        if isinstance(exc, Exception):
+            raise exc
+        msg = f'Task "{task.description()}" failed'
+        raise RuntimeError(f"{msg}: {exc}" if exc else msg)
+    task.finished(result)
+
+
+def run_job(job):
+    """Run a list of tasks sequentially.
+
+    :param job: List of (task name, task arguments) tuples.
+
+    :return: List of task descriptions.
+
+    """
+    init_qgis()
+    descriptions = []
+    for (task_name, kwargs) in job:
+        task_class = TASKS[task_name]
+        kwargs = kwargs.copy()
+        if "iface" in inspect.signature(task_class).parameters:
+            kwargs["iface"] = BatchIface()
+        task = task_class(**kwargs)
+        run_task(task)
+        descriptions.append(kwargs["description"])
+    return descriptions
+
+
+def run_jobs(jobs, n_workers):
+    """Run independent jobs in a pool of processes.
+
+    Processes are started with the "spawn" method as QGIS is not
+    fork-safe. Each job is a list of tasks which are run
+    sequentially (e.g. sampling then calibration for one period).
+    """
+    if len(jobs) == 0:
+        return
+    failed = []
+    if n_workers <= 1 or len(jobs) == 1:
+        for job in jobs:
+            try:
+                run_job(job)
+            except Exception as exc:
+                failed.append((job[0][1]["description"], exc))
+    else:
+        ctx = mp.get_context("spawn")
+        n_workers = min(n_workers, len(jobs))
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                                 initializer=init_qgis) as pool:
+            futures = {pool.submit(run_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                exc = future.exception()
+                if exc is not None:
+                    job = futures[future]
+                    failed.append((job[0][1]["description"], exc))
+    if failed:
+        msg = "\n".join(f"  {desc}: {exc}" for (desc, exc) in failed)
+        raise RuntimeError(f"{len(failed)} job(s) failed:\n{msg}")
+
+
+def run_variables(args):
+    """Download forest cover change and compute variables."""
+    workdir = args["data_workdir"]
+    task = FarGetFccGridArgsTask(
+        description=task_description(args, "GetFccGridArgs"),
+        iface=BatchIface(),
+        workdir=workdir,
+        get_fcc_args=args["get_fcc_args"],
+        gc_project=args["gc_project"])
+    run_task(task)
+    task = FarGetFccTilesTask(
+        description=task_description(args, "GetFccTiles"),
+        grid_args=task.grid_args,
+        n_workers=args["tile_workers"],
+        max_retries=args["tile_retries"])
+    run_task(task)
+    task = FarGetVariablesTask(
+        description=task_description(args, "GetVariables"),
+        iface=BatchIface(),
+        workdir=workdir,
+        get_fcc_args=args["get_fcc_args"],
+        isocode=args["isocode"],
+        gc_project=args["gc_project"],
+        wdpa_key=args["wdpa_key"],
+        proj=args["proj"],
+        pyramid_levels=args["pyramid_levels"],
+        n_workers=args["variable_workers"])
+    run_task(task)
+
+
+def model_jobs(args):
+    """Jobs for model fitting (one job per model and period)."""
+    workdir = args["workdir"]
+    years = args["years"]
+    steps = args["steps"]
+    jobs = []
+    interp_periods = get_interp_periods(args)
+    for period in args["mod_periods"]:
+        # FAR models: sampling, calibration and rho interpolation
+        if "far" in steps:
+            os.makedirs(opj(workdir, "outputs", "far_models", period),
+                        exist_ok=True)
+            job = [("SampleObs", {
+                "description": task_description(
+                    args, "SampleObs", period=period),
+                "workdir": workdir, "period": period,
+                "proj": args["proj"], "nsamp": args["nsamp"],
+                "adapt": args["adapt"], "seed": args["seed"],
+                "csize": args["csize"],
+                "export_csv": args["sample_csv"],
+                "n_workers": args["sample_workers"]})]
+            job.append(("FarCalibrate", {
+                "description": task_description(
+                    args, "FarCalibrate", period=period),
+                "workdir": workdir, "period": period,
+                "csize": args["csize"],
+                "variables": args["variables"],
+                "beta_start": args["beta_start"],
+                "prior_vrho": args["prior_vrho"],
+                "mcmc": args["mcmc"],
+                "varselection": args["varselection"],
+                "varselection_mode": args["varselection_mode"],
+                "n_chains": args["n_chains"],
+                "burnin_max": args["burnin_max"],
+                "seed": args["seed"]}))
+            if "icar" in args["far_models"] and period in interp_periods:
+                job.append(("FarInterpolateRho", {
+                    "description": task_description(
+                        args, "FarInterpolateRho", period=period),
+                    "workdir": workdir, "period": period,
+                    "csize_interpolate": args["csize_interp"]}))
+            jobs.append(job)
+        # Benchmark and moving window models share the distance
+        # threshold of the period which is computed first in the
+        # same job
+        if "bm" in steps or "mw" in steps:
+            job = [("DistThresh", {
+                "description": task_description(
+                    args, "DistThresh", period=period),
+                "workdir": workdir,
+                "defor_thresh": args["defor_thresh"],
+                "max_dist": args["max_dist"],
+                "period": period})]
+            if "bm" in steps:
+                job.append(("BmCalibrate", {
+                    "description": task_description(
+                        args, "BmCalibrate", period=period),
+                    "workdir": workdir, "years": years,
+                    "period": period}))
+            # Moving window models of a period are computed together
+            # in one pass over the forest cover change raster
+            if "mw" in steps:
+                os.makedirs(opj(workdir, "outputs", "rmj_moving_window",
+                                period), exist_ok=True)
+                win_sizes = args["win_sizes"]
+                job.append(("MwCalibrate", {
+                    "description": task_description(
+                        args, "MwCalibrate",
+                        model="mv_" + "_".join(str(i) for i in win_sizes),
+                        period=period),
+                    "workdir": workdir, "years": years,
+                    "win_sizes": win_sizes, "period": period,
+                    "n_workers": args["mw_workers"]}))
+            jobs.append(job)
+    return jobs
+
+
+def predict_jobs(args):
+    """Jobs for predictions (one job per model and period).
+
+    FAR models of a period are predicted together in one job.
+    """
+    workdir = args["workdir"]
+    years = args["years"]
+    steps = args["steps"]
+    jobs = []
+    for period in args["pred_periods"]:
+        date = get_date(period)
+        if "far" in steps:
+            os.makedirs(opj(workdir, "outputs", "far_models", period),
+                        exist_ok=True)
+            models = list(args["far_models"])
+            if len(models) > 0:
+                jobs.append([("FarPredict", {
+                    "description": task_description(
+                        args, "FarPredict", model="_".join(models),
+                        period=period, date=date),
+                    "workdir": workdir, "years": years,
+                    "period": period, "models": models,
+                    "n_workers": args["predict_workers"]})])
+        if "bm" in steps and period in PRED_BM_PERIODS:
+            jobs.append([("BmPredict", {
+                "description": task_description(
+                    args, "BmPredict", period=period, date=date),
+                "workdir": workdir, "years": years,
+                "period": period})])
+        if "mw" in steps:
+            os.makedirs(opj(workdir, "outputs", "rmj_moving_window",
+                            period), exist_ok=True)
+            for win_size in args["win_sizes"]:
+                jobs.append([("MwPredict", {
+                    "description": task_description(
+                        args, "MwPredict", model=f"mv_{win_size}",
+                        date=date),
+                    "workdir": workdir, "years": years,
+                    "win_size": win_size, "period": period})])
+    return jobs
+
+
+def validate_jobs(args):
+    """Jobs for model validation (one job per period).
+
+    All the models and coarse grids of a period are validated
+    together in one pass over the forest cover change raster.
+    """
+    workdir = args["workdir"]
+    models = list(args["val_models"])
+    jobs = []
+    for period in args["val_periods"]:
+        date = get_date(period)
+        for subdir in ["figures", "tables"]:
+            os.makedirs(opj(workdir, "outputs", "model_validation",
+                            period, subdir), exist_ok=True)
+        jobs.append([("Validate", {
+            "description": task_description(
+                args, "Validate", model="_".join(models), period=period,
+                date=date),
+            "workdir": workdir, "years": args["years"],
+            "csizes_val": args["csizes_val"], "models": models,
+            "period": period, "n_workers": args["val_workers"]})])
+    return jobs
+
+
+def run_workflow(args):
+    """Run the steps of the workflow."""
+    steps = args["steps"]
+    n_workers = int(args["n_workers"])
+    os.makedirs(args["workdir"], exist_ok=True)
+    if "variables" in steps:
+        run_variables(args)
+    run_jobs(model_jobs(args), n_workers)
+    run_jobs(predict_jobs(args), n_workers)
+    if "validate" in steps:
+        run_jobs(validate_jobs(args), n_workers)
+        # Only the validated models are combined so that results
+        # from a previous run with other models are left out
+        combine_model_results(
+            workdir=args["workdir"],
+            csizes_val=args["csizes_val"],
+            models=list(args["val_models"]),
+            periods=list(args["val_periods"]))
+
+
+def main(argv=None):
+    """Command line interface."""
+    parser = argparse.ArgumentParser(
+        description="Run the deforisk workflow without QGIS interface.")
+    parser.add_argument("config", help="YAML or JSON configuration file")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes")
+    parser.add_argument("--steps", default=None,
+                        help=("comma separated steps among "
+                              f"{', '.join(STEPS)}"))
+    opts = parser.parse_args(argv)
+    args = load_config(opts.config)
+    if opts.workers is not None:
+        args["n_workers"] = opts.workers
+    if opts.steps is not None:
+        args["steps"] = as_list(opts.steps)
+    init_qgis()
+    try:
+        run_workflow(args)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        _QGS_APP.exitQgis()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# End of file
@@ -32,14 +32,14 @@ import os
 import subprocess
 import platform
 import random
+from functools import partial
 
-from qgis.core import Qgis, QgsApplication, QgsTask
+from qgis.core import Qgis, QgsApplication
 
 from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction
 
-import pandas as pd
 import geefcc
 import pywdpa
 import forestatrisk as far
@@ -53,7 +53,7 @@ from .deforisk_plugin_dialog import DeforiskPluginDialog
 # Local far functions
 from .far_functions import (
     FarGetFccGridArgsTask,
-    FarGetFccTileTask,
+    FarGetFccTilesTask,
     FarGetVariablesTask,
     FarSampleObsTask,
     FarCalibrateTask,
@@ -65,16 +65,23 @@ from .far_functions import (
 from .rmj_functions import (
     BmCalibrateTask,
     BmPredictTask,
+    DistThreshTask,
     MwCalibrateTask,
     MwPredictTask,
 )
 
 # Local val function
 from .val_functions import (
-    EmptyTask,
-    ValidateTask
+    ValidateTask,
+    combine_model_results,
 )
 
+# Task graph
+from .task_graph import TaskGraph
+
+# Preview resolution
+from .engines import preview_workdir
+
 opj = os.path.join
 
 
@@ -125,8 +132,9 @@ class DeforiskPlugin:
         self.first_start = None
         self.dlg = None
 
-        # Task manager
+        # Task manager and running task graphs
         self.tm = QgsApplication.taskManager()
+        self.graphs = []
 
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -424,6 +432,18 @@ class DeforiskPlugin:
             date = "t3"
         return date
 
+    def get_pyramid_levels(self):
+        """Get resolutions of pyramid levels as list.
+
+        The preview resolution is always built.
+        """
+        levels = self.args["pyramid_levels"]
+        levels = [float(i) for i in levels.replace(" ", "").split(",") if i]
+        preview_res = self.args["preview_res"]
+        if preview_res and preview_res not in levels:
+            levels.append(preview_res)
+        return levels
+
     def get_csizes_val(self):
         """Get coarse grid cell sizes as list."""
         csizes_val = self.args["csizes_val"]
@@ -481,36 +501,11 @@ class DeforiskPlugin:
 
     def combine_model_results(self):
         """Combine model results for comparison."""
-        workdir = self.args["workdir"]
-        os.chdir(workdir)
-        indices_list = []
-        csizes_val = self.get_csizes_val()
-        models = self.get_all_models()
-        periods = self.VAL_PERIODS.copy()
-        # Loop on periods and models
-        for csize_val in csizes_val:
-            for period in periods:
-                for model in models:
-                    ifile = opj(
-                        self.OUT, "model_validation",
-                        period, "tables",
-                        f"indices_{model}_{period}_{csize_val}.csv"
-                    )
-                    if os.path.isfile(ifile):
-                        df = pd.read_csv(ifile)
-                        df["model"] = model
-                        df["period"] = period
-                        indices_list.append(df)
-        # Concat indices
-        indices = pd.concat(indices_list, axis=0)
-        indices.sort_values(by=["csize_coarse_grid", "period", "model"])
-        indices = indices[["csize_coarse_grid", "csize_coarse_grid_ha",
-                           "ncell", "period", "model",
-                           "MedAE", "R2", "RMSE", "wRMSE"]]
-        indices.to_csv(
-            os.path.join(self.OUT, "model_validation", "indices_all.csv"),
-            sep=",", header=True,
-            index=False, index_label=False)
+        combine_model_results(
+            workdir=self.args["workdir"],
+            csizes_val=self.get_csizes_val(),
+            models=self.get_all_models(),
+            periods=self.VAL_PERIODS.copy())
 
     def catch_arguments(self):
         """Catch arguments from UI."""
@@ -574,6 +569,27 @@ class DeforiskPlugin:
         val_calib = self.dlg.val_calib.isChecked()
         val_valid = self.dlg.val_valid.isChecked()
         val_histo = self.dlg.val_histo.isChecked()
+        # Advanced settings (not in the dialog)
+        settings = QSettings()
+        tile_workers = settings.value("deforisk/tile_workers", 4, type=int)
+        tile_retries = settings.value("deforisk/tile_retries", 3, type=int)
+        n_chains = settings.value("deforisk/mcmc_chains", 1, type=int)
+        burnin_max = settings.value("deforisk/mcmc_burnin_max", 0, type=int)
+        predict_workers = settings.value("deforisk/predict_workers", 4,
+                                         type=int)
+        varselection_mode = settings.value("deforisk/varselection_mode",
+                                           "icar", type=str)
+        sample_csv = settings.value("deforisk/sample_csv", True, type=bool)
+        sample_workers = settings.value("deforisk/sample_workers", 4,
+                                        type=int)
+        variable_workers = settings.value("deforisk/variable_workers", 4,
+                                          type=int)
+        mw_workers = settings.value("deforisk/mw_workers", 4, type=int)
+        val_workers = settings.value("deforisk/val_workers", 4, type=int)
+        pyramid_levels = settings.value("deforisk/pyramid_levels",
+                                        "90, 300", type=str)
+        preview_res = settings.value("deforisk/preview_res", 0.0,
+                                     type=float)
         # Special variables
         if workdir == "":
             # seed = 1234  # Only for tests to get same dir
@@ -586,13 +602,20 @@ class DeforiskPlugin:
         variables = var if variables == "" else variables
         # Dictionary of arguments for far functions
         self.args = {
-            # Data
-            "workdir": workdir,
+            # Data (stages after variables run in the preview
+            # working directory if a preview resolution is set)
+            "data_workdir": workdir,
+            "workdir": preview_workdir(workdir, preview_res),
+            "pyramid_levels": pyramid_levels,
+            "preview_res": preview_res,
             "get_fcc_args": get_fcc_args,
             "isocode": iso,
             "gc_project": gc_project,
             "wdpa_key": wdpa_key,
             "proj": proj,
+            "tile_workers": tile_workers,
+            "tile_retries": tile_retries,
+            "variable_workers": variable_workers,
             # Benchmark
             "defor_thresh": defor_thresh, "max_dist": max_dist,
             "mod_bm_periods": {
@@ -603,7 +626,8 @@ class DeforiskPlugin:
                 "pred_bm_forecast_t3": pred_bm_forecast_t3},
             # FAR sample
             "nsamp": nsamp, "adapt": adapt, "seed": seed,
-            "csize": csize,
+            "csize": csize, "sample_csv": sample_csv,
+            "sample_workers": sample_workers,
             "samp_far_periods": {
                 "samp_far_calib": samp_far_calib,
                 "samp_far_hist": samp_far_hist},
@@ -611,11 +635,15 @@ class DeforiskPlugin:
             "variables": variables,
             "beta_start": beta_start, "prior_vrho": prior_vrho,
             "mcmc": mcmc, "varselection": varselection,
+            "n_chains": n_chains,
+            "burnin_max": burnin_max,
+            "varselection_mode": varselection_mode,
             "mod_far_periods": {
                 "mod_far_calib": mod_far_calib,
                 "mod_far_hist": mod_far_hist},
             # FAR predict
             "csize_interp": csize_interp,
+            "predict_workers": predict_workers,
             "pred_far_models": {
                 "pred_icar": pred_icar,
                 "pred_glm": pred_glm,
@@ -627,6 +655,7 @@ class DeforiskPlugin:
                 "pred_far_forecast_t3": pred_far_forecast_t3},
             # Moving Window
             "win_sizes": win_sizes,
+            "mw_workers": mw_workers,
             "mod_mw_periods": {
                 "mod_mw_calib": mod_mw_calib,
                 "mod_mw_hist": mod_mw_hist},
@@ -637,6 +666,7 @@ class DeforiskPlugin:
                 "pred_mw_forecast_t3": pred_mw_forecast_t3},
             # Validation
             "csizes_val": csizes_val,
+            "val_workers": val_workers,
             "val_icar": val_icar,
             "val_glm": val_glm, "val_rf": val_rf,
             "val_mw": val_mw,
@@ -644,258 +674,425 @@ class DeforiskPlugin:
             "val_histo": val_histo,
         }
 
-    def far_get_fcc_grid_args(self):
+    def start_graph(self, graph, callback=None):
+        """Start a task graph and keep a reference to it."""
+
+        def graph_finished(failed):
+            self.graphs.remove(graph)
+            if callback is not None and not failed:
+                callback()
+
+        graph.callback = graph_finished
+        self.graphs.append(graph)
+        graph.start()
+
+    def get_mod_period(self, period):
+        """Get period of the model used for predictions."""
+        mod_period = "historical"
+        if period in ["calibration", "validation"]:
+            mod_period = "calibration"
+        return mod_period
+
+    def get_pred_node(self, model, period):
+        """Get the graph node producing the risk map of a model."""
+        if model in self.FAR_MODELS:
+            node = f"FarPredict_{period}"
+        elif model == "bm":
+            if period in self.MOD_PERIODS:
+                node = f"BmCalibrate_{period}"
+            else:
+                node = f"BmPredict_{period}"
+        else:
+            win_size = model.split("_")[1]
+            node = f"MwPredict_{win_size}_{period}"
+        return node
+
+    def far_get_fcc_grid_args_task(self):
         """Get fcc grid arguments."""
-        self.catch_arguments()
         description = self.task_description("GetFccGridArgs")
         self.task_grid = FarGetFccGridArgsTask(
             description=description,
             iface=self.iface,
-            workdir=self.args["workdir"],
+            workdir=self.args["data_workdir"],
             get_fcc_args=self.args["get_fcc_args"],
             gc_project=self.args["gc_project"],
         )
-        self.task_grid.taskCompleted.connect(self.far_get_fcc_tiles)
-        # Add task to task manager
-        self.tm.addTask(self.task_grid)
+        return self.task_grid
 
-    def far_get_fcc_tiles(self):
+    def far_get_fcc_tiles_task(self):
         """Get fcc."""
-        self.catch_arguments()
-        # Main empty task
         description = self.task_description("GetFccTiles")
-        main_task = EmptyTask(description)
-        grid = self.task_grid.grid_args["grid"]
-        for (i, ext) in enumerate(grid):
-            description = self.task_description(
-                f"GetFccTile_{i}")
-            task = FarGetFccTileTask(
-                description=description,
-                index=i,
-                ext=ext,
-                grid_args=self.task_grid.grid_args,
-            )
-            main_task.addSubTask(task, [], QgsTask.ParentDependsOnSubTask)
-        # Execute far_predict after rho interpolation
-        main_task.taskCompleted.connect(self.far_get_variables)
-        # Add main task to task manager
-        self.tm.addTask(main_task)
+        task = FarGetFccTilesTask(
+            description=description,
+            grid_args=self.task_grid.grid_args,
+            n_workers=self.args["tile_workers"],
+            max_retries=self.args["tile_retries"],
+        )
+        return task
 
-    def far_get_variables(self):
+    def far_get_variables_task(self):
         """Get variables."""
-        self.catch_arguments()
         description = self.task_description("GetVariables")
         task = FarGetVariablesTask(
             description=description,
             iface=self.iface,
-            workdir=self.args["workdir"],
+            workdir=self.args["data_workdir"],
             get_fcc_args=self.args["get_fcc_args"],
             isocode=self.args["isocode"],
             gc_project=self.args["gc_project"],
             wdpa_key=self.args["wdpa_key"],
-            proj=self.args["proj"])
-        # Add task to task manager
-        self.tm.addTask(task)
+            proj=self.args["proj"],
+            pyramid_levels=self.get_pyramid_levels(),
+            n_workers=self.args["variable_workers"])
+        return task
+
+    def far_sample_obs_task(self, period):
+        """Sample observations."""
+        description = self.task_description(
+            "SampleObs", period=period)
+        task = FarSampleObsTask(
+            description=description,
+            iface=self.iface,
+            workdir=self.args["workdir"],
+            period=period,
+            proj=self.args["proj"],
+            nsamp=self.args["nsamp"],
+            adapt=self.args["adapt"],
+            seed=self.args["seed"],
+            csize=self.args["csize"],
+            export_csv=self.args["sample_csv"],
+            n_workers=self.args["sample_workers"])
+        return task
+
+    def far_calibrate_task(self, period):
+        """Estimate forestatrisk model parameters."""
+        description = self.task_description(
+            "FarCalibrate", period=period)
+        task = FarCalibrateTask(
+            description=description,
+            iface=self.iface,
+            workdir=self.args["workdir"],
+            period=period,
+            csize=self.args["csize"],
+            variables=self.args["variables"],
+            beta_start=self.args["beta_start"],
+            prior_vrho=self.args["prior_vrho"],
+            mcmc=self.args["mcmc"],
+            varselection=self.args["varselection"],
+            n_chains=self.args["n_chains"],
+            burnin_max=self.args["burnin_max"],
+            varselection_mode=self.args["varselection_mode"],
+            seed=self.args["seed"])
+        return task
+
+    def far_interpolate_rho_task(self, period):
+        """Interpolate rho."""
+        description = self.task_description(
+            "FarInterpolateRho", period=period)
+        task = FarInterpolateRhoTask(
+            description=description,
+            iface=self.iface,
+            workdir=self.args["workdir"],
+            period=period,
+            csize_interpolate=self.args["csize_interp"])
+        return task
+
+    def far_predict_task(self, models, period):
+        """Predict deforestation risk with several models."""
+        date = self.get_date(period)
+        description = self.task_description(
+            "FarPredict", model="_".join(models),
+            period=period, date=date)
+        task = FarPredictTask(
+            description=description,
+            iface=self.iface,
+            workdir=self.args["workdir"],
+            years=self.args["get_fcc_args"]["years"],
+            period=period,
+            models=models,
+            n_workers=self.args["predict_workers"])
+        return task
+
+    def mw_calibrate_task(self, win_sizes, period):
+        """Compute local deforestation rates for several window
+        sizes."""
+        model = "mv_" + "_".join(str(i) for i in win_sizes)
+        description = self.task_description(
+            "MwCalibrate", model=model, period=period)
+        task = MwCalibrateTask(
+            description=description,
+            workdir=self.args["workdir"],
+            years=self.args["get_fcc_args"]["years"],
+            win_sizes=win_sizes,
+            period=period,
+            n_workers=self.args["mw_workers"])
+        return task
+
+    def mw_predict_task(self, win_size, period):
+        """Predict deforestation rate with moving window approach."""
+        date = self.get_date(period)
+        model = f"mv_{win_size}"
+        description = self.task_description(
+            "MwPredict", model=model, date=date)
+        task = MwPredictTask(
+            description=description,
+            workdir=self.args["workdir"],
+            years=self.args["get_fcc_args"]["years"],
+            win_size=win_size,
+            period=period)
+        return task
+
+    def bm_calibrate_task(self, period):
+        """Compute distance threshold and vulnerability classes with
+        deforestation rates.
+        """
+        description = self.task_description(
+            "BmCalibrate", period=period)
+        task = BmCalibrateTask(
+            description=description,
+            workdir=self.args["workdir"],
+            years=self.args["get_fcc_args"]["years"],
+            period=period)
+        return task
+
+    def dist_thresh_task(self, period):
+        """Compute the distance to forest edge threshold."""
+        description = self.task_description(
+            "DistThresh", period=period)
+        task = DistThreshTask(
+            description=description,
+            workdir=self.args["workdir"],
+            defor_thresh=self.args["defor_thresh"],
+            max_dist=self.args["max_dist"],
+            period=period)
+        return task
+
+    def bm_predict_task(self, period):
+        """Predict deforestation rate with the benchmark model."""
+        date = self.get_date(period)
+        description = self.task_description(
+            "BmPredict", period=period, date=date)
+        task = BmPredictTask(
+            description=description,
+            workdir=self.args["workdir"],
+            years=self.args["get_fcc_args"]["years"],
+            period=period)
+        return task
+
+    def validate_task(self, models, period):
+        """Validation of several models on all coarse grids."""
+        date = self.get_date(period)
+        description = self.task_description(
+            "Validate", model="_".join(models),
+            period=period, date=date)
+        task = ValidateTask(
+            description=description,
+            iface=self.iface,
+            workdir=self.args["workdir"],
+            years=self.args["get_fcc_args"]["years"],
+            csizes_val=self.get_csizes_val(),
+            models=models,
+            period=period,
+            n_workers=self.args["val_workers"])
+        return task
+
+    def add_get_variables_nodes(self, graph):
+        """Add tasks for variables to the graph."""
+        graph.add("GetFccGridArgs", self.far_get_fcc_grid_args_task)
+        graph.add("GetFccTiles", self.far_get_fcc_tiles_task,
+                  deps=["GetFccGridArgs"])
+        graph.add("GetVariables", self.far_get_variables_task,
+                  deps=["GetFccTiles"])
+
+    def add_far_sample_obs_nodes(self, graph):
+        """Add tasks for observation sampling to the graph."""
+        for period in self.get_samp_far_periods():
+            graph.add(f"SampleObs_{period}",
+                      partial(self.far_sample_obs_task, period),
+                      deps=["GetVariables"])
+
+    def add_far_calibrate_nodes(self, graph):
+        """Add tasks for FAR model fitting to the graph."""
+        for period in self.get_mod_far_periods():
+            graph.add(f"FarCalibrate_{period}",
+                      partial(self.far_calibrate_task, period),
+                      deps=["GetVariables", f"SampleObs_{period}"])
+
+    def add_far_predict_nodes(self, graph):
+        """Add tasks for rho interpolation and FAR predictions."""
+        models = self.get_pred_far_models()
+        # Interpolate rho
+        if "icar" in models:
+            for period in self.get_interp_far_periods():
+                graph.add(f"FarInterpolateRho_{period}",
+                          partial(self.far_interpolate_rho_task, period),
+                          deps=[f"FarCalibrate_{period}"])
+        # Predictions (all models in one pass over the variables)
+        if len(models) == 0:
+            return
+        for period in self.get_pred_far_periods():
+            self.create_far_directory(period)
+            mod_period = self.get_mod_period(period)
+            deps = ["GetVariables", f"FarCalibrate_{mod_period}"]
+            if "icar" in models:
+                deps.append(f"FarInterpolateRho_{mod_period}")
+            graph.add(f"FarPredict_{period}",
+                      partial(self.far_predict_task, models, period),
+                      deps=deps)
+
+    def add_dist_thresh_node(self, graph, period):
+        """Add the distance threshold task of a period to the graph.
+
+        The threshold is shared by the benchmark and moving window
+        models so that the task is added only once.
+        """
+        name = f"DistThresh_{period}"
+        if name not in graph:
+            graph.add(name, partial(self.dist_thresh_task, period),
+                      deps=["GetVariables"])
+        return name
+
+    def add_mw_calibrate_nodes(self, graph):
+        """Add tasks for MW model fitting to the graph."""
+        # All window sizes of a period in one pass over fcc123.tif
+        win_sizes = self.get_win_sizes()
+        for period in self.get_mod_mw_periods():
+            self.create_mw_directory(period)
+            thresh = self.add_dist_thresh_node(graph, period)
+            graph.add(f"MwCalibrate_{period}",
+                      partial(self.mw_calibrate_task, win_sizes, period),
+                      deps=["GetVariables", thresh])
+
+    def add_mw_predict_nodes(self, graph):
+        """Add tasks for MW predictions to the graph."""
+        for period in self.get_pred_mw_periods():
+            self.create_mw_directory(period)
+            mod_period = self.get_mod_period(period)
+            for win_size in self.get_win_sizes():
+                graph.add(f"MwPredict_{win_size}_{period}",
+                          partial(self.mw_predict_task, win_size, period),
+                          deps=[f"MwCalibrate_{mod_period}"])
+
+    def add_bm_calibrate_nodes(self, graph):
+        """Add tasks for benchmark model fitting to the graph."""
+        for period in self.get_mod_bm_periods():
+            thresh = self.add_dist_thresh_node(graph, period)
+            graph.add(f"BmCalibrate_{period}",
+                      partial(self.bm_calibrate_task, period),
+                      deps=["GetVariables", thresh])
+
+    def add_bm_predict_nodes(self, graph):
+        """Add tasks for benchmark predictions to the graph."""
+        for period in self.get_pred_bm_periods():
+            mod_period = self.get_mod_period(period)
+            graph.add(f"BmPredict_{period}",
+                      partial(self.bm_predict_task, period),
+                      deps=[f"BmCalibrate_{mod_period}"])
+
+    def add_validate_nodes(self, graph):
+        """Add tasks for model validation to the graph.
+
+        All the models and coarse grids of a period are validated in
+        one pass over fcc123.tif, once the risk maps of all the models
+        for the period are available.
+        """
+        val_models = self.get_val_models()
+        for period in self.get_val_periods():
+            self.create_validation_directories(period)
+            deps = []
+            for model in val_models:
+                node = self.get_pred_node(model, period)
+                if node not in deps:
+                    deps.append(node)
+            graph.add(f"Validate_{period}",
+                      partial(self.validate_task, val_models, period),
+                      deps=deps)
+
+    def far_get_fcc_grid_args(self):
+        """Get fcc grid arguments, fcc tiles and variables."""
+        self.catch_arguments()
+        graph = TaskGraph(self.tm)
+        self.add_get_variables_nodes(graph)
+        self.start_graph(graph)
 
     def far_sample_obs(self):
         """Sample observations."""
         self.catch_arguments()
-        samp_far_periods = self.get_samp_far_periods()
-        for period in samp_far_periods:
-            description = self.task_description(
-                "SampleObs", period=period)
-            task = FarSampleObsTask(
-                description=description,
-                iface=self.iface,
-                workdir=self.args["workdir"],
-                period=period,
-                proj=self.args["proj"],
-                nsamp=self.args["nsamp"],
-                adapt=self.args["adapt"],
-                seed=self.args["seed"],
-                csize=self.args["csize"])
-            # Add task to task manager
-            self.tm.addTask(task)
+        graph = TaskGraph(self.tm)
+        self.add_far_sample_obs_nodes(graph)
+        self.start_graph(graph)
 
     def far_calibrate(self):
         """Estimate forestatrisk model parameters."""
         self.catch_arguments()
-        periods = self.get_mod_far_periods()
-        for period in periods:
-            description = self.task_description(
-                "FarCalibrate", period=period)
-            task = FarCalibrateTask(
-                description=description,
-                iface=self.iface,
-                workdir=self.args["workdir"],
-                period=period,
-                csize=self.args["csize"],
-                variables=self.args["variables"],
-                beta_start=self.args["beta_start"],
-                prior_vrho=self.args["prior_vrho"],
-                mcmc=self.args["mcmc"],
-                varselection=self.args["varselection"])
-            # Add task to task manager
-            self.tm.addTask(task)
-
-    def far_predict(self):
-        """Predict deforestation risk."""
-        # Models and periods
-        models = self.get_pred_far_models()
-        periods = self.get_pred_far_periods()
-        # Tasks with loops on dates and models
-        for period in periods:
-            self.create_far_directory(period)
-            date = self.get_date(period)
-            for model in models:
-                description = self.task_description(
-                    "FarPredict", model=model,
-                    period=period, date=date)
-                task = FarPredictTask(
-                    description=description,
-                    iface=self.iface,
-                    workdir=self.args["workdir"],
-                    years=self.args["get_fcc_args"]["years"],
-                    period=period,
-                    model=model)
-                # Add task to task manager
-                self.tm.addTask(task)
+        graph = TaskGraph(self.tm)
+        self.add_far_calibrate_nodes(graph)
+        self.start_graph(graph)
 
     def far_predict_after_rho_interp(self):
-        """Interpolate rho."""
+        """Interpolate rho and predict deforestation risk."""
         self.catch_arguments()
-        periods = self.get_interp_far_periods()
-        # Main empty task
-        description = self.task_description("FarInterpolateRho")
-        main_task = EmptyTask(description)
-        # Interpolate rho
-        for period in periods:
-            description = self.task_description(
-                "FarInterpolateRho", period=period)
-            task = FarInterpolateRhoTask(
-                description=description,
-                iface=self.iface,
-                workdir=self.args["workdir"],
-                period=period,
-                csize_interpolate=self.args["csize_interp"])
-            main_task.addSubTask(task, [], QgsTask.ParentDependsOnSubTask)
-        # Execute far_predict after rho interpolation
-        main_task.taskCompleted.connect(self.far_predict)
-        # Add main task to task manager
-        self.tm.addTask(main_task)
+        graph = TaskGraph(self.tm)
+        self.add_far_predict_nodes(graph)
+        self.start_graph(graph)
 
     def mw_calibrate(self):
         """Compute distance threshold and local deforestation rate."""
         self.catch_arguments()
-        win_sizes = self.get_win_sizes()
-        periods = self.get_mod_mw_periods()
-        # Loop on window sizes
-        for period in periods:
-            self.create_mw_directory(period)
-            for win_size in win_sizes:
-                model = f"mv_{win_size}"
-                description = self.task_description(
-                    "MwCalibrate", model=model, period=period)
-                task = MwCalibrateTask(
-                    description=description,
-                    workdir=self.args["workdir"],
-                    years=self.args["get_fcc_args"]["years"],
-                    defor_thresh=self.args["defor_thresh"],
-                    max_dist=self.args["max_dist"],
-                    win_size=win_size,
-                    period=period)
-                # Add task to task manager
-                self.tm.addTask(task)
+        graph = TaskGraph(self.tm)
+        self.add_mw_calibrate_nodes(graph)
+        self.start_graph(graph)
 
     def mw_predict(self):
         """Predict deforestation rate with moving window approach."""
         self.catch_arguments()
-        win_sizes = self.get_win_sizes()
-        periods = self.get_pred_mw_periods()
-        for period in periods:
-            self.create_mw_directory(period)
-            date = self.get_date(period)
-            for wsize in win_sizes:
-                model = f"mv_{wsize}"
-                description = self.task_description(
-                    "MwPredict", model=model, date=date)
-                task = MwPredictTask(
-                    description=description,
-                    workdir=self.args["workdir"],
-                    years=self.args["get_fcc_args"]["years"],
-                    win_size=wsize,
-                    period=period)
-                # Add task to task manager
-                self.tm.addTask(task)
+        graph = TaskGraph(self.tm)
+        self.add_mw_predict_nodes(graph)
+        self.start_graph(graph)
 
     def bm_calibrate(self):
         """Compute distance threshold and vulnerability classes with
         deforestation rates.
         """
         self.catch_arguments()
-        periods = self.get_mod_bm_periods()
-        for period in periods:
-            description = self.task_description(
-                "BmCalibrate", period=period)
-            task = BmCalibrateTask(
-                description=description,
-                workdir=self.args["workdir"],
-                years=self.args["get_fcc_args"]["years"],
-                defor_thresh=self.args["defor_thresh"],
-                max_dist=self.args["max_dist"],
-                period=period)
-            # Add task to task manager
-            self.tm.addTask(task)
+        graph = TaskGraph(self.tm)
+        self.add_bm_calibrate_nodes(graph)
+        self.start_graph(graph)
 
     def bm_predict(self):
         """Predict deforestation rate with the benchmark model."""
         self.catch_arguments()
-        periods = self.get_pred_bm_periods()
-        for period in periods:
-            date = self.get_date(period)
-            description = self.task_description(
-                "BmPredict", period=period, date=date)
-            task = BmPredictTask(
-                description=description,
-                workdir=self.args["workdir"],
-                years=self.args["get_fcc_args"]["years"],
-                period=period)
-            # Add task to task manager
-            self.tm.addTask(task)
+        graph = TaskGraph(self.tm)
+        self.add_bm_predict_nodes(graph)
+        self.start_graph(graph)
 
     def validate(self):
         """Model validation."""
-        # Catch arguments
         self.catch_arguments()
-        csizes_val = self.get_csizes_val()
-        val_models = self.get_val_models()
-        val_periods = self.get_val_periods()
-        # Main empty task
-        description = self.task_description("Validate_all")
-        main_task = EmptyTask(description)
-        # Tasks with loop on csizes_val, periods, and models
-        for csize_val in csizes_val:
-            for period in val_periods:
-                self.create_validation_directories(period)
-                date = self.get_date(period)
-                for model in val_models:
-                    description = self.task_description(
-                        "Validate", model=model,
-                        period=period, date=date,
-                        csize_val=csize_val)
-                    task = ValidateTask(
-                        description=description,
-                        iface=self.iface,
-                        workdir=self.args["workdir"],
-                        years=self.args["get_fcc_args"]["years"],
-                        csize_val=csize_val,
-                        period=period,
-                        model=model)
-                    main_task.addSubTask(task)
-        # Combine model results
-        main_task.taskCompleted.connect(self.combine_model_results)
-        # Add first task to task manager
-        self.tm.addTask(main_task)
+        graph = TaskGraph(self.tm)
+        self.add_validate_nodes(graph)
+        self.start_graph(graph, callback=self.combine_model_results)
+
+    def run_all(self):
+        """Run all the selected steps of the workflow.
+
+        Steps are organized in a graph of tasks: the benchmark and
+        moving window models are run concurrently with the sampling
+        and fitting of the FAR models, and validations start as soon
+        as the predictions for a period are available.
+        """
+        self.catch_arguments()
+        graph = TaskGraph(self.tm)
+        self.add_get_variables_nodes(graph)
+        self.add_bm_calibrate_nodes(graph)
+        self.add_mw_calibrate_nodes(graph)
+        self.add_far_sample_obs_nodes(graph)
+        self.add_far_calibrate_nodes(graph)
+        self.add_bm_predict_nodes(graph)
+        self.add_mw_predict_nodes(graph)
+        self.add_far_predict_nodes(graph)
+        self.add_validate_nodes(graph)
+        self.start_graph(graph, callback=self.combine_model_results)
 
     def run(self):
         """Run method that performs all the real work."""
@@ -916,6 +1113,10 @@ class DeforiskPlugin:
         self.dlg.run_far_get_variable.clicked.connect(
             self.far_get_fcc_grid_args)
 
+        # All steps
+        self.dlg.run_all.clicked.connect(
+            self.run_all)
+
         # Benchmark model
         self.dlg.run_bm_calibrate.clicked.connect(
             self.bm_calibrate)
@@ -0,0 +1,17 @@
+"""Computation engines independent of QGis."""
+
+from .forest import get_aoi_extent, compute_forest_from_tiles
+from .pool import process_pool
+from .mcmc import fit_icar_chains
+from .varselection import select_variables
+from .neighbors import cellneigh
+from .blocks import plan_blk_rows
+from .predict import predict_raster, block_memory as predict_block_memory
+from .design import design_spec, save_design_spec, load_design_spec
+from .defrate import N_CAT, write_defrate_per_cat
+from .comparison import submit_models, MODELS as COMPARISON_MODELS
+from .samples import write_sample, read_sample, sample_file
+from .sampling import sample as sample_observations
+from .pyramid import preview_workdir, build_level
+
+# End of file
@@ -0,0 +1,143 @@
+"""Block sizes for raster input/output."""
+
+import os
+from glob import glob
+
+from osgeo import gdal
+
+# Alias
+opj = os.path.join
+
+# Memory budget (in bytes) if the available memory is unknown
+DEFAULT_BUDGET = 256 * 1024 ** 2
+# Bounds of the memory budget and fraction of the available memory
+MIN_BUDGET = 32 * 1024 ** 2
+MAX_BUDGET = 1024 ** 3
+MEMORY_FRACTION = 0.1
+
+
+def available_memory():
+    """Get the available physical memory (in bytes).
+
+    :return: Available memory, or None if unknown.
+
+    """
+    try:
+        return (os.sysconf("SC_AVPHYS_PAGES")
+                * os.sysconf("SC_PAGE_SIZE"))
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        # Windows
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            """MEMORYSTATUSEX structure."""
+            _fields_ = [("dwLength", ctypes.c_ulong),
+                        ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong),
+                        ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong),
+                        ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong),
+                        ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+        return status.ullAvailPhys
+    except (AttributeError, OSError):
+        return None
+
+
+def memory_budget():
+    """Memory budget for one block (in bytes).
+
+    A fraction of the available memory, bounded so that blocks are
+    neither too small (many small reads) nor too large.
+    """
+    avail = available_memory()
+    if not avail:
+        return DEFAULT_BUDGET
+    budget = int(avail * MEMORY_FRACTION)
+    return max(MIN_BUDGET, min(budget, MAX_BUDGET))
+
+
+def raster_files(paths):
+    """List raster files from files and directories (``*.tif``)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob(opj(path, "*.tif"))))
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def plan_blk_rows(rasters, overhead=4, n_workers=1, min_rows=1,
+                  budget=None, band_bytes=0, pixel_bytes=0):
+    """Number of rows of blocks for computations on rasters.
+
+    Blocks have the width of the rasters. The number of rows is the
+    largest one for which all the input rasters (all bands) and the
+    intermediate arrays fit in the memory budget. It is a multiple of
+    the internal block height of the GeoTIFFs (strips or tiles) so
+    that blocks are read at once, and each worker process gets at
+    least four blocks. Blocks have at least the internal block height
+    of the GeoTIFFs, whatever the budget.
+
+    The memory used by intermediate arrays is given either relative to
+    the input data (``overhead``) or in bytes per pixel of the block
+    (``band_bytes`` for each input band and ``pixel_bytes``), as
+    measured for the kernels of the engines (see ``block_memory`` in
+    ``engines.predict``, ``engines.window`` and
+    ``engines.validation``).
+
+    :param rasters: Input raster files or directories of rasters.
+    :param overhead: Memory used by intermediate arrays relative to
+        the input data.
+    :param n_workers: Number of blocks processed at the same time.
+    :param min_rows: Minimum number of rows (e.g. window size).
+    :param budget: Memory budget (in bytes). Default to
+        ``memory_budget()``.
+    :param band_bytes: Memory used by intermediate arrays per pixel
+        and input band (in bytes).
+    :param pixel_bytes: Memory used by intermediate arrays per pixel
+        (in bytes), whatever the number of input bands.
+
+    :return: Number of rows.
+
+    """
+    files = raster_files(rasters)
+    if budget is None:
+        budget = memory_budget()
+    nrow = 0
+    ncol = 0
+    row_bytes = 0
+    block_height = 1
+    for ifile in files:
+        r = gdal.Open(ifile)
+        nrow = max(nrow, r.RasterYSize)
+        ncol = max(ncol, r.RasterXSize)
+        for k in range(r.RasterCount):
+            band = r.GetRasterBand(k + 1)
+            nbytes = gdal.GetDataTypeSize(band.DataType) // 8
+            row_bytes += r.RasterXSize * (nbytes * (1 + overhead)
+                                          + band_bytes)
+        block_height = max(block_height,
+                           r.GetRasterBand(1).GetBlockSize()[1])
+        del r
+    if nrow == 0:
+        return max(128, min_rows)
+    row_bytes += ncol * pixel_bytes
+    rows = int(budget / max(1, n_workers) // row_bytes)
+    # Enough blocks for each worker
+    if n_workers > 1:
+        rows = min(rows, -(-nrow // (4 * n_workers)))
+    # Aligned on internal blocks, with at least one internal block
+    rows -= rows % block_height
+    rows = max(rows, block_height, min_rows, 1)
+    return min(rows, max(nrow, min_rows))
+
+# End of file
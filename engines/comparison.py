@@ -0,0 +1,94 @@
+"""Models without spatial random effects for model comparison."""
+
+import os
+import pickle
+
+import numpy as np
+from patsy.highlevel import dmatrices
+import joblib
+from sklearn.linear_model import LogisticRegression
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import log_loss
+
+# Alias
+opj = os.path.join
+
+# Models and output files
+MODELS = {"null": "mod_null.pickle",
+          "glm": "mod_glm.pickle",
+          "rf": "mod_rf.joblib"}
+
+
+def fit_model(name, formula, data, ofile, seed=1234, n_jobs=1):
+    """Fit and save one model.
+
+    Models are the null model (intercept only), a simple glm with no
+    spatial random effects and a random forest, fitted on the design
+    of the iCAR model (without the cell column).
+
+    :param name: Model name ("null", "glm" or "rf").
+    :param formula: Formula of the iCAR model.
+    :param data: Dataset with observations.
+    :param ofile: Output file for the model.
+    :param seed: Seed for the random forest.
+    :param n_jobs: Number of jobs for the random forest.
+
+    :return: Deviance of the model.
+
+    """
+    if name == "null":
+        y, x = dmatrices("I(1-fcc) ~ 1", data=data, NA_action="drop")
+        X = np.asarray(x)
+    else:
+        y, x = dmatrices(formula, data=data, NA_action="drop")
+        X = np.asarray(x)
+        # We remove the last column (cells), and the first one
+        # (intercept) for the random forest
+        X = X[:, 1:-1] if name == "rf" else X[:, :-1]
+    Y = np.asarray(y)[:, 0]
+    if name == "rf":
+        mod = RandomForestClassifier(n_estimators=50,
+                                     min_samples_leaf=2,
+                                     max_depth=15,
+                                     random_state=seed,
+                                     n_jobs=n_jobs)
+    else:
+        mod = LogisticRegression(solver="lbfgs")
+    mod = mod.fit(X, Y)
+    pred = mod.predict_proba(X)
+    with open(ofile, "wb") as file:
+        if name == "rf":
+            # Use joblib for persistence
+            # https://scikit-learn.org/stable/model_persistence.html
+            joblib.dump(mod, file, compress=True)
+        else:
+            pickle.dump(mod, file)
+    return 2 * log_loss(Y, pred, normalize=False)
+
+
+def submit_models(pool, formula, data, outdir, seed=1234):
+    """Fit the comparison models in parallel.
+
+    Each model is fitted in its own process of ``pool`` so that the
+    random forest can use all the cores without interfering with the
+    QGIS process (``n_jobs=-1``). Results are reproducible for a given
+    ``seed``.
+
+    :param pool: Process pool (see ``engines.pool.process_pool``).
+    :param outdir: Output directory for the models.
+
+    :return: Dictionary of futures returning the deviances, with
+        model names as keys.
+
+    """
+    # Workers do not share the working directory of the calling
+    # process, which may be changed by other tasks
+    outdir = os.path.abspath(outdir)
+    futures = {}
+    for (name, fname) in MODELS.items():
+        n_jobs = -1 if name == "rf" else 1
+        futures[name] = pool.submit(fit_model, name, formula, data,
+                                    opj(outdir, fname), seed, n_jobs)
+    return futures
+
+# End of file
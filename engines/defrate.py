@@ -0,0 +1,76 @@
+"""Deforestation rates per category of deforestation risk."""
+
+import numpy as np
+import pandas as pd
+
+# Number of categories of deforestation risk (1-65535, 0 for nodata)
+N_CAT = 65535
+
+
+def count_per_cat(defor_cat, fcc, period):
+    """Count forest and deforested pixels per category for one block.
+
+    Same counts as in ``far.defrate_per_cat``.
+
+    :param defor_cat: Array of categories of deforestation risk.
+    :param fcc: Array of forest cover change at three dates (123).
+    :param period: "calibration", "validation", "historical" or
+        "forecast".
+
+    :return: Array of shape (2, N_CAT + 1) with the number of forest
+        pixels (first row) and deforested pixels (second row) for
+        each category (column 0 is for nodata).
+
+    """
+    if period == "calibration":
+        data_for = defor_cat[fcc > 0]
+        data_defor = defor_cat[fcc == 1]
+    elif period == "validation":
+        data_for = defor_cat[fcc > 1]
+        data_defor = defor_cat[fcc == 2]
+    elif period in ["historical", "forecast"]:
+        data_for = defor_cat[fcc > 0]
+        data_defor = defor_cat[np.isin(fcc, [1, 2])]
+    else:
+        raise ValueError(f"Unknown period {period}")
+    counts = np.zeros((2, N_CAT + 1), dtype=np.int64)
+    counts[0] = np.bincount(data_for.ravel(), minlength=N_CAT + 1)
+    counts[1] = np.bincount(data_defor.ravel(), minlength=N_CAT + 1)
+    return counts
+
+
+def write_defrate_per_cat(counts, time_interval, pixel_area,
+                          tab_file_defrate):
+    """Write the table of deforestation rates per category.
+
+    The table is the same as the one of ``far.defrate_per_cat``.
+
+    :param counts: Counts from ``count_per_cat`` summed on blocks.
+    :param time_interval: Time interval (in years).
+    :param pixel_area: Pixel area (in ha).
+    :param tab_file_defrate: Path to the ``.csv`` output file.
+
+    """
+    cat = np.arange(1, N_CAT + 1)
+    df = pd.DataFrame({"cat": cat,
+                       "nfor": counts[0, 1:],
+                       "ndefor": counts[1, 1:]})
+    # Annual deforestation rates per category (just for info)
+    df["rate_obs"] = (1 - (1 - df["ndefor"] / df["nfor"])
+                      ** (1 / time_interval))
+    # Relative spatial deforestation probability from model
+    df["rate_mod"] = ((df["cat"] - 1) * 999999 / 65534 + 1) * 1e-6
+    # Correction factor ndefor / sum_i p_i
+    sum_ndefor = df["ndefor"].sum()
+    sum_pi = (df["nfor"] * df["rate_mod"]).sum()
+    correction_factor = sum_ndefor / sum_pi
+    # Absolute deforestation probability
+    df["rate_abs"] = df["rate_mod"] * correction_factor
+    df["time_interval"] = time_interval
+    df["pixel_area"] = pixel_area
+    # Deforestation density (ha/pixel/yr)
+    df["defor_dens"] = df["rate_abs"] * pixel_area / time_interval
+    df.to_csv(tab_file_defrate, sep=",", header=True,
+              index=False, index_label=False)
+
+# End of file
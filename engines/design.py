@@ -0,0 +1,122 @@
+"""Serializable design of the iCAR model.
+
+The patsy design info of the iCAR model (used to compute the design
+matrix for predictions) cannot be pickled. The design is saved as a
+JSON specification with the formula, the categorical levels and the
+state of the stateful transforms (e.g. means and variances of
+``scale()``), from which the design info is built again without the
+dataset.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+from patsy.highlevel import dmatrices
+from patsy.eval import ast_names
+
+
+def encode(value):
+    """Make a transform attribute JSON serializable.
+
+    Floats are written as strings with all their digits as patsy
+    uses extended precision (``np.longdouble``) for some states.
+    """
+    if isinstance(value, np.ndarray):
+        if np.issubdtype(value.dtype, np.floating):
+            data = [np.format_float_scientific(i, unique=True)
+                    for i in value.ravel()]
+        else:
+            data = value.ravel().tolist()
+        return {"array": data, "dtype": value.dtype.char,
+                "shape": list(value.shape)}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode(value):
+    """Decode a transform attribute."""
+    if isinstance(value, dict) and "array" in value:
+        arr = np.array(value["array"], dtype=value["dtype"])
+        return arr.reshape(value["shape"])
+    return value
+
+
+def design_spec(formula, dataset):
+    """Specification of the design of a model.
+
+    :param formula: Model formula.
+    :param dataset: Dataset used to fit the model.
+
+    :return: Dictionary with the formula, the variables, the levels of
+        categorical variables and the state of stateful transforms
+        for each factor.
+
+    """
+    y, x = dmatrices(formula, dataset, 0, "drop")
+    variables = set()
+    levels = {}
+    transforms = {}
+    factor_infos = list(y.design_info.factor_infos.items())
+    factor_infos += list(x.design_info.factor_infos.items())
+    for (factor, info) in factor_infos:
+        names = [i for i in ast_names(factor.code) if i in dataset.columns]
+        variables.update(names)
+        if info.type == "categorical":
+            if len(names) != 1:
+                raise ValueError("Categorical factors must depend on "
+                                 f"one variable ({factor.code})")
+            levels[names[0]] = [encode(i) for i in info.categories]
+        states = info.state.get("transforms", {})
+        if states:
+            transforms[factor.code] = {
+                key: {attr: encode(val) for (attr, val) in vars(obj).items()}
+                for (key, obj) in states.items()}
+    return {"formula": formula, "variables": sorted(variables),
+            "levels": levels, "transforms": transforms}
+
+
+def design_info_from_spec(spec):
+    """Build the design info of explicative variables from a spec.
+
+    The design info is built on a small artificial dataset with all
+    the categorical levels. The state of stateful transforms is then
+    set to the state memorized on the dataset used to fit the model.
+
+    :param spec: Specification from ``design_spec``.
+
+    :return: Patsy design info of the design matrix X.
+
+    """
+    levels = spec["levels"]
+    nrow = max([len(i) for i in levels.values()] + [2])
+    data = {}
+    for var in spec["variables"]:
+        if var in levels:
+            data[var] = [levels[var][i % len(levels[var])]
+                         for i in range(nrow)]
+        else:
+            data[var] = np.arange(nrow, dtype=np.float64)
+    _, x = dmatrices(spec["formula"], pd.DataFrame(data), 0, "drop")
+    for (factor, info) in x.design_info.factor_infos.items():
+        states = spec["transforms"].get(factor.code, {})
+        for (key, attrs) in states.items():
+            obj = info.state["transforms"][key]
+            for (attr, val) in attrs.items():
+                setattr(obj, attr, decode(val))
+    return x.design_info
+
+
+def save_design_spec(spec, ofile):
+    """Save the design specification in a JSON file."""
+    with open(ofile, "w", encoding="utf-8") as f:
+        json.dump(spec, f, indent=2)
+
+
+def load_design_spec(ifile):
+    """Load the design specification from a JSON file."""
+    with open(ifile, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# End of file
@@ -0,0 +1,265 @@
+"""Compute forest rasters from forest cover tiles."""
+
+import os
+import math
+from glob import glob
+from concurrent.futures import as_completed
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from .pool import process_pool
+
+# Alias
+opj = os.path.join
+
+# Creation options (same as forestatrisk)
+COPTS = ["COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=YES"]
+
+
+def get_aoi_extent(aoi_file, buff=5000):
+    """Get the extent of the area of interest with a buffer.
+
+    The extent is computed as in ``forestatrisk`` (buffer of 5 km,
+    rounded to the meter) so that forest rasters are aligned with the
+    other variables.
+
+    :param aoi_file: Path to the aoi vector file in projected
+        coordinates.
+    :param buff: Buffer around the extent (in m).
+
+    :return: The extent as a tuple (xmin, ymin, xmax, ymax).
+
+    """
+    ds = ogr.Open(aoi_file)
+    (xmin, xmax, ymin, ymax) = ds.GetLayer().GetExtent()
+    ds = None
+    extent = (math.floor(xmin - buff), math.floor(ymin - buff),
+              math.ceil(xmax + buff), math.ceil(ymax + buff))
+    return extent
+
+
+def warp_tiles(tiles_dir, proj, extent, temp_dir, res=30):
+    """Mosaic and reproject forest tiles as virtual rasters.
+
+    Tiles are mosaicked in ``forest.vrt`` and reprojected in a warped
+    virtual raster ``forest_proj.vrt``. No pixel is written to disk:
+    data are reprojected on the fly when blocks are read.
+
+    :param tiles_dir: Directory with ``forest_*.tif`` tiles.
+    :param proj: Projection definition (EPSG, PROJ.4, WKT).
+    :param extent: Extent (xmin, ymin, xmax, ymax) of output rasters.
+    :param temp_dir: Directory for virtual rasters.
+    :param res: Resolution (in m).
+
+    :return: Path to the warped virtual raster.
+
+    """
+    tif_files = sorted(glob(opj(tiles_dir, "forest_*.tif")))
+    if len(tif_files) == 0:
+        raise ValueError(f"No forest tiles in {tiles_dir}")
+    forest_vrt = opj(temp_dir, "forest.vrt")
+    ds = gdal.BuildVRT(forest_vrt, tif_files)
+    ds.FlushCache()
+    ds = None
+    proj_vrt = opj(temp_dir, "forest_proj.vrt")
+    param = gdal.WarpOptions(
+        format="VRT",
+        srcSRS="EPSG:4326",
+        dstSRS=proj,
+        outputBounds=extent,
+        targetAlignedPixels=True,
+        resampleAlg=gdal.GRA_NearestNeighbour,
+        xRes=res,
+        yRes=res,
+    )
+    ds = gdal.Warp(proj_vrt, forest_vrt, options=param)
+    ds.FlushCache()
+    ds = None
+    return proj_vrt
+
+
+def create_raster(ofile, ref_ds, dtype, nodata):
+    """Create a single band raster aligned on a reference dataset."""
+    drv = gdal.GetDriverByName("GTiff")
+    if os.path.isfile(ofile):
+        os.remove(ofile)
+    ds = drv.Create(ofile, ref_ds.RasterXSize, ref_ds.RasterYSize,
+                    1, dtype, COPTS)
+    ds.SetGeoTransform(ref_ds.GetGeoTransform())
+    ds.SetProjection(ref_ds.GetProjectionRef())
+    ds.GetRasterBand(1).SetNoDataValue(nodata)
+    return ds
+
+
+def rasterize_aoi_block(aoi_ds, gt, yoff, nx, ny):
+    """Rasterize the aoi layer on a block of rows."""
+    xmin = gt[0]
+    xmax = gt[0] + nx * gt[1]
+    ymax = gt[3] + yoff * gt[5]
+    ymin = ymax + ny * gt[5]
+    ds = gdal.Rasterize(
+        "", aoi_ds, format="MEM",
+        layers="aoi",
+        outputBounds=[xmin, ymin, xmax, ymax],
+        width=nx, height=ny,
+        burnValues=[1], initValues=[0],
+        outputType=gdal.GDT_Byte)
+    aoi = ds.ReadAsArray()
+    ds = None
+    return aoi
+
+
+def fcc_code(forest_a, forest_b):
+    """Forest cover change between two dates.
+
+    1: forest, 0: deforested, 255: nodata (non-forest at first date).
+    Equivalent to ``255-254*(A==1)*(B==1)-255*(A==1)*(B==0)``.
+    """
+    fcc = np.full(forest_a.shape, 255, dtype=np.uint8)
+    fcc[(forest_a == 1) & (forest_b == 1)] = 1
+    fcc[(forest_a == 1) & (forest_b == 0)] = 0
+    return fcc
+
+
+def compute_distance_band(band, dist_file, ref_ds):
+    """Distance to non-forest pixels (forest edge).
+
+    ``gdal.ComputeProximity`` processes the band scanline by
+    scanline, so memory use does not depend on raster size.
+    """
+    dst_ds = create_raster(dist_file, ref_ds, gdal.GDT_UInt32, 0)
+    dst_band = dst_ds.GetRasterBand(1)
+    gdal.ComputeProximity(
+        band, dst_band,
+        ["VALUES=0", "USE_INPUT_NODATA=YES", "DISTUNITS=GEO"])
+    dst_band.SetNoDataValue(0)
+    dst_band.FlushCache()
+    dst_band = None
+    dst_ds = None
+
+
+def compute_distance_file(src_file, band_index, dist_file):
+    """Distance to forest edge for one band of a raster file.
+
+    Used to compute distances for several dates in worker processes.
+    """
+    src_ds = gdal.Open(src_file)
+    compute_distance_band(src_ds.GetRasterBand(band_index),
+                          dist_file, src_ds)
+    src_ds = None
+
+
+def compute_forest_from_tiles(tiles_dir, aoi_file, proj, extent,
+                              output_dir="data", temp_dir="data_raw",
+                              blk_rows=256, callback=None, n_workers=1):
+    """Compute forest rasters from forest cover tiles.
+
+    Forest cover tiles are read block by block through a warped
+    virtual raster and forest rasters are directly written in the
+    output directory. Rasters and values are the same as the ones
+    computed with ``forestatrisk.data.compute.compute_forest``:
+
+    - ``forest_t{1,2,3}.tif``: forest (1) at each date, masked with aoi.
+    - ``fcc12.tif``, ``fcc13.tif``: forest cover change (1: forest,
+      0: deforested, 255: nodata).
+    - ``fcc123.tif``: sum of forest rasters (0: nodata).
+    - ``dist_edge_t{1,2,3}.tif``: distance to forest edge (in m).
+
+    :param tiles_dir: Directory with ``forest_*.tif`` tiles.
+    :param aoi_file: Path to the aoi vector file in projected
+        coordinates with layer "aoi".
+    :param proj: Projection definition (EPSG, PROJ.4, WKT).
+    :param extent: Extent (xmin, ymin, xmax, ymax) of output rasters.
+    :param output_dir: Output directory.
+    :param temp_dir: Directory for virtual rasters.
+    :param blk_rows: Number of rows per block.
+    :param callback: Function called with the progress (in [0, 1]).
+    :param n_workers: Number of worker processes to compute
+        distances to forest edge (one date per process).
+
+    """
+
+    # Warped virtual raster
+    proj_vrt = warp_tiles(tiles_dir, proj, extent, temp_dir)
+    src_ds = gdal.Open(proj_vrt)
+    nbands = src_ds.RasterCount
+    if nbands != 3:
+        raise ValueError("Three dates are needed to compute "
+                         f"forest rasters ({nbands} provided)")
+    ncol = src_ds.RasterXSize
+    nrow = src_ds.RasterYSize
+    gt = src_ds.GetGeoTransform()
+    aoi_ds = gdal.OpenEx(aoi_file, gdal.OF_VECTOR)
+
+    # Output rasters
+    out = {}
+    for i in range(3):
+        out[f"forest_t{i + 1}"] = create_raster(
+            opj(output_dir, f"forest_t{i + 1}.tif"),
+            src_ds, gdal.GDT_Byte, 255)
+    for fcc in ["fcc12", "fcc13"]:
+        out[fcc] = create_raster(opj(output_dir, f"{fcc}.tif"),
+                                 src_ds, gdal.GDT_Byte, 255)
+    out["fcc123"] = create_raster(opj(output_dir, "fcc123.tif"),
+                                  src_ds, gdal.GDT_Byte, 0)
+
+    # Steps: blocks then distances
+    nblock = int(np.ceil(nrow / blk_rows))
+    n_steps = nblock + 3
+
+    # Loop on blocks of rows
+    for b in range(nblock):
+        yoff = b * blk_rows
+        ny = min(blk_rows, nrow - yoff)
+        data = src_ds.ReadAsArray(0, yoff, ncol, ny)
+        aoi = rasterize_aoi_block(aoi_ds, gt, yoff, ncol, ny)
+        inside = aoi == 1
+        # Forest masked with aoi
+        forest = [data[i] * aoi for i in range(3)]
+        for i in range(3):
+            band = out[f"forest_t{i + 1}"].GetRasterBand(1)
+            band.WriteArray(forest[i], 0, yoff)
+        # fcc12 masked with aoi
+        fcc12 = np.where(inside, fcc_code(data[0], data[1]), 255)
+        out["fcc12"].GetRasterBand(1).WriteArray(
+            fcc12.astype(np.uint8), 0, yoff)
+        # fcc13 from masked forest
+        fcc13 = fcc_code(forest[0], forest[2])
+        out["fcc13"].GetRasterBand(1).WriteArray(fcc13, 0, yoff)
+        # fcc123
+        fcc123 = forest[0] + forest[1] + forest[2]
+        out["fcc123"].GetRasterBand(1).WriteArray(
+            fcc123.astype(np.uint8), 0, yoff)
+        if callback:
+            callback((b + 1) / n_steps)
+
+    # Close output rasters
+    for ds in out.values():
+        ds.FlushCache()
+    out = None
+    aoi_ds = None
+
+    # Distance to forest edge (computed without aoi mask)
+    dist_files = [opj(output_dir, f"dist_edge_t{i + 1}.tif")
+                  for i in range(3)]
+    if n_workers > 1:
+        src_ds = None
+        args = [(os.path.abspath(proj_vrt), i + 1,
+                 os.path.abspath(dist_files[i])) for i in range(3)]
+        with process_pool(min(n_workers, 3)) as pool:
+            futures = [pool.submit(compute_distance_file, *i)
+                       for i in args]
+            for (k, future) in enumerate(as_completed(futures)):
+                future.result()
+                if callback:
+                    callback((nblock + k + 1) / n_steps)
+    else:
+        for i in range(3):
+            compute_distance_band(src_ds.GetRasterBand(i + 1),
+                                  dist_files[i], src_ds)
+            if callback:
+                callback((nblock + i + 1) / n_steps)
+        src_ds = None
+
+# End of file
@@ -0,0 +1,307 @@
+"""Parallel MCMC chains for the binomial iCAR model."""
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from patsy.highlevel import dmatrices
+from sklearn.linear_model import LogisticRegression
+import forestatrisk as far
+
+# Convergence criteria
+RHAT_MAX = 1.01
+ESS_MIN = 400
+
+# Burn-in of the first round relative to the number of samples
+BURNIN_START = 0.25
+
+
+def autocov(x):
+    """Autocovariance of a chain (computed with FFT)."""
+    n = len(x)
+    x = x - np.mean(x)
+    f = np.fft.rfft(x, n=2 * n)
+    acov = np.fft.irfft(f * np.conjugate(f))[:n] / n
+    return acov
+
+
+def rhat(chains):
+    """Split R-hat of one parameter.
+
+    :param chains: Array of shape (nchain, ndraw).
+
+    :return: Potential scale reduction factor computed on chains
+        split in two halves (Gelman et al. 2013).
+
+    """
+    ndraw = chains.shape[1]
+    half = ndraw // 2
+    split = np.concatenate(
+        [chains[:, :half], chains[:, ndraw - half:]], axis=0)
+    within = np.mean(np.var(split, axis=1, ddof=1))
+    between = half * np.var(np.mean(split, axis=1), ddof=1)
+    if within == 0:
+        return np.nan
+    var_plus = (half - 1) / half * within + between / half
+    return np.sqrt(var_plus / within)
+
+
+def ess(chains):
+    """Effective sample size of one parameter.
+
+    Multi-chain autocorrelations are truncated with Geyer's initial
+    monotone sequence estimator (as in Stan).
+
+    :param chains: Array of shape (nchain, ndraw).
+
+    :return: Effective sample size.
+
+    """
+    (nchain, ndraw) = chains.shape
+    acov = np.array([autocov(chain) for chain in chains])
+    chain_mean = np.mean(chains, axis=1)
+    mean_var = np.mean(acov[:, 0]) * ndraw / (ndraw - 1)
+    var_plus = mean_var * (ndraw - 1) / ndraw
+    if nchain > 1:
+        var_plus += np.var(chain_mean, ddof=1)
+    if var_plus == 0:
+        return np.nan
+    rho_hat = 1 - (mean_var - np.mean(acov, axis=0)) / var_plus
+    rho_hat[0] = 1
+    # Sum of consecutive pairs while positive
+    pairs = []
+    for k in range((ndraw - 1) // 2):
+        pair = rho_hat[2 * k] + rho_hat[2 * k + 1]
+        if pair <= 0:
+            break
+        pairs.append(pair)
+    # Monotone sequence
+    pairs = np.minimum.accumulate(pairs)
+    tau = max(-1 + 2 * np.sum(pairs), 1 / np.log10(nchain * ndraw))
+    return nchain * ndraw / tau
+
+
+def diagnostics(samples):
+    """Convergence diagnostics for all parameters.
+
+    :param samples: Array of shape (nchain, ndraw, npar).
+
+    :return: Tuple of arrays (rhat, ess) of length npar.
+
+    """
+    npar = samples.shape[2]
+    rhats = np.array([rhat(samples[:, :, i]) for i in range(npar)])
+    esss = np.array([ess(samples[:, :, i]) for i in range(npar)])
+    return (rhats, esss)
+
+
+def dispersed_starts(x_arr, y_arr, beta_start, n_chains, seed,
+                     dispersion=0.5):
+    """Dispersed starting values for betas and Vrho.
+
+    The first chain starts from ``beta_start`` (or from logistic
+    regression estimates if ``beta_start`` is -99). Other chains start
+    from random values around it.
+    """
+    npar = x_arr.shape[1]
+    if np.size(beta_start) == 1 and beta_start == -99:
+        mod_lr = LogisticRegression(solver="lbfgs")
+        mod_lr = mod_lr.fit(x_arr, y_arr)
+        center = np.ravel(mod_lr.coef_)
+    elif np.size(beta_start) == 1:
+        center = np.ones(npar) * beta_start
+    else:
+        center = np.asarray(beta_start, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    beta_starts = [center]
+    vrho_starts = [1.0]
+    for _ in range(1, n_chains):
+        noise = rng.normal(0, dispersion, npar) * (np.abs(center) + 1)
+        beta_starts.append(center + noise)
+        vrho_starts.append(float(np.exp(rng.normal(0, 1))))
+    return (beta_starts, vrho_starts)
+
+
+def run_icar_chain(formula, data, n_neighbors, neighbors, prior_vrho,
+                   burnin, mcmc, thin, beta_start, vrho_start, seed):
+    """Run one chain of the binomial iCAR model.
+
+    :return: Dictionary with MCMC samples ("mcmc", columns betas,
+        Vrho and Deviance) and posterior means of spatial random
+        effects ("rho").
+
+    """
+    mod = far.model_binomial_iCAR(
+        suitability_formula=formula, data=data,
+        n_neighbors=n_neighbors, neighbors=neighbors,
+        priorVrho=prior_vrho,
+        burnin=burnin, mcmc=mcmc, thin=thin,
+        beta_start=beta_start, Vrho_start=vrho_start,
+        seed=seed, verbose=0)
+    return {"mcmc": mod.mcmc, "rho": mod.rho}
+
+
+class IcarChains:
+    """Binomial iCAR model estimated with several chains.
+
+    Attributes are the same as for ``far.model_binomial_iCAR``
+    (``suitability_formula``, ``mcmc``, ``betas``, ``Vrho``,
+    ``deviance``, ``rho``) with samples of all chains pooled. The
+    attributes ``chains``, ``rhat``, ``ess``, ``burnin`` (burn-in of
+    the chains), ``total_burnin`` (burn-in of all the rounds, see
+    ``fit_icar_chains``) and ``converged`` give the convergence
+    diagnostics.
+    """
+
+    def __init__(self, formula, y_name, x_name, varnames, chains, rho,
+                 burnin, total_burnin, converged):
+        self.suitability_formula = formula
+        self.y_name = y_name
+        self.x_name = x_name
+        self.varnames = list(varnames) + ["Vrho", "Deviance"]
+        self.chains = chains
+        self.mcmc = chains.reshape(-1, chains.shape[2])
+        posterior_means = np.mean(self.mcmc, axis=0)
+        self.betas = posterior_means[:-2]
+        self.Vrho = posterior_means[-2]
+        self.deviance = posterior_means[-1]
+        self.rho = rho
+        (self.rhat, self.ess) = diagnostics(chains)
+        self.burnin = burnin
+        self.total_burnin = total_burnin
+        self.converged = converged
+
+    def __repr__(self):
+        """Summary with R-hat and effective sample sizes."""
+        summary = (
+            "Binomial logistic regression with iCAR process\n"
+            f"  Model: {self.y_name} ~ {self.x_name}\n"
+            f"  Chains: {self.chains.shape[0]}, "
+            f"burn-in: {self.burnin} (total {self.total_burnin}), "
+            f"samples per chain: {self.chains.shape[1]}, "
+            f"converged: {self.converged}\n"
+            "  Posteriors:\n"
+        )
+        name_width = max(len(x) for x in self.varnames)
+        post_mean = np.mean(self.mcmc, axis=0)
+        post_std = np.std(self.mcmc, axis=0)
+        ci_low = np.percentile(self.mcmc, 2.5, axis=0)
+        ci_high = np.percentile(self.mcmc, 97.5, axis=0)
+        summary += (f"%{name_width}s %10s %10s %10s %10s %10s %10s\n") % (
+            "", "Mean", "Std", "CI_low", "CI_high", "Rhat", "ESS")
+        for (i, varname) in enumerate(self.varnames):
+            summary += (f"%{name_width}s %10.3g %10.3g %10.3g %10.3g "
+                        "%10.3f %10.0f\n") % (
+                varname, post_mean[i], post_std[i], ci_low[i],
+                ci_high[i], self.rhat[i], self.ess[i])
+        return summary
+
+    def plot(self, output_file="mcmc.pdf", plots_per_page=5,
+             figsize=(8.27, 11.69), dpi=100):
+        """Plot traces (one color per chain) and posteriors."""
+        posterior_means = np.mean(self.mcmc, axis=0)
+        pdf_pages = PdfPages(output_file)
+        nb_plots = len(self.varnames)
+        figures = []
+        for i in range(nb_plots):
+            if i % plots_per_page == 0:
+                fig = plt.figure(figsize=figsize, dpi=dpi)
+                gs = fig.add_gridspec(plots_per_page, 2)
+            irow = i % plots_per_page
+            ax1 = fig.add_subplot(gs[irow, 0])
+            for chain in self.chains:
+                ax1.plot(chain[:, i], linewidth=0.5, alpha=0.7)
+            ax1.axhline(y=posterior_means[i], linewidth=1, color="r")
+            ax1.text(0, 1, f"{self.varnames[i]} "
+                     f"(Rhat={self.rhat[i]:.3f})",
+                     horizontalalignment="left",
+                     verticalalignment="bottom",
+                     fontsize=11, transform=ax1.transAxes)
+            ax2 = fig.add_subplot(gs[irow, 1])
+            ax2.hist(self.mcmc[:, i], density=1, bins=20, color="#808080")
+            ax2.axvline(x=posterior_means[i], linewidth=1, color="r")
+            if (i + 1) % plots_per_page == 0 or (i + 1) == nb_plots:
+                fig.tight_layout()
+                figures.append(fig)
+                pdf_pages.savefig(fig)
+        pdf_pages.close()
+        return figures
+
+
+def fit_icar_chains(pool, formula, data, n_neighbors, neighbors,
+                    prior_vrho, mcmc, thin, beta_start, n_chains,
+                    burnin_max, burnin_start=None, seed=1234,
+                    rhat_max=RHAT_MAX, ess_min=ESS_MIN,
+                    is_canceled=None):
+    """Fit the binomial iCAR model with parallel chains.
+
+    Chains start from dispersed values and are run in parallel in
+    ``pool`` with a short burn-in of ``burnin_start`` iterations. The
+    fit stops at the first round where chains have converged (split
+    R-hat below ``rhat_max`` and effective sample size above
+    ``ess_min`` for all parameters).
+
+    Otherwise, chains are run again with a doubled burn-in. As
+    ``far.model_binomial_iCAR`` always starts spatial random effects
+    from zero, rounds are independent runs, only warm-started with
+    the betas and Vrho of the last samples of the previous round, and
+    samples of previous rounds are discarded. The burn-in of each
+    round must then be sufficient on its own: a round is run only if
+    its burn-in is longer than the burn-in of the previous round and
+    if the total burn-in of all the rounds does not exceed
+    ``burnin_max``.
+
+    :param pool: Process pool (see ``engines.pool.process_pool``).
+    :param burnin_max: Maximal total burn-in of all the rounds.
+    :param burnin_start: Burn-in of the first round (defaults to
+        ``BURNIN_START * mcmc``).
+    :param is_canceled: Function returning True to stop the fit.
+
+    :return: An ``IcarChains`` object, or None if canceled. Samples
+        and spatial random effects are those of the last round.
+
+    """
+    # Design matrices for starting values and variable names
+    y, x = dmatrices(formula, data, 0, "drop")
+    x_arr = np.asarray(x)[:, :-1]
+    y_arr = np.asarray(y)[:, 0]
+    (beta_starts, vrho_starts) = dispersed_starts(
+        x_arr, y_arr, beta_start, n_chains, seed)
+    if burnin_start is None:
+        burnin_start = max(1, int(BURNIN_START * mcmc))
+    burnin = min(burnin_start, burnin_max)
+    total_burnin = 0
+    n_round = 0
+    while True:
+        futures = [
+            pool.submit(run_icar_chain, formula, data, n_neighbors,
+                        neighbors, prior_vrho, burnin, mcmc, thin,
+                        beta_starts[c], vrho_starts[c],
+                        seed + c + 100 * n_round)
+            for c in range(n_chains)]
+        results = [future.result() for future in futures]
+        if is_canceled is not None and is_canceled():
+            return None
+        total_burnin += burnin
+        chains = np.stack([res["mcmc"] for res in results])
+        (rhats, esss) = diagnostics(chains)
+        converged = bool(np.all(rhats < rhat_max)
+                         and np.all(esss >= ess_min))
+        next_burnin = min(2 * burnin, burnin_max - total_burnin)
+        if converged or next_burnin <= burnin:
+            break
+        # Next round is warm-started with the last samples of betas
+        # and Vrho
+        burnin = next_burnin
+        beta_starts = [chain[-1, :-2] for chain in chains]
+        vrho_starts = [float(chain[-1, -2]) for chain in chains]
+        n_round += 1
+    rho = np.mean([res["rho"] for res in results], axis=0)
+    return IcarChains(
+        formula=formula,
+        y_name=y.design_info.describe(),
+        x_name=x.design_info.describe(),
+        varnames=x.design_info.column_names[:-1],
+        chains=chains, rho=rho, burnin=burnin,
+        total_burnin=total_burnin, converged=converged)
+
+# End of file
@@ -0,0 +1,113 @@
+"""Neighborhood of spatial cells for the iCAR model."""
+
+import os
+
+import numpy as np
+from osgeo import gdal
+
+# Alias
+opj = os.path.join
+
+
+def raster_geometry(raster):
+    """Get raster size and geotransform.
+
+    :return: Array (ncol, nrow, gt[0], ..., gt[5]).
+
+    """
+    r = gdal.Open(raster)
+    geometry = np.array([r.RasterXSize, r.RasterYSize]
+                        + list(r.GetGeoTransform()), dtype=np.float64)
+    del r
+    return geometry
+
+
+def grid_shape(geometry, csize):
+    """Number of rows and columns of spatial cells.
+
+    Computed as in ``far.cellneigh``.
+
+    :param geometry: Raster geometry (see ``raster_geometry``).
+    :param csize: Spatial cell size (in km).
+
+    :return: Tuple (nrow, ncol).
+
+    """
+    (ncol_r, nrow_r) = geometry[:2]
+    gt = geometry[2:]
+    xmin = gt[0]
+    xmax = gt[0] + gt[1] * ncol_r
+    ymin = gt[3] + gt[5] * nrow_r
+    ymax = gt[3]
+    csize = csize * 1000  # Transform km in m
+    ncol = int(np.ceil((xmax - xmin) / csize))
+    nrow = int(np.ceil((ymax - ymin) / csize))
+    return (nrow, ncol)
+
+
+def compute_cellneigh(nrow, ncol, rank=1):
+    """Compute number of neighbors and adjacent cells.
+
+    Vectorized version of ``far.cellneigh`` giving the same arrays
+    (adjacent cells are ordered by row, then by column, for each
+    cell).
+
+    :return: Tuple (nneigh, adj).
+
+    """
+    around = np.arange(-rank, rank + 1)
+    (di, dj) = np.meshgrid(around, around, indexing="ij")
+    center = (di == 0) & (dj == 0)
+    di = di[~center]
+    dj = dj[~center]
+    rows = np.arange(nrow)[:, None, None]
+    cols = np.arange(ncol)[None, :, None]
+    # Valid neighbors, shape (nrow, ncol, noffsets)
+    valid = ((rows + di >= 0) & (rows + di < nrow)
+             & (cols + dj >= 0) & (cols + dj < ncol))
+    nneigh = valid.sum(axis=2).ravel().astype(np.int64)
+    neigh = (rows + di) * ncol + (cols + dj)
+    adj = neigh[valid].astype(np.int64)
+    return (nneigh, adj)
+
+
+def cellneigh(raster, csize=10, rank=1, cache_file=None):
+    """Compute number of spatial cells and neighbors with a cache.
+
+    Arrays are saved in a compressed hidden ``.npz`` file next to the
+    raster with the raster geometry, the cell size and the rank. They are
+    loaded at the next call if the raster geometry, ``csize`` and
+    ``rank`` have not changed.
+
+    :param raster: Path to raster file to compute region.
+    :param csize: Spatial cell size (in km).
+    :param rank: Rank of the neighborhood (1 for chess king's move).
+    :param cache_file: Path to the cache file. Default to
+        ``.cellneigh_{csize}km.npz`` in the raster directory.
+
+    :return: Tuple (nneigh, adj).
+
+    """
+    if cache_file is None:
+        cache_file = opj(os.path.dirname(raster),
+                         f".cellneigh_{csize:g}km.npz")
+    geometry = raster_geometry(raster)
+    key = np.concatenate([geometry, [csize, rank]])
+    # Load cached arrays if still valid
+    if os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as cached:
+                if np.array_equal(cached["key"], key):
+                    return (cached["nneigh"], cached["adj"])
+        except (OSError, ValueError, KeyError):
+            pass
+    # Compute and save arrays
+    (nrow, ncol) = grid_shape(geometry, csize)
+    (nneigh, adj) = compute_cellneigh(nrow, ncol, rank)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez_compressed(f, key=key, nneigh=nneigh, adj=adj)
+    os.replace(tmp_file, cache_file)
+    return (nneigh, adj)
+
+# End of file
@@ -0,0 +1,55 @@
+"""Process pool usable from QGIS."""
+
+import os
+import sys
+import shutil
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+# Alias
+opj = os.path.join
+
+
+def python_executable():
+    """Get the Python interpreter to start worker processes.
+
+    Within QGIS, ``sys.executable`` is the QGIS executable and not
+    the Python interpreter. The interpreter is searched for in the
+    Python installation used by QGIS.
+    """
+    exe = sys.executable
+    if exe and os.path.basename(exe).lower().startswith("python"):
+        return exe
+    version = f"{sys.version_info.major}.{sys.version_info.minor}"
+    candidates = [
+        opj(sys.exec_prefix, "python.exe"),
+        opj(sys.exec_prefix, "bin", f"python{version}"),
+        opj(sys.exec_prefix, "bin", "python3"),
+    ]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which("python3") or exe
+
+
+def process_pool(n_workers, initializer=None, initargs=()):
+    """Get a pool of processes started with the "spawn" method.
+
+    Processes are spawned (and not forked) as QGIS and GDAL are not
+    fork-safe. Functions run in the pool must be importable without
+    QGIS (see the ``engines`` package).
+
+    :param n_workers: Number of worker processes.
+    :param initializer: Function called at the start of each worker.
+    :param initargs: Arguments of the initializer.
+
+    :return: A ``concurrent.futures.ProcessPoolExecutor``.
+
+    """
+    ctx = mp.get_context("spawn")
+    ctx.set_executable(python_executable())
+    n_workers = max(1, min(int(n_workers), os.cpu_count() or 1))
+    return ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                               initializer=initializer, initargs=initargs)
+
+# End of file
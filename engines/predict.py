@@ -0,0 +1,313 @@
+"""Block-parallel prediction of the deforestation probability."""
+
+import os
+import pickle
+import uuid
+from glob import glob
+from concurrent.futures import as_completed
+
+import numpy as np
+from osgeo import gdal
+import pandas as pd
+from patsy.build import build_design_matrices
+import joblib
+
+from .pool import process_pool
+from .defrate import count_per_cat
+from .design import design_info_from_spec
+
+# Alias
+opj = os.path.join
+
+# Creation options (same as forestatrisk)
+COPTS = ["COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=YES"]
+
+# Memory used by predict_block (bytes per pixel of the block, measured
+# with tracemalloc): per band of the variable stack (float64 copy,
+# masks, data frame and design matrix), per pixel (coordinates and
+# masks) and per model (probabilities and rescaled values)
+BAND_BYTES = 33
+PIXEL_BYTES = 48
+MODEL_BYTES = 24
+
+# State of the worker process (see init_worker)
+_STATE = {}
+
+
+def invlogit(x):
+    """Inverse-logit avoiding under/overflow."""
+    return np.where(x > 0, 1.0 / (1.0 + np.exp(-np.abs(x))),
+                    np.exp(-np.abs(x)) / (1.0 + np.exp(-np.abs(x))))
+
+
+def rescale(value):
+    """Rescale probabilities to integer values in [1, 65535].
+
+    Same as ``far.misc.rescale``, 0 being the nodata value.
+    """
+    value = np.maximum(value, 1e-06)
+    return np.int_(((value * 1e6 - 1) * 65534 / 999999) + 1)
+
+
+def raster_stack(var_dir, forest_raster, cell_raster=None):
+    """Virtual raster with variables as bands.
+
+    The stack is aligned on the forest raster as in
+    ``far.predict_raster``. The raster of spatial random effects
+    (``cell_raster``) is added as the last band if provided.
+
+    :return: Tuple (stack dataset, band names, nodata values).
+
+    """
+    raster_list = sorted(glob(opj(var_dir, "*.tif")))
+    if cell_raster is not None:
+        raster_list.append(cell_raster)
+    names = [os.path.basename(i).split(".")[0] for i in raster_list]
+    fmask = gdal.Open(forest_raster)
+    gt = fmask.GetGeoTransform()
+    ncol = fmask.RasterXSize
+    nrow = fmask.RasterYSize
+    del fmask
+    param = gdal.BuildVRTOptions(
+        resolution="user",
+        outputBounds=(gt[0], gt[3] + gt[5] * nrow,
+                      gt[0] + gt[1] * ncol, gt[3]),
+        xRes=gt[1], yRes=-gt[5],
+        separate=True)
+    vrt_file = f"/vsimem/var_{uuid.uuid4()}.vrt"
+    gdal.BuildVRT(vrt_file, raster_list, options=param)
+    stack = gdal.Open(vrt_file)
+    nodata = []
+    for k in range(stack.RasterCount):
+        nd = stack.GetRasterBand(k + 1).GetNoDataValue()
+        if nd is None or np.isnan(nd):
+            raise ValueError("NoData value is not specified for "
+                             f"input raster file {raster_list[k]}")
+        nodata.append(nd)
+    return (stack, names, np.array(nodata, dtype=np.float32))
+
+
+def load_model(model, model_file):
+    """Load a model.
+
+    :return: Betas for "icar", the scikit-learn model otherwise.
+
+    """
+    with open(model_file, "rb") as file:
+        if model == "icar":
+            return pickle.load(file)["betas"]
+        if model == "glm":
+            return pickle.load(file)
+        mod = joblib.load(file)
+    # One job per worker, parallelism is done with blocks
+    mod.n_jobs = 1
+    return mod
+
+
+def init_worker(models, spec, var_dir, forest_raster,
+                cell_raster=None, fcc_raster=None, period=None):
+    """Initialize a worker process.
+
+    The design info from patsy cannot be pickled. It is built in each
+    worker from the design specification of the models (see
+    ``engines.design``). Models and rasters are opened once per
+    worker.
+
+    :param models: Dictionary of model files with model names ("icar",
+        "glm" or "rf") as keys (``mod_icar.pickle`` for "icar").
+    :param spec: Design specification of the iCAR model.
+    :param var_dir: Directory with rasters of explicative variables.
+    :param forest_raster: Forest raster (1 for forest).
+    :param cell_raster: Raster of spatial random effects for "icar".
+    :param fcc_raster: Raster of forest cover change (123) to count
+        pixels per category of deforestation risk (see
+        ``engines.defrate``).
+    :param period: Period for counts.
+
+    """
+    x_design_info = design_info_from_spec(spec)
+    mods = {model: load_model(model, model_file)
+            for (model, model_file) in models.items()}
+    with_rho = "icar" in mods
+    (stack, names, nodata) = raster_stack(
+        var_dir, forest_raster, cell_raster if with_rho else None)
+    fmask = gdal.Open(forest_raster)
+    fcc = gdal.Open(fcc_raster) if fcc_raster is not None else None
+    _STATE.clear()
+    _STATE.update({
+        "mods": mods, "x_design_info": x_design_info,
+        "stack": stack, "names": names, "nodata": nodata,
+        "with_rho": with_rho,
+        "fmask": fmask, "gt": fmask.GetGeoTransform(),
+        "fcc": fcc, "period": period})
+
+
+def predict_block(x_off, y_off, nx, ny):
+    """Predict the probability of deforestation for one block.
+
+    Variables are read and the design matrix is computed once for
+    all the models.
+
+    :return: Tuple (x_off, y_off, dictionary of arrays of rescaled
+        probabilities, dictionary of counts per category or None).
+
+    """
+    st = _STATE
+    gt = st["gt"]
+    data = st["stack"].ReadAsArray(x_off, y_off, nx, ny)
+    data = data.astype(np.float64).reshape(len(st["names"]), ny * nx)
+    # Nodata values are replaced with -9999 in forestatrisk
+    band_valid = (data != st["nodata"][:, None]) & (data != -9999)
+    fmask = st["fmask"].GetRasterBand(1).ReadAsArray(x_off, y_off, nx, ny)
+    fmask = fmask.ravel() == 1
+    # Spatial random effects (last band) are only used by "icar"
+    nvar = len(st["names"]) - 1 if st["with_rho"] else len(st["names"])
+    valid = np.all(band_valid[:nvar], axis=0) & fmask
+    preds = {model: np.zeros(ny * nx, dtype=np.uint16)
+             for model in st["mods"]}
+    if np.any(valid):
+        df = pd.DataFrame(data[:, valid].T, columns=st["names"])
+        # Coordinates of the center of the pixels
+        (rows, cols) = np.divmod(np.flatnonzero(valid), nx)
+        df["X"] = gt[0] + (x_off + cols + 0.5) * gt[1]
+        df["Y"] = gt[3] + (y_off + rows + 0.5) * gt[5]
+        # Fake "cell" column for the design info
+        df["cell"] = 0
+        (x_new,) = build_design_matrices([st["x_design_info"]], df)
+        x_new = np.asarray(x_new)
+        for (model, mod) in st["mods"].items():
+            if model == "icar":
+                rho_valid = band_valid[-1][valid]
+                prob = invlogit(np.dot(x_new[rho_valid, :-1], mod)
+                                + df["rho"].to_numpy()[rho_valid])
+                idx = np.flatnonzero(valid)[rho_valid]
+            else:
+                if model == "glm":
+                    prob = mod.predict_proba(x_new[:, :-1])[:, 1]
+                else:
+                    prob = mod.predict_proba(x_new[:, 1:-1])[:, 1]
+                idx = np.flatnonzero(valid)
+            preds[model][idx] = rescale(prob)
+    preds = {model: pred.reshape(ny, nx) for (model, pred) in preds.items()}
+    # Counts per category while the block is in memory
+    counts = None
+    if st["fcc"] is not None:
+        fcc = st["fcc"].GetRasterBand(1).ReadAsArray(x_off, y_off, nx, ny)
+        counts = {model: count_per_cat(pred, fcc, st["period"])
+                  for (model, pred) in preds.items()}
+    return (x_off, y_off, preds, counts)
+
+
+def block_memory(n_models):
+    """Memory used by ``predict_block`` (see ``plan_blk_rows``)."""
+    return {"overhead": 0, "band_bytes": BAND_BYTES,
+            "pixel_bytes": PIXEL_BYTES + MODEL_BYTES * n_models}
+
+
+def make_blocks(ncol, nrow, blk_rows):
+    """Row blocks (x_off, y_off, nx, ny) covering the raster."""
+    blk_rows = max(1, int(blk_rows))
+    return [(0, y_off, ncol, min(blk_rows, nrow - y_off))
+            for y_off in range(0, nrow, blk_rows)]
+
+
+def create_output(output_file, ref_ds):
+    """Create the output raster of probabilities."""
+    driver = gdal.GetDriverByName("GTiff")
+    if os.path.isfile(output_file):
+        os.remove(output_file)
+    out = driver.Create(output_file, ref_ds.RasterXSize,
+                        ref_ds.RasterYSize, 1, gdal.GDT_UInt16, COPTS)
+    out.SetGeoTransform(ref_ds.GetGeoTransform())
+    out.SetProjection(ref_ds.GetProjection())
+    out.GetRasterBand(1).SetNoDataValue(0)
+    return out
+
+
+def predict_raster(models, spec, var_dir, forest_raster, output_files,
+                   cell_raster=None,
+                   fcc_raster=None, period=None, counts=None,
+                   blk_rows=128, n_workers=1, is_canceled=None):
+    """Predict the spatial probability of deforestation by block.
+
+    This gives the same rasters as ``far.predict_raster`` and
+    ``far.predict_raster_binomial_iCAR``. Several models can be
+    predicted in one pass: each block of variables is read once and
+    all the models are evaluated on it. The raster is divided in
+    blocks of rows which are predicted in parallel by ``n_workers``
+    processes. Blocks are written to the output GeoTIFFs by the
+    calling process as soon as they are computed, as a compressed
+    GeoTIFF cannot be written concurrently.
+
+    If ``fcc_raster`` is given, forest and deforested pixels per
+    category of deforestation risk are counted on the fly (see
+    ``engines.defrate``), so that probability rasters do not need to
+    be read again to compute deforestation rates.
+
+    See ``init_worker`` for the models and input arguments.
+
+    :param output_files: Dictionary of output rasters of
+        probabilities (UInt16, 0 for nodata) with model names as keys.
+    :param counts: Dictionary of arrays of shape (2, N_CAT + 1) with
+        model names as keys, to which counts per category are added
+        (used with ``fcc_raster``).
+    :param blk_rows: Number of rows of each block.
+    :param n_workers: Number of worker processes. If 1, blocks are
+        predicted in the calling process.
+    :param is_canceled: Function returning True to stop predictions.
+
+    :return: True if predictions are complete, False if canceled.
+
+    """
+    # Workers do not share the working directory of the calling
+    # process, which may be changed by other tasks
+    models = {model: os.path.abspath(model_file)
+              for (model, model_file) in models.items()}
+    (var_dir, forest_raster) = map(os.path.abspath, (var_dir, forest_raster))
+    if cell_raster is not None:
+        cell_raster = os.path.abspath(cell_raster)
+    if fcc_raster is not None:
+        fcc_raster = os.path.abspath(fcc_raster)
+    initargs = (models, spec, var_dir, forest_raster,
+                cell_raster, fcc_raster, period)
+    fmask = gdal.Open(forest_raster)
+    ncol = fmask.RasterXSize
+    nrow = fmask.RasterYSize
+    outs = {model: create_output(output_files[model], fmask)
+            for model in models}
+    del fmask
+    bands = {model: out.GetRasterBand(1) for (model, out) in outs.items()}
+    blocks = make_blocks(ncol, nrow, blk_rows)
+    pool = None
+    if n_workers > 1 and len(blocks) > 1:
+        pool = process_pool(min(n_workers, len(blocks)),
+                            initializer=init_worker, initargs=initargs)
+        futures = [pool.submit(predict_block, *blk) for blk in blocks]
+        results = (future.result() for future in as_completed(futures))
+    else:
+        init_worker(*initargs)
+        results = (predict_block(*blk) for blk in blocks)
+    complete = True
+    try:
+        for (x_off, y_off, preds, blk_counts) in results:
+            if is_canceled is not None and is_canceled():
+                complete = False
+                break
+            for (model, pred) in preds.items():
+                bands[model].WriteArray(pred, x_off, y_off)
+                if counts is not None and blk_counts is not None:
+                    counts[model] += blk_counts[model]
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        else:
+            _STATE.clear()
+    if complete:
+        for band in bands.values():
+            band.FlushCache()
+            band.ComputeStatistics(False)
+    bands = None
+    outs = None
+    return complete
+
+# End of file
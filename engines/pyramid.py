@@ -0,0 +1,175 @@
+"""Aggregated (pyramid) levels of variables for preview runs.
+
+Each level is a working directory ``preview_{res}m`` inside the
+working directory, with a ``data`` folder of variables aggregated at
+a coarser resolution. Downstream stages run at this resolution when
+they are given the preview working directory instead of the
+working directory.
+
+Forest cover change is aggregated once, by decimation of
+``fcc123.tif`` (nearest neighbour), which keeps the proportions of
+forest and deforested pixels on average. The mode would remove most
+deforested pixels, deforestation being a minority class in almost
+every cell. Other forest rasters of the level are derived from the
+aggregated ``fcc123.tif`` so that all the forest rasters agree.
+"""
+
+import os
+import shutil
+
+import numpy as np
+from osgeo import gdal
+
+# Alias
+opj = os.path.join
+
+# Creation options (same as forestatrisk)
+COPTS = ["COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=YES"]
+
+# Categorical variables (aggregated with the mode)
+CATEGORICAL = ["pa"]
+
+# Forest rasters (aggregated by decimation)
+FOREST_PREFIXES = ["fcc", "forest"]
+
+# Forest rasters derived from fcc123 (0: nodata, 1: deforested on
+# t1-t2, 2: deforested on t2-t3, 3: forest at t3), with values
+# indexed by fcc123 values, as computed in
+# engines.forest.compute_forest_from_tiles (255: nodata)
+FROM_FCC123 = {
+    "forest_t1": [0, 1, 1, 1],
+    "forest_t2": [0, 0, 1, 1],
+    "forest_t3": [0, 0, 0, 1],
+    "fcc12": [255, 0, 1, 1],
+    "fcc13": [255, 0, 0, 1],
+}
+
+
+def preview_workdir(workdir, res=0):
+    """Working directory of a preview resolution.
+
+    :param workdir: Working directory.
+    :param res: Preview resolution (in m), 0 for full resolution.
+
+    :return: Working directory of the level, or ``workdir`` for full
+        resolution.
+
+    """
+    if not res:
+        return workdir
+    return opj(workdir, f"preview_{float(res):g}m")
+
+
+def resampling(raster_file):
+    """Resampling method to aggregate a raster.
+
+    Forest rasters are decimated (nearest neighbour), categorical
+    variables are aggregated with the most frequent value, and other
+    variables with the mean.
+    """
+    name = os.path.basename(raster_file).split(".")[0]
+    if any(name.startswith(i) for i in FOREST_PREFIXES):
+        return "near"
+    if name in CATEGORICAL:
+        return "mode"
+    return "average"
+
+
+def aggregate_raster(ifile, ofile, res):
+    """Aggregate a raster at a coarser resolution.
+
+    The output raster has the same origin and extent (rounded to the
+    new resolution) and the same nodata value as the input raster.
+    For rasters aggregated with the mode, nodata pixels are counted
+    as any other value, so that a cell with a few valid pixels is not
+    given the value of these pixels.
+    """
+    src = gdal.Open(ifile)
+    gt = src.GetGeoTransform()
+    bounds = (gt[0], gt[3] + gt[5] * src.RasterYSize,
+              gt[0] + gt[1] * src.RasterXSize, gt[3])
+    nodata = src.GetRasterBand(1).GetNoDataValue()
+    del src
+    alg = resampling(ifile)
+    nodata_opts = {}
+    if alg == "mode" and nodata is not None:
+        nodata_opts = {"srcNodata": "None", "dstNodata": "None",
+                       "warpOptions": [f"INIT_DEST={nodata:g}"]}
+    param = gdal.WarpOptions(
+        outputBounds=bounds, xRes=res, yRes=res,
+        resampleAlg=alg,
+        creationOptions=COPTS,
+        **nodata_opts)
+    gdal.Warp(ofile, ifile, options=param)
+    # Nodata value of the input raster
+    if nodata_opts:
+        out = gdal.Open(ofile, gdal.GA_Update)
+        out.GetRasterBand(1).SetNoDataValue(nodata)
+        out = None
+
+
+def derive_from_fcc123(fcc123_file, ofile, name, blk_rows=256):
+    """Derive a forest raster from an aggregated fcc123 raster.
+
+    :param fcc123_file: Raster of forest cover change (123).
+    :param ofile: Output raster.
+    :param name: Name of the forest raster (see ``FROM_FCC123``).
+    :param blk_rows: Number of rows of blocks.
+
+    """
+    lookup = np.full(256, 255, dtype=np.uint8)
+    lookup[:4] = FROM_FCC123[name]
+    src = gdal.Open(fcc123_file)
+    src_band = src.GetRasterBand(1)
+    (ncol, nrow) = (src.RasterXSize, src.RasterYSize)
+    driver = gdal.GetDriverByName("GTiff")
+    out = driver.Create(ofile, ncol, nrow, 1, gdal.GDT_Byte, COPTS)
+    out.SetGeoTransform(src.GetGeoTransform())
+    out.SetProjection(src.GetProjection())
+    band = out.GetRasterBand(1)
+    band.SetNoDataValue(255)
+    for y_off in range(0, nrow, blk_rows):
+        ny = min(blk_rows, nrow - y_off)
+        fcc123 = src_band.ReadAsArray(0, y_off, ncol, ny)
+        band.WriteArray(lookup[fcc123], 0, y_off)
+    band.FlushCache()
+    band = None
+    out = None
+    del src
+
+
+def build_level(data_dir, level_dir, res):
+    """Build one pyramid level of the variables.
+
+    Rasters (``*.tif``) of ``data_dir`` are aggregated at resolution
+    ``res`` in ``level_dir``, forest rasters of ``FROM_FCC123`` being
+    derived from the aggregated ``fcc123.tif``. Other files (e.g. the
+    area of interest) are copied. Hidden files (caches) are skipped.
+
+    :param data_dir: Directory with variables at full resolution.
+    :param level_dir: Output directory.
+    :param res: Resolution of the level (in m).
+
+    """
+    os.makedirs(level_dir, exist_ok=True)
+    names = sorted(os.listdir(data_dir))
+    with_fcc123 = "fcc123.tif" in names
+    derived = []
+    for name in names:
+        ifile = opj(data_dir, name)
+        if name.startswith(".") or not os.path.isfile(ifile):
+            continue
+        ofile = opj(level_dir, name)
+        if os.path.isfile(ofile):
+            os.remove(ofile)
+        if not name.endswith(".tif"):
+            shutil.copyfile(ifile, ofile)
+        elif with_fcc123 and name.split(".")[0] in FROM_FCC123:
+            derived.append(name)
+        else:
+            aggregate_raster(ifile, ofile, res)
+    for name in derived:
+        derive_from_fcc123(opj(level_dir, "fcc123.tif"),
+                           opj(level_dir, name), name.split(".")[0])
+
+# End of file
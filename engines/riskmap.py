@@ -0,0 +1,209 @@
+"""Risk maps and deforestation rates of the riskmapjnr models in one pass.
+
+The maps of the benchmark model (vulnerability classes) and of the
+moving window models (local deforestation rates set to 1 beyond the
+distance threshold) are computed by block. Forest and deforested
+pixels per category are counted while the block is in memory (see
+``engines.defrate``), so that the maps do not need to be read again
+to compute deforestation rates.
+"""
+
+import os
+
+import numpy as np
+from osgeo import gdal
+import pandas as pd
+
+from .defrate import count_per_cat
+from .predict import make_blocks
+
+# Creation options (same as riskmapjnr)
+COPTS = {"bm": ["COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=YES"],
+         "mw": ["COMPRESS=LZW", "PREDICTOR=2", "BIGTIFF=YES"]}
+
+# Maximal category of the benchmark model (class * 1000 + subj)
+N_CAT_BM = 30999
+
+
+def vulnerability_classes(forest, dist, subj, dist_bins):
+    """Vulnerability classes of the benchmark model for one block.
+
+    Same as ``riskmapjnr.benchmark.vulnerability_map``: distances to
+    forest edge are binned (first bin including its lower bound),
+    classes are reversed so that high values indicate high
+    vulnerability, class 1 is for distances beyond the threshold, and
+    the subjurisdiction is added (class * 1000 + subj).
+
+    :return: Array of categories (UInt16, 0 for nodata).
+
+    """
+    dist_bins = np.asarray(dist_bins, dtype=float)
+    n_classes = len(dist_bins) - 1
+    dist_thresh = dist_bins[-1]
+    label = np.digitize(dist, dist_bins, right=True) - 1
+    label[dist == dist_bins[0]] = 0
+    cat = n_classes + 1 - label.astype(np.int64)
+    # Distances outside the bins have no class (NaN in riskmapjnr)
+    beyond = dist > dist_thresh
+    cat[((dist < dist_bins[0]) | np.isnan(dist)) & ~beyond] = -1
+    cat[beyond] = 1
+    cat[forest == 0] = 0
+    cat = cat * 1000 + subj.astype(np.int64)
+    cat[cat <= 1000] = 0
+    return cat.astype(np.uint16)
+
+
+def set_cat_zero(ldefrate, dist, dist_thresh):
+    """Risk map of a moving window model for one block.
+
+    Same as ``riskmapjnr.set_defor_cat_zero``: local deforestation
+    rates are set to 1 beyond the distance threshold, and to 0
+    (nodata) out of forest.
+    """
+    cat = ldefrate.copy()
+    cat[(dist >= dist_thresh) & (cat != 0)] = 1
+    cat[dist == 0] = 0
+    return cat
+
+
+def riskmap_block(model, bands, params, x_off, y_off, nx, ny):
+    """Risk map of a riskmapjnr model for one block."""
+    data = [band.ReadAsArray(x_off, y_off, nx, ny) for band in bands]
+    if model == "bm":
+        (forest, dist, subj) = data
+        return vulnerability_classes(forest, dist.astype(float), subj,
+                                     params["dist_bins"])
+    (ldefrate, dist) = data
+    return set_cat_zero(ldefrate, dist, params["dist_thresh"])
+
+
+def riskmap_defrate(model, input_files, params, output_file, fcc_file,
+                    period, blk_rows=128, is_canceled=None):
+    """Compute the risk map and count pixels per category.
+
+    :param model: "bm" for the benchmark model, "mw" for moving
+        window models.
+    :param input_files: Input rasters: forest, distance to forest
+        edge and subjurisdictions for "bm", local deforestation rate
+        and distance to forest edge for "mw".
+    :param params: Dictionary with "dist_bins" for "bm" and
+        "dist_thresh" for "mw".
+    :param output_file: Output raster (UInt16, 0 for nodata).
+    :param fcc_file: Raster of forest cover change (123).
+    :param period: Period for counts (see ``count_per_cat``).
+    :param blk_rows: Number of rows of each block.
+    :param is_canceled: Function returning True to stop computations.
+
+    :return: Array of counts of shape (2, N_CAT + 1) (see
+        ``count_per_cat``), or None if canceled.
+
+    """
+    datasets = [gdal.Open(ifile) for ifile in input_files]
+    bands = [ds.GetRasterBand(1) for ds in datasets]
+    ref = datasets[0]
+    (ncol, nrow) = (ref.RasterXSize, ref.RasterYSize)
+    driver = gdal.GetDriverByName("GTiff")
+    if os.path.isfile(output_file):
+        os.remove(output_file)
+    out = driver.Create(output_file, ncol, nrow, 1, gdal.GDT_UInt16,
+                        COPTS[model])
+    out.SetProjection(datasets[1].GetProjection())
+    out.SetGeoTransform(datasets[1].GetGeoTransform())
+    out_band = out.GetRasterBand(1)
+    out_band.SetNoDataValue(0)
+    fcc_band = gdal.Open(fcc_file).GetRasterBand(1)
+    counts = None
+    for (x_off, y_off, nx, ny) in make_blocks(ncol, nrow, blk_rows):
+        if is_canceled is not None and is_canceled():
+            return None
+        cat = riskmap_block(model, bands, params, x_off, y_off, nx, ny)
+        out_band.WriteArray(cat, x_off, y_off)
+        fcc = fcc_band.ReadAsArray(x_off, y_off, nx, ny)
+        blk_counts = count_per_cat(cat, fcc, period)
+        counts = blk_counts if counts is None else counts + blk_counts
+    out_band.FlushCache()
+    out_band.ComputeStatistics(False)
+    out_band = None
+    out = None
+    return counts
+
+
+def pixel_area_ha(fcc_file):
+    """Pixel area (in ha)."""
+    gt = gdal.Open(fcc_file).GetGeoTransform()
+    return gt[1] * (-gt[5]) / 10000
+
+
+def write_bm_defrate_per_class(counts, time_interval, pixel_area,
+                               tab_file_defrate, deforate_model=None):
+    """Write the table of deforestation rates per vulnerability class.
+
+    The table is the same as the one of
+    ``riskmapjnr.benchmark.defrate_per_class``.
+
+    :param counts: Counts from ``riskmap_defrate``.
+    :param time_interval: Time interval (in years).
+    :param pixel_area: Pixel area (in ha).
+    :param tab_file_defrate: Path to the ``.csv`` output file.
+    :param deforate_model: Table of the model's period, for the
+        "validation" and "forecast" periods.
+
+    """
+    cat = np.arange(1, N_CAT_BM + 1)
+    df = pd.DataFrame({"cat": cat,
+                       "nfor": counts[0, 1:N_CAT_BM + 1],
+                       "ndefor": counts[1, 1:N_CAT_BM + 1]})
+    df = df[df["nfor"] != 0]
+    df["rate_obs"] = (1 - (1 - df["ndefor"] / df["nfor"])
+                      ** (1 / time_interval))
+    if deforate_model is not None:
+        df_mod = pd.read_csv(deforate_model)
+        df = df.merge(right=df_mod, on="cat", how="left",
+                      suffixes=(None, "_mod"))
+    else:
+        df["rate_mod"] = df["ndefor"] / df["nfor"]
+    sum_ndefor = df["ndefor"].sum()
+    sum_pi = (df["nfor"] * df["rate_mod"]).sum()
+    correction_factor = sum_ndefor / sum_pi
+    df["rate_abs"] = df["rate_mod"] * correction_factor
+    df["time_interval"] = time_interval
+    df["pixel_area"] = pixel_area
+    df["defor_dens"] = df["rate_abs"] * pixel_area / time_interval
+    df.to_csv(tab_file_defrate, sep=",", header=True,
+              index=False, index_label=False)
+
+
+def write_mw_defrate_per_cat(counts, time_interval, pixel_area,
+                             tab_file_defrate):
+    """Write the table of deforestation rates per category.
+
+    The table is the same as the one of
+    ``riskmapjnr.defrate_per_cat``, category 1 (beyond the distance
+    threshold) having a null probability.
+
+    :param counts: Counts from ``riskmap_defrate``.
+    :param time_interval: Time interval (in years).
+    :param pixel_area: Pixel area (in ha).
+    :param tab_file_defrate: Path to the ``.csv`` output file.
+
+    """
+    n_cat = counts.shape[1] - 1
+    cat = np.arange(1, n_cat + 1)
+    df = pd.DataFrame({"cat": cat,
+                       "nfor": counts[0, 1:],
+                       "ndefor": counts[1, 1:]})
+    df["time_interval"] = time_interval
+    df["rate_obs"] = (1 - (1 - df["ndefor"] / df["nfor"])
+                      ** (1 / time_interval))
+    df["rate_mod"] = ((df["cat"] - 2) * 999999 / 65533 + 1) * 1e-6
+    df.loc[df["cat"] == 1, "rate_mod"] = 0
+    sum_ndefor = df["ndefor"].sum()
+    sum_pi = (df["nfor"] * df["rate_mod"]).sum()
+    correction_factor = sum_ndefor / sum_pi
+    df["rate_abs"] = df["rate_mod"] * correction_factor
+    df["pixel_area"] = pixel_area
+    df["defor_dens"] = df["rate_abs"] * pixel_area / time_interval
+    df.to_csv(tab_file_defrate, sep=",", header=True,
+              index=False, index_label=False)
+
+# End of file
@@ -0,0 +1,100 @@
+"""Storage of sampled observations.
+
+Observations are stored in a Parquet file with typed columns
+(``sample.parquet``), which is faster and lighter to load than the
+CSV file written by ``far.sample``. The CSV file (``sample.txt``) can
+be exported for display in QGIS.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Alias
+opj = os.path.join
+
+# File names
+PARQUET_FILE = "sample.parquet"
+CSV_FILE = "sample.txt"
+
+# Integer columns
+INT_COLUMNS = ["fcc", "cell"]
+# Coordinates (kept in double precision)
+COORD_COLUMNS = ["X", "Y"]
+
+
+def typed_sample(dataset):
+    """Set column types of sampled observations.
+
+    Forest cover change and cell numbers are stored as integers
+    (nullable if there are missing values). Variables read from
+    rasters are stored in single precision when this is lossless.
+    """
+    dataset = dataset.copy()
+    for col in dataset.columns:
+        values = dataset[col]
+        if col in INT_COLUMNS:
+            dataset[col] = values.astype("Int32" if values.isna().any()
+                                         else np.int32)
+        elif (col not in COORD_COLUMNS
+              and pd.api.types.is_float_dtype(values)):
+            single = values.astype(np.float32)
+            if np.array_equal(single.to_numpy(np.float64),
+                              values.to_numpy(np.float64), equal_nan=True):
+                dataset[col] = single
+    return dataset
+
+
+def write_sample(dataset, outdir, export_csv=True):
+    """Write sampled observations.
+
+    :param dataset: Dataset of sampled observations.
+    :param outdir: Output directory.
+    :param export_csv: Also write the CSV file (for QGIS).
+
+    """
+    typed_sample(dataset).to_parquet(opj(outdir, PARQUET_FILE),
+                                     engine="pyarrow", index=False)
+    csv_file = opj(outdir, CSV_FILE)
+    if export_csv:
+        dataset.to_csv(csv_file, sep=",", header=True,
+                       index=False, index_label=False)
+    elif os.path.isfile(csv_file):
+        os.remove(csv_file)
+
+
+def sample_file(outdir):
+    """Get the file of sampled observations in a directory.
+
+    The Parquet file is used if available, the CSV file otherwise
+    (observations sampled with previous versions).
+    """
+    parquet_file = opj(outdir, PARQUET_FILE)
+    if os.path.isfile(parquet_file):
+        return parquet_file
+    return opj(outdir, CSV_FILE)
+
+
+def read_sample(outdir):
+    """Read sampled observations.
+
+    :return: Dataset of observations without missing values and
+        with a column ``trial`` of ones (see
+        ``far.model_binomial_iCAR``).
+
+    """
+    ifile = sample_file(outdir)
+    if ifile.endswith(".parquet"):
+        dataset = pd.read_parquet(ifile, engine="pyarrow")
+    else:
+        dataset = pd.read_csv(ifile)
+    dataset = dataset.dropna(axis=0)
+    # Nullable integers after removing missing values
+    for col in INT_COLUMNS:
+        if col in dataset.columns:
+            dataset[col] = dataset[col].astype(np.int64)
+    dataset["trial"] = 1
+    return dataset
+
+# End of file
@@ -0,0 +1,247 @@
+"""Stratified sampling of observations by block.
+
+Deforested and forest pixels are sampled without replacement with
+bottom-k sampling: each pixel gets a pseudo-random key computed from
+its index and the seed, and the sample of a class is made of the
+pixels with the smallest keys. Each block keeps a reservoir of the k
+pixels with the smallest keys for each class, and reservoirs are
+merged keeping the k smallest keys again. The sample only depends on
+the seed, and not on the block size, the number of worker processes
+or the order in which blocks are processed.
+"""
+
+from concurrent.futures import as_completed
+
+import numpy as np
+from osgeo import gdal
+import pandas as pd
+
+from .pool import process_pool
+from .predict import raster_stack, make_blocks
+
+# Bounds of the sample size adapted to forest area (see far.sample)
+NSAMP_MIN = 10000
+NSAMP_MAX = 50000
+
+# Constants of the splitmix64 generator
+GAMMA = 0x9E3779B97F4A7C15
+MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX2 = np.uint64(0x94D049BB133111EB)
+
+# Values of the forest raster for each class
+CLASSES = {"defor": 0, "for": 1}
+
+# State of the worker process (see init_worker)
+_STATE = {}
+
+
+def pixel_keys(idx, seed):
+    """Pseudo-random keys of pixels.
+
+    Keys are obtained by hashing the pixel indices with the seed
+    (splitmix64). The hash is a bijection so that two pixels never
+    have the same key.
+
+    :param idx: Array of pixel indices (row * ncol + col).
+    :param seed: Seed.
+
+    :return: Array of keys (uint64).
+
+    """
+    offset = np.uint64((int(seed) * GAMMA) % 2 ** 64)
+    z = idx.astype(np.uint64) * np.uint64(GAMMA) + offset
+    z = (z ^ (z >> np.uint64(30))) * MIX1
+    z = (z ^ (z >> np.uint64(27))) * MIX2
+    return z ^ (z >> np.uint64(31))
+
+
+def smallest_keys(idx, keys, k):
+    """Keep the k pixels with the smallest keys."""
+    if len(keys) > k:
+        sel = np.argpartition(keys, k - 1)[:k] if k > 0 else []
+        (idx, keys) = (idx[sel], keys[sel])
+    return (idx, keys)
+
+
+def adapt_nsamp(npix, pixel_area):
+    """Adapt the sample size to forest area.
+
+    Same as in ``far.sample``: 1000 for 1 Mha of forest, with
+    min=10000 and max=50000.
+
+    :param npix: Number of forest and deforested pixels.
+    :param pixel_area: Pixel area (in m2).
+
+    """
+    farea = pixel_area * npix / 10000  # farea in ha
+    nsamp_prop = 1000 * farea / 1e6  # 1000 per 1Mha
+    if nsamp_prop >= NSAMP_MAX:
+        return NSAMP_MAX
+    if nsamp_prop <= NSAMP_MIN:
+        return NSAMP_MIN
+    return int(np.rint(nsamp_prop))
+
+
+def init_worker(var_dir, forest_raster):
+    """Initialize a worker process.
+
+    :param var_dir: Directory with rasters of variables.
+    :param forest_raster: Forest raster (1=forest, 0=deforested).
+
+    """
+    (stack, names, nodata) = raster_stack(var_dir, forest_raster)
+    fmask = gdal.Open(forest_raster)
+    _STATE.clear()
+    _STATE.update({"fmask": fmask, "stack": stack,
+                   "names": names, "nodata": nodata,
+                   "ncol": stack.RasterXSize})
+
+
+def sample_block(x_off, y_off, nx, ny, seed, k):
+    """Reservoirs of deforested and forest pixels for one block.
+
+    :return: Dictionary with classes as keys and tuples (pixel
+        indices, keys, number of pixels of the class) as values.
+
+    """
+    forest = _STATE["fmask"].GetRasterBand(1).ReadAsArray(
+        x_off, y_off, nx, ny)
+    ncol = _STATE["ncol"]
+    res = {}
+    for (cls, value) in CLASSES.items():
+        (rows, cols) = np.nonzero(forest == value)
+        idx = (y_off + rows).astype(np.int64) * ncol + x_off + cols
+        res[cls] = smallest_keys(idx, pixel_keys(idx, seed), k) + (len(idx),)
+    return res
+
+
+def extract_block(idx):
+    """Extract values of variables for selected pixels.
+
+    :param idx: Sorted array of pixel indices (within a few rows).
+
+    :return: Array of shape (len(idx), number of variables) with
+        nodata values set to NaN.
+
+    """
+    ncol = _STATE["ncol"]
+    (rows, cols) = np.divmod(idx, ncol)
+    (r0, r1) = (int(rows[0]), int(rows[-1]))
+    data = _STATE["stack"].ReadAsArray(0, r0, ncol, r1 - r0 + 1)
+    data = data.reshape(len(_STATE["names"]), r1 - r0 + 1, ncol)
+    # ReadAsArray returns float32 values in far.sample
+    val = data[:, rows - r0, cols].astype(np.float32)
+    val = np.where(val == _STATE["nodata"][:, None], np.nan, val)
+    return val.T.astype(np.float64)
+
+
+def sample(nsamp=10000, adapt=True, seed=1234, csize=10,
+           var_dir="data", forest_raster="fcc.tif",
+           blk_rows=128, n_workers=1, is_canceled=None):
+    """Sample deforested and forest pixels and extract variables.
+
+    Same sampling design and same output as ``far.sample`` (nsamp
+    deforested pixels and nsamp forest pixels drawn at random), with
+    blocks processed in parallel by ``n_workers`` processes. Memory
+    is bounded by the block size and the sample size.
+
+    :param nsamp: Number of pixels of each class.
+    :param adapt: Adapt ``nsamp`` to forest area (see
+        ``adapt_nsamp``).
+    :param seed: Seed.
+    :param csize: Spatial cell size in km.
+    :param var_dir: Directory with rasters of variables.
+    :param forest_raster: Forest raster (1=forest, 0=deforested).
+    :param blk_rows: Number of rows of each block.
+    :param n_workers: Number of worker processes. If 1, blocks are
+        processed in the calling process.
+    :param is_canceled: Function returning True to stop sampling.
+
+    :return: A pandas DataFrame with one observation per row (values
+        of variables, X, Y and cell), or None if canceled.
+
+    """
+    initargs = (var_dir, forest_raster)
+    init_worker(*initargs)
+    (stack, names) = (_STATE["stack"], _STATE["names"])
+    (ncol, nrow) = (stack.RasterXSize, stack.RasterYSize)
+    gt = stack.GetGeoTransform()
+    blocks = make_blocks(ncol, nrow, blk_rows)
+    k = NSAMP_MAX if adapt else nsamp
+    pool = None
+    if n_workers > 1 and len(blocks) > 1:
+        _STATE.clear()
+        pool = process_pool(min(n_workers, len(blocks)),
+                            initializer=init_worker, initargs=initargs)
+    try:
+        # Reservoirs of pixels with the smallest keys
+        if pool is not None:
+            futures = [pool.submit(sample_block, *blk, seed, k)
+                       for blk in blocks]
+            results = (future.result() for future in as_completed(futures))
+        else:
+            results = (sample_block(*blk, seed, k) for blk in blocks)
+        reservoirs = {cls: (np.empty(0, dtype=np.int64),
+                            np.empty(0, dtype=np.uint64))
+                      for cls in CLASSES}
+        npix = dict.fromkeys(CLASSES, 0)
+        for res in results:
+            if is_canceled is not None and is_canceled():
+                return None
+            for (cls, (idx, keys, n)) in res.items():
+                reservoirs[cls] = smallest_keys(
+                    np.concatenate((reservoirs[cls][0], idx)),
+                    np.concatenate((reservoirs[cls][1], keys)), k)
+                npix[cls] += n
+
+        # Sample size
+        if adapt:
+            nsamp = adapt_nsamp(sum(npix.values()), gt[1] * (-gt[5]))
+        select = np.concatenate(
+            [np.sort(smallest_keys(*reservoirs[cls], nsamp)[0])
+             for cls in CLASSES])
+
+        # Extract values of variables by block of rows
+        order = np.argsort(select, kind="stable")
+        bounds = np.searchsorted(select[order] // ncol,
+                                 [blk[1] for blk in blocks] + [nrow])
+        groups = [order[a:b] for (a, b) in zip(bounds[:-1], bounds[1:])
+                  if b > a]
+        if pool is not None:
+            futures = {pool.submit(extract_block, select[i]): j
+                       for (j, i) in enumerate(groups)}
+            results = ((futures[future], future.result())
+                       for future in as_completed(futures))
+        else:
+            results = ((j, extract_block(select[i]))
+                       for (j, i) in enumerate(groups))
+        val = np.zeros((len(select), len(names)), dtype=np.float64)
+        for (j, values) in results:
+            if is_canceled is not None and is_canceled():
+                return None
+            val[groups[j]] = values
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        _STATE.clear()
+
+    # Coordinates of the center of pixels
+    (yoff, xoff) = np.divmod(select, ncol)
+    pts_x = (xoff + 0.5) * gt[1] + gt[0]
+    pts_y = (yoff + 0.5) * gt[5] + gt[3]
+
+    # Cell number for spatial autocorrelation (see far.sample)
+    csize = csize * 1000  # Transform km in m
+    (xmin, ymax) = (gt[0], gt[3])
+    ncell_x = int(np.ceil(gt[1] * ncol / csize))
+    big_j = ((pts_x - xmin) / csize).astype(int)
+    big_i = ((ymax - pts_y) / csize).astype(int)
+    cell = big_i * ncell_x + big_j  # Cell number starts at zero
+
+    dataset = pd.DataFrame(val, columns=names)
+    dataset["X"] = pts_x
+    dataset["Y"] = pts_y
+    dataset["cell"] = cell.astype(np.float64)
+    return dataset
+
+# End of file
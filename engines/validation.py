@@ -0,0 +1,337 @@
+"""Validation of risk maps on coarse grids.
+
+Observed and predicted deforestation are aggregated to square cells
+of several sizes (in pixels) by block of rows: the columns of each
+block are first summed to cells of the greatest common divisor of
+the sizes, then to each size from this base grid, and rows are
+accumulated separately for each size so that blocks do not need to
+be aligned on the cells. Observed deforestation is aggregated once
+per period from ``fcc123.tif``, and the risk maps of the models are
+evaluated against these aggregates in parallel.
+"""
+
+import os
+from math import gcd
+from functools import reduce
+from concurrent.futures import as_completed
+
+import numpy as np
+from osgeo import gdal
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from .pool import process_pool
+from .predict import make_blocks
+
+# Memory used to aggregate observations and predictions (bytes per
+# pixel of the block, measured with tracemalloc)
+PIXEL_BYTES = 20
+
+# State of the worker process (see init_worker)
+_STATE = {}
+
+
+def column_sums(data, size):
+    """Sum the rows of an array over groups of size columns.
+
+    The array is padded with zeros so that the last group can be
+    partial, as squares on the right edge in
+    ``far.validation_udef_arp``.
+    """
+    (ny, nx) = data.shape
+    mx = -(-nx // size)
+    if mx * size != nx:
+        padded = np.zeros((ny, mx * size), dtype=data.dtype)
+        padded[:, :nx] = data
+        data = padded
+    return data.reshape(ny, mx, size).sum(axis=2)
+
+
+class RowSums:
+    """Sums over squares of a coarse grid accumulated by rows.
+
+    Rows of column sums (see ``column_sums``) are added by block of
+    any number of rows. Rows of squares which are not complete at
+    the end of a block are kept in a partial sum until the next
+    block, and the last row of squares can be partial, as squares on
+    the bottom edge in ``far.validation_udef_arp``.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.rows = []
+        self.partial = None
+        self.nrows = 0
+
+    def add(self, cols):
+        """Add rows of column sums."""
+        ny = cols.shape[0]
+        start = 0
+        if self.nrows > 0:
+            start = min(self.size - self.nrows, ny)
+            self.partial = self.partial + cols[:start].sum(axis=0)
+            self.nrows += start
+            if self.nrows == self.size:
+                self.rows.append(self.partial[None, :])
+                self.nrows = 0
+        nfull = (ny - start) // self.size
+        end = start + nfull * self.size
+        if nfull > 0:
+            self.rows.append(cols[start:end].reshape(
+                nfull, self.size, -1).sum(axis=1))
+        if end < ny:
+            self.partial = cols[end:].sum(axis=0)
+            self.nrows = ny - end
+
+    def sums(self):
+        """Sums over the squares (rows and columns of the grid)."""
+        rows = self.rows
+        if self.nrows > 0:
+            rows = rows + [self.partial[None, :]]
+        return np.vstack(rows)
+
+
+def block_memory():
+    """Memory used by ``aggregate_raster`` (see ``plan_blk_rows``)."""
+    return {"overhead": 0, "pixel_bytes": PIXEL_BYTES}
+
+
+def observed(fcc, period):
+    """Forest and deforested pixels on the period for one block."""
+    if period == "calibration":
+        return (fcc > 0, fcc == 1)
+    if period == "validation":
+        return (fcc > 1, fcc == 2)
+    return (fcc > 0, np.isin(fcc, [1, 2]))
+
+
+def aggregate_raster(raster_file, csizes, func, blk_rows=128,
+                     is_canceled=None):
+    """Aggregate values of a raster to coarse grids by block of rows.
+
+    :param raster_file: Input raster.
+    :param csizes: Sizes of coarse grid cells (in pixels).
+    :param func: Function returning a tuple of arrays to aggregate
+        from an array of raster values.
+    :param blk_rows: Number of rows of blocks.
+    :param is_canceled: Function returning True to stop computations.
+
+    :return: Dictionary with cell sizes as keys and lists of coarse
+        grids (one per array returned by ``func``) as values, or None
+        if canceled.
+
+    """
+    base = reduce(gcd, csizes)
+    ds = gdal.Open(raster_file)
+    band = ds.GetRasterBand(1)
+    (ncol, nrow) = (ds.RasterXSize, ds.RasterYSize)
+    acc = None
+    for (x_off, y_off, nx, ny) in make_blocks(ncol, nrow, blk_rows):
+        if is_canceled is not None and is_canceled():
+            return None
+        arrays = func(band.ReadAsArray(x_off, y_off, nx, ny))
+        if acc is None:
+            acc = {csize: [RowSums(csize) for _ in arrays]
+                   for csize in csizes}
+        for (k, array) in enumerate(arrays):
+            base_cols = column_sums(array, base)
+            for csize in csizes:
+                acc[csize][k].add(column_sums(base_cols, csize // base))
+    del ds
+    return {csize: [i.sums() for i in acc[csize]] for csize in csizes}
+
+
+def aggregate_observed(fcc_file, period, csizes, blk_rows=128,
+                       is_canceled=None):
+    """Aggregate observed forest and deforestation to coarse grids.
+
+    :return: Dictionary with cell sizes as keys and tuples (number of
+        forest pixels, number of deforested pixels) per cell as
+        values, or None if canceled.
+
+    """
+    def func(fcc):
+        return [i.astype(np.int64) for i in observed(fcc, period)]
+    sums = aggregate_raster(fcc_file, csizes, func, blk_rows, is_canceled)
+    if sums is None:
+        return None
+    return {csize: tuple(i.ravel() for i in sums[csize])
+            for csize in csizes}
+
+
+def defor_lookup(tab_file_defor, time_interval):
+    """Deforestation (in ha) on the period per category of risk.
+
+    Categories absent from the table or with no deforestation
+    density (NaN) have no deforestation, as with ``np.nansum`` in
+    ``far.validation_udef_arp``.
+    """
+    df = pd.read_csv(tab_file_defor)
+    lookup = np.zeros(65536, dtype=np.float64)
+    dens = df["defor_dens"].to_numpy() * time_interval
+    cat = df["cat"].to_numpy()
+    keep = (cat >= 0) & (cat < 65536) & ~np.isnan(dens)
+    lookup[cat[keep]] = dens[keep]
+    return lookup
+
+
+def write_results(nfor_obs, ndefor_obs, ndefor_pred_ha, pix_area,
+                  csize, period, riskmap_file, indices_file_pred,
+                  tab_file_pred, fig_file_pred,
+                  figsize=(6.4, 6.4), dpi=100):
+    """Write the tables and the figure of the validation.
+
+    Same outputs as ``far.validation_udef_arp`` for one coarse grid.
+    """
+    df = pd.DataFrame({"cell": np.arange(len(nfor_obs)),
+                       "nfor_obs": nfor_obs,
+                       "ndefor_obs": ndefor_obs,
+                       "nfor_obs_ha": 0.0,
+                       "ndefor_obs_ha": 0.0,
+                       "ndefor_pred_ha": ndefor_pred_ha})
+    csize_ha = round(csize * csize * pix_area / 10000, 2)
+    # Select cells with forest cover > 0
+    df = df[df["nfor_obs"] > 0]
+    ncell = df.shape[0]
+    df["nfor_obs_ha"] = df["nfor_obs"] * pix_area / 10000
+    df["ndefor_obs_ha"] = df["ndefor_obs"] * pix_area / 10000
+    df.to_csv(tab_file_pred, sep=",", header=True,
+              index=False, index_label=False)
+    # Indices
+    error_pred = df["ndefor_pred_ha"] - df["ndefor_obs_ha"]
+    squared_error = (error_pred) ** 2
+    rmse = round(np.sqrt(np.mean(squared_error)), 2)
+    w = df["nfor_obs_ha"] / df["nfor_obs_ha"].sum()
+    wrmse = round(np.sqrt(sum(squared_error * w)), 2)
+    medae = round(np.median(np.absolute(error_pred)), 2)
+    r = np.corrcoef(df["ndefor_pred_ha"], df["ndefor_obs_ha"])[0, 1]
+    r_square = round(r ** 2, 2)
+    # Plot predictions vs. observations
+    model_name = os.path.basename(riskmap_file)[5:-7]
+    title = ("{0} model, {1} period\n"
+             "Predicted vs. observed deforestation "
+             "in {2} ha grid cells.")
+    title = title.format(model_name, period, csize_ha)
+    cols = ["ndefor_obs_ha", "ndefor_pred_ha"]
+    p = [df[cols].min(axis=None), df[cols].max(axis=None)]
+    fig = plt.figure(figsize=figsize, dpi=dpi)
+    ax = plt.subplot(111)
+    ax.set_box_aspect(1)
+    plt.scatter(df["ndefor_obs_ha"], df["ndefor_pred_ha"],
+                color=None, marker="o", edgecolor="k")
+    plt.plot(p, p, "r--")
+    plt.title(title)
+    plt.xlabel("Observed deforestation (ha)")
+    plt.ylabel("Predicted deforestation (ha)")
+    t = ("MedAE = {0:.2f} ha\n"
+         "R2 = {1:.2f}\n"
+         "n = {2:d}")
+    t = t.format(medae, r_square, ncell)
+    plt.text(0, df[cols].max(axis=None), t, ha="left", va="top")
+    fig.savefig(fig_file_pred)
+    plt.close(fig)
+    indices = {"RMSE": rmse, "wRMSE": wrmse, "MedAE": medae,
+               "R2": r_square, "ncell": ncell,
+               "csize_coarse_grid": csize,
+               "csize_coarse_grid_ha": csize_ha}
+    pd.DataFrame([indices]).to_csv(
+        indices_file_pred, sep=",", header=True,
+        index=False, index_label=False)
+
+
+def init_worker(obs, pix_area, period, time_interval, blk_rows):
+    """Initialize a worker process with the observed aggregates."""
+    _STATE.clear()
+    _STATE.update({"obs": obs, "pix_area": pix_area, "period": period,
+                   "time_interval": time_interval, "blk_rows": blk_rows})
+
+
+def evaluate_model(model, riskmap_file, tab_file_defor, outputs):
+    """Evaluate the risk map of a model on all the coarse grids.
+
+    :param outputs: Dictionary with cell sizes as keys and tuples
+        (indices file, table file, figure file) as values.
+
+    :return: Model name.
+
+    """
+    st = _STATE
+    csizes = sorted(outputs)
+    lookup = defor_lookup(tab_file_defor, st["time_interval"])
+
+    def func(cat):
+        return [lookup[cat]]
+    pred = aggregate_raster(riskmap_file, csizes, func, st["blk_rows"])
+    for csize in csizes:
+        (nfor_obs, ndefor_obs) = st["obs"][csize]
+        write_results(nfor_obs, ndefor_obs, pred[csize][0].ravel(),
+                      st["pix_area"], csize, st["period"], riskmap_file,
+                      *outputs[csize])
+    return model
+
+
+def validate(fcc_file, period, time_interval, models, blk_rows=128,
+             n_workers=1, is_canceled=None):
+    """Validate risk maps of several models on several coarse grids.
+
+    This gives the same outputs as ``far.validation_udef_arp`` for
+    each model and cell size. ``fcc123.tif`` is read once and
+    observed deforestation is aggregated to all the coarse grids at
+    once. Models are evaluated in parallel by ``n_workers``
+    processes, each risk map being read once for all the grids.
+
+    :param fcc_file: Raster of forest cover change (123).
+    :param period: Validation period.
+    :param time_interval: Time interval (in years).
+    :param models: Dictionary with model names as keys and tuples
+        (risk map, table of deforestation density per category,
+        outputs) as values, outputs being a dictionary with cell
+        sizes (in pixels) as keys and tuples (indices file, table
+        file, figure file) as values.
+    :param blk_rows: Number of rows of blocks.
+    :param n_workers: Number of worker processes. If 1, models are
+        evaluated in the calling process.
+    :param is_canceled: Function returning True to stop validation.
+
+    :return: True if validation is complete, False if canceled.
+
+    """
+    csizes = sorted({csize for (_, _, outputs) in models.values()
+                     for csize in outputs})
+    obs = aggregate_observed(fcc_file, period, csizes, blk_rows,
+                             is_canceled)
+    if obs is None:
+        return False
+    gt = gdal.Open(fcc_file).GetGeoTransform()
+    initargs = (obs, gt[1] * (-gt[5]), period, time_interval, blk_rows)
+    # Workers do not share the working directory of the calling
+    # process, which may be changed by other tasks
+    args = [(model, os.path.abspath(riskmap_file),
+             os.path.abspath(tab_file_defor),
+             {csize: tuple(map(os.path.abspath, files))
+              for (csize, files) in outputs.items()})
+            for (model, (riskmap_file, tab_file_defor, outputs))
+            in models.items()]
+    if n_workers > 1 and len(args) > 1:
+        pool = process_pool(min(n_workers, len(args)),
+                            initializer=init_worker, initargs=initargs)
+        try:
+            futures = [pool.submit(evaluate_model, *i) for i in args]
+            for future in as_completed(futures):
+                if is_canceled is not None and is_canceled():
+                    return False
+                future.result()
+        finally:
+            pool.shutdown(cancel_futures=True)
+    else:
+        init_worker(*initargs)
+        try:
+            for i in args:
+                if is_canceled is not None and is_canceled():
+                    return False
+                evaluate_model(*i)
+        finally:
+            _STATE.clear()
+    return True
+
+# End of file
@@ -0,0 +1,284 @@
+"""Incremental and parallel computation of country variables.
+
+Variables of ``far.data.country_compute`` are computed by group, each
+group depending on one source of raw data: OpenStreetMap for distances
+to roads, towns and rivers, SRTM for altitude and slope, WDPA for
+protected areas, and a remote raster for biomass. Each group is a
+stage of the artifact cache (see ``artifact_cache``), so that a new
+raw file or a changed parameter only recomputes the variables
+depending on it. Groups are divided in independent jobs run in a
+process pool.
+"""
+
+import os
+import shutil
+import subprocess
+from glob import glob
+from concurrent.futures import as_completed
+
+from osgeo import gdal
+import forestatrisk as far
+from forestatrisk.data.compute import (
+    compute_gadm, compute_srtm,
+    compute_wdpa, compute_biomass_avitabile
+)
+from forestatrisk.data.compute.compute_distance import compute_distance
+
+from .pool import process_pool
+
+# Alias
+opj = os.path.join
+
+# Raw files downloaded for each source ({iso} is the country code)
+SOURCES = {
+    "gadm": ["gadm41_{iso}_0.gpkg"],
+    "srtm": ["SRTM_*.zip"],
+    "wdpa": ["pa_{iso}.*"],
+    "osm": ["country.osm.pbf"],
+}
+
+# Raw data and files of each group of variables
+GROUPS = {
+    "osm": {"source": "osm",
+            "files": ["dist_road.tif", "dist_town.tif", "dist_river.tif",
+                      "roads_proj.*", "towns_proj.*", "rivers_proj.*"]},
+    "srtm": {"source": "srtm", "files": ["altitude.tif", "slope.tif"]},
+    "wdpa": {"source": "wdpa", "files": ["pa.tif", "pa_proj.*"]},
+    "biomass": {"source": None, "files": ["AGB.tif"]},
+}
+
+# OpenStreetMap categories: osmfilter filter and SQL statement
+# (same as far.data.compute.compute_osm)
+OSM_CATEGORIES = {
+    "roads": ('--keep="highway=motorway '
+              'or highway=trunk or highway=*ary"',
+              "SELECT osm_id, name, highway FROM lines "
+              "WHERE highway IS NOT NULL"),
+    "towns": ('--keep="place=city or '
+              'place=town or place=village"',
+              "SELECT osm_id, name, place FROM points "
+              "WHERE place IS NOT NULL"),
+    "rivers": ('--keep="waterway=river or '
+               'waterway=canal"',
+               "SELECT osm_id, name, waterway FROM lines "
+               "WHERE waterway IS NOT NULL"),
+}
+
+# Creation options (same as forestatrisk)
+COPTS = ["COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=YES"]
+
+# Forest rasters (see engines.forest)
+FOREST_FILES = ([f"forest_t{i + 1}.tif" for i in range(3)]
+                + ["fcc12.tif", "fcc13.tif", "fcc123.tif"]
+                + [f"dist_edge_t{i + 1}.tif" for i in range(3)])
+
+
+def expand(directory, patterns, iso):
+    """List files matching patterns in a directory.
+
+    Patterns without any matching file are kept as paths so that
+    they are reported as missing by the artifact cache.
+    """
+    files = []
+    for pattern in patterns:
+        path = opj(directory, pattern.format(iso=iso))
+        matches = sorted(glob(path))
+        files.extend(matches if matches else [path])
+    return files
+
+
+def source_files(source, temp_dir, iso):
+    """Raw files of a source in the download directory."""
+    return expand(temp_dir, SOURCES[source], iso)
+
+
+def group_files(group, output_dir, iso):
+    """Files of a group of variables in the output directory."""
+    return expand(output_dir, GROUPS[group]["files"], iso)
+
+
+def download_source(source, get_fcc_args, iso, temp_dir):
+    """Download the raw data of one source.
+
+    :param source: Source name (key of ``SOURCES``).
+    :param get_fcc_args: Arguments of ``geefcc.get_fcc()``.
+    :param iso: Country iso code.
+    :param temp_dir: Download directory.
+
+    """
+    toggles = {i: i == source for i in SOURCES}
+    far.data.country_download(
+        get_fcc_args=get_fcc_args,
+        iso3=iso,
+        output_dir=temp_dir,
+        forest=False,
+        **toggles)
+
+
+def compute_aoi(temp_dir, output_dir, proj, iso, gadm=True):
+    """Reproject the area of interest.
+
+    :param gadm: If True, the area of interest is extracted again
+        from the GADM file, otherwise ``aoi_latlon.gpkg`` is used.
+
+    :return: Extent with a 5 km buffer.
+
+    """
+    aoi_latlon_file = opj(temp_dir, "aoi_latlon.gpkg")
+    if gadm and os.path.isfile(aoi_latlon_file):
+        os.remove(aoi_latlon_file)
+    ofile = opj(temp_dir, "aoi_proj.gpkg")
+    extent = compute_gadm(opj(temp_dir, f"gadm41_{iso}_0.gpkg"),
+                          ofile, proj)
+    shutil.copy2(ofile, output_dir)
+    return extent
+
+
+def convert_osm():
+    """Convert the OpenStreetMap file to o5m (for osmfilter)."""
+    cmd = "osmconvert country.osm.pbf -o=country.o5m"
+    subprocess.run(cmd, shell=True, check=True,
+                   capture_output=True, text=True)
+
+
+def compute_osm_category(cat, proj, extent):
+    """Compute the distance to one category of OpenStreetMap features.
+
+    Same computations as in ``far.data.compute.compute_osm`` for one
+    category ("roads", "towns" or "rivers"), so that categories can
+    be computed in parallel. Run in the download directory after
+    ``convert_osm``.
+    """
+    (keep, sql_statement) = OSM_CATEGORIES[cat]
+    cmd = f"osmfilter country.o5m {keep} -o={cat}.osm"
+    subprocess.run(cmd, shell=True, check=True,
+                   capture_output=True, text=True)
+    # Convert to shapefile
+    param = gdal.VectorTranslateOptions(
+        accessMode="overwrite",
+        skipFailures=True,
+        format="ESRI Shapefile",
+        layerCreationOptions=["ENCODING=UTF-8"],
+        SQLStatement=sql_statement)
+    gdal.VectorTranslate(cat + ".shp", cat + ".osm", options=param)
+    # Reproject
+    param = gdal.VectorTranslateOptions(
+        accessMode="overwrite",
+        format="ESRI Shapefile",
+        layerCreationOptions=["ENCODING=UTF-8"],
+        srcSRS="EPSG:4326",
+        dstSRS=proj)
+    gdal.VectorTranslate(cat + "_proj.shp", cat + ".shp", options=param)
+    # Rasterize
+    param = gdal.RasterizeOptions(
+        outputBounds=extent,
+        targetAlignedPixels=True,
+        burnValues=[1],
+        outputSRS=proj,
+        noData=255,
+        xRes=150,
+        yRes=150,
+        layers=[cat + "_proj"],
+        outputType=gdal.GDT_Byte,
+        creationOptions=COPTS)
+    gdal.Rasterize(cat + ".tif", cat + "_proj.shp", options=param)
+    # Compute distances (gdal.ComputeProximity, scanline by scanline)
+    compute_distance(input_file=cat + ".tif",
+                     dist_file="dist_" + cat[:-1] + ".tif",
+                     values=1, verbose=False)
+
+
+def group_jobs(group):
+    """Independent jobs of a group of variables.
+
+    :return: List of jobs (tuples of arguments of ``run_job``
+        following the temporary directory).
+
+    """
+    if group == "osm":
+        return [(group, cat) for cat in OSM_CATEGORIES]
+    return [(group, None)]
+
+
+def run_job(temp_dir, group, cat, proj, extent, iso):
+    """Run one job of a group of variables in the download directory.
+
+    The working directory is restored afterwards, so that jobs can
+    also be run in the calling process.
+    """
+    wd = os.getcwd()
+    os.chdir(temp_dir)
+    try:
+        if group == "osm":
+            compute_osm_category(cat, proj, extent)
+        elif group == "srtm":
+            compute_srtm(proj, extent)
+        elif group == "wdpa":
+            compute_wdpa(iso, proj, extent)
+        elif group == "biomass":
+            compute_biomass_avitabile(proj, extent)
+        else:
+            raise ValueError(f"Unknown group of variables {group}")
+    finally:
+        os.chdir(wd)
+    return (group, cat)
+
+
+def compute_groups(groups, temp_dir, output_dir, proj, extent, iso,
+                   n_workers=1):
+    """Compute groups of variables in parallel.
+
+    Groups are divided in independent jobs (the three distance
+    rasters of OpenStreetMap data, altitude and slope, protected
+    areas, and biomass) run in a pool of ``n_workers`` processes.
+    Computations are done in the download directory and files are
+    copied to the output directory as in ``far.data.country_compute``.
+
+    :param groups: Names of the groups (keys of ``GROUPS``).
+    :param temp_dir: Download directory.
+    :param output_dir: Output directory.
+    :param proj: Projection definition (EPSG, PROJ.4, WKT).
+    :param extent: Extent (xmin, ymin, xmax, ymax) of output rasters.
+    :param iso: Country iso code.
+    :param n_workers: Number of worker processes. If 1, jobs are run
+        in the calling process.
+
+    :return: Generator of group names as soon as groups are complete.
+
+    """
+    temp_dir = os.path.abspath(temp_dir)
+    output_dir = os.path.abspath(output_dir)
+    if "osm" in groups:
+        wd = os.getcwd()
+        os.chdir(temp_dir)
+        try:
+            convert_osm()
+        finally:
+            os.chdir(wd)
+    jobs = [job for group in groups for job in group_jobs(group)]
+    remaining = {group: len(group_jobs(group)) for group in groups}
+    args = [(temp_dir,) + job + (proj, extent, iso) for job in jobs]
+    if n_workers > 1 and len(jobs) > 1:
+        with process_pool(min(n_workers, len(jobs))) as pool:
+            futures = [pool.submit(run_job, *i) for i in args]
+            for future in as_completed(futures):
+                (group, _) = future.result()
+                remaining[group] -= 1
+                if remaining[group] == 0:
+                    copy_group(group, temp_dir, output_dir, iso)
+                    yield group
+    else:
+        for i in args:
+            (group, _) = run_job(*i)
+            remaining[group] -= 1
+            if remaining[group] == 0:
+                copy_group(group, temp_dir, output_dir, iso)
+                yield group
+
+
+def copy_group(group, temp_dir, output_dir, iso):
+    """Copy files of a group of variables to the output directory."""
+    for ifile in expand(temp_dir, GROUPS[group]["files"], iso):
+        shutil.copy2(ifile, output_dir)
+
+# End of file
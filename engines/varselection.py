@@ -0,0 +1,127 @@
+"""Variable selection for the binomial iCAR model."""
+
+import numpy as np
+from patsy.highlevel import dmatrices
+from sklearn.linear_model import LogisticRegression
+import forestatrisk as far
+
+# Selection modes
+MODES = ["icar", "pilot", "glm"]
+
+# Number of iterations for burn-in and sampling of each mode
+ITERATIONS = {"pilot": 200, "icar": 1000}
+
+
+def make_formula(variables):
+    """Make model formula from variables."""
+    right_part = " + ".join(list(variables) + ["cell"])
+    left_part = "I(1-fcc) + trial ~ "
+    return left_part + right_part
+
+
+def term_effects(x, betas):
+    """Get the effects of each term (without intercept and cell).
+
+    :return: Dictionary of coefficient arrays with term names as keys.
+
+    """
+    effects = {}
+    for (term, slc) in x.design_info.term_slices.items():
+        name = term.name()
+        if name in ["Intercept", "cell"]:
+            continue
+        effects[name] = np.atleast_1d(betas[slc])
+    return effects
+
+
+def fit_glm(formula, data, penalty_c=1.0):
+    """Fit a penalized logistic regression on the iCAR design.
+
+    The design matrix is the same as for the iCAR model (with
+    intercept, without the cell column). The intercept is fitted by
+    ``LogisticRegression`` so that it is not penalized.
+
+    :return: Tuple (x design matrix, coefficients).
+
+    """
+    y, x = dmatrices(formula, data, 0, "drop")
+    x_arr = np.asarray(x)[:, :-1]
+    y_arr = np.asarray(y)[:, 0]
+    icpt = x.design_info.column_names.index("Intercept")
+    keep = np.arange(x_arr.shape[1]) != icpt
+    betas = np.zeros(x_arr.shape[1])
+    if np.any(keep):
+        mod = LogisticRegression(C=penalty_c, solver="lbfgs",
+                                 max_iter=1000)
+        mod = mod.fit(x_arr[:, keep], y_arr)
+        betas[keep] = np.ravel(mod.coef_)
+        betas[icpt] = mod.intercept_[0]
+    else:
+        # Intercept only (maximum likelihood estimate)
+        p = np.clip(np.mean(y_arr), 1e-6, 1 - 1e-6)
+        betas[icpt] = np.log(p / (1 - p))
+    return (x, betas)
+
+
+def fit_icar(formula, data, n_neighbors, neighbors, prior_vrho,
+             beta_start, niter):
+    """Fit the iCAR model with a short chain.
+
+    :return: Tuple (x design matrix, posterior means of betas).
+
+    """
+    mod = far.model_binomial_iCAR(
+        suitability_formula=formula, data=data,
+        n_neighbors=n_neighbors, neighbors=neighbors,
+        priorVrho=prior_vrho,
+        burnin=niter, mcmc=niter, thin=1,
+        beta_start=beta_start,
+        verbose=0)
+    _, x = dmatrices(formula, data, 0, "drop")
+    return (x, mod.betas)
+
+
+def select_variables(data, variables, mode, n_neighbors, neighbors,
+                     prior_vrho, beta_start, is_canceled=None):
+    """Remove variables with positive effects on deforestation.
+
+    Models are fitted while at least one variable has a positive
+    effect (which is not ecologically meaningful), removing these
+    variables at each iteration. Three modes are available:
+
+    - "icar": iCAR model with 1000 + 1000 iterations (default of the
+      plugin, as in previous versions).
+    - "pilot": iCAR model with short chains (200 iterations).
+    - "glm": penalized logistic regression on the same design
+      (fast pre-screening, no spatial random effects).
+
+    :param data: Dataset with observations.
+    :param variables: Array of variable terms.
+    :param mode: Selection mode ("icar", "pilot" or "glm").
+    :param is_canceled: Function returning True to stop selection.
+
+    :return: Tuple (selected variables, starting values of betas
+        for the final model), or None if canceled.
+
+    """
+    if mode not in MODES:
+        raise ValueError(f"Variable selection mode must be in {MODES}")
+    variables = np.array(variables)
+    while True:
+        formula = make_formula(variables)
+        if mode == "glm":
+            (x, betas) = fit_glm(formula, data)
+        else:
+            (x, betas) = fit_icar(formula, data, n_neighbors, neighbors,
+                                  prior_vrho, beta_start, ITERATIONS[mode])
+        if is_canceled is not None and is_canceled():
+            return None
+        effects = term_effects(x, betas)
+        var_remove = np.array([np.any(effects[var.replace(" ", "")] >= 0)
+                               for var in variables], dtype=bool)
+        if not np.any(var_remove):
+            break
+        variables = variables[np.logical_not(var_remove)]
+    return (variables, betas)
+
+# End of file
@@ -0,0 +1,218 @@
+"""Local deforestation rates with moving windows of several sizes.
+
+Number of deforested and forest pixels in each window are obtained
+from summed-area tables (integral images): the sum over any window is
+computed from four values of the table, whatever the window size. The
+raster is divided in blocks of rows, each block being read once with
+an overlap of half the largest window above and below, so that all the
+window sizes are computed from one read of the forest cover change
+raster. Blocks are processed in parallel.
+"""
+
+import os
+from concurrent.futures import as_completed
+
+import numpy as np
+from osgeo import gdal
+
+from .pool import process_pool
+from .predict import make_blocks
+
+# Creation options (same as riskmapjnr)
+COPTS = ["COMPRESS=LZW", "PREDICTOR=2", "BIGTIFF=YES"]
+
+# Memory used by defor_rate_block (bytes per pixel of the block,
+# measured with tracemalloc): summed-area tables and window sums, and
+# rescaled rates for each window size
+PIXEL_BYTES = 64
+WIN_BYTES = 4
+
+# State of the worker process (see init_worker)
+_STATE = {}
+
+
+def rescale(value, min_val=1, max_val=10000):
+    """Rescale rates to integer values in [min_val, max_val].
+
+    Same as ``riskmapjnr.misc.rescale``, 0 being the nodata value.
+    """
+    value = np.maximum(value.astype(float), 1e-06)
+    r = ((value * 1e6 - 1) * (max_val - min_val) / 999999.0) + min_val
+    return np.rint(r).astype(int)
+
+
+def summed_area_table(data, halo):
+    """Summed-area table of a block padded with zeros.
+
+    The block is padded with ``halo`` columns of zeros on the left and
+    on the right, and a row and a column of zeros are added at the
+    top and on the left of the table, so that ``sat[i, j]`` is the
+    sum of ``data`` over rows < i and columns < j - halo.
+    """
+    (ny, nx) = data.shape
+    sat = np.zeros((ny + 1, nx + 2 * halo + 1), dtype=np.int64)
+    np.cumsum(data, axis=0, out=sat[1:, halo + 1:halo + nx + 1])
+    return np.cumsum(sat, axis=1)
+
+
+def window_sum(sat, win_size, halo, ny, nx):
+    """Sum over square windows centered on the pixels of a block.
+
+    :param sat: Summed-area table (see ``summed_area_table``) of the
+        block with ``halo`` rows above and below.
+    :param win_size: Window size (odd number of pixels).
+    :param halo: Number of rows and columns of the overlap.
+    :param ny: Number of rows of the block (without overlap).
+    :param nx: Number of columns.
+
+    :return: Array of shape (ny, nx).
+
+    """
+    r = win_size // 2
+    (a1, a2) = (halo - r, halo + r + 1)
+    (b1, b2) = (halo - r, halo + r + 1)
+    return (sat[a2:a2 + ny, b2:b2 + nx] - sat[a1:a1 + ny, b2:b2 + nx]
+            - sat[a2:a2 + ny, b1:b1 + nx] + sat[a1:a1 + ny, b1:b1 + nx])
+
+
+def block_memory(n_win):
+    """Memory used by ``defor_rate_block`` (see ``plan_blk_rows``)."""
+    return {"overhead": 0, "pixel_bytes": PIXEL_BYTES + WIN_BYTES * n_win}
+
+
+def init_worker(fcc_file, defor_values, win_sizes, time_interval,
+                rescale_min_val, rescale_max_val):
+    """Initialize a worker process.
+
+    See ``local_defor_rate`` for arguments.
+    """
+    fcc = gdal.Open(fcc_file)
+    _STATE.clear()
+    _STATE.update({
+        "fcc": fcc, "nrow": fcc.RasterYSize,
+        "defor_values": defor_values, "win_sizes": win_sizes,
+        "halo": max(win_sizes) // 2, "time_interval": time_interval,
+        "min_val": rescale_min_val, "max_val": rescale_max_val})
+
+
+def defor_rate_block(x_off, y_off, nx, ny):
+    """Local deforestation rates for one block and all window sizes.
+
+    :return: Tuple (x_off, y_off, dictionary of arrays of rescaled
+        rates with window sizes as keys).
+
+    """
+    st = _STATE
+    halo = st["halo"]
+    # Read the block with the overlap, rows outside the raster
+    # are zeros (mode="constant" and cval=0 in riskmapjnr)
+    top = max(0, y_off - halo)
+    bottom = min(st["nrow"], y_off + ny + halo)
+    data = st["fcc"].GetRasterBand(1).ReadAsArray(
+        x_off, top, nx, bottom - top)
+    fcc = np.zeros((ny + 2 * halo, nx), dtype=data.dtype)
+    start = top - (y_off - halo)
+    fcc[start:start + bottom - top] = data
+    del data
+    sat_defor = summed_area_table(
+        np.isin(fcc, st["defor_values"]).astype(np.int32), halo)
+    sat_for = summed_area_table((fcc > 0).astype(np.int32), halo)
+    forest = fcc[halo:halo + ny] > 0
+    del fcc
+    rates = {}
+    for win_size in st["win_sizes"]:
+        win_defor = window_sum(sat_defor, win_size, halo, ny, nx)[forest]
+        win_for = window_sum(sat_for, win_size, halo, ny, nx)[forest]
+        theta = 1 - (1 - win_defor / win_for) ** (1 / st["time_interval"])
+        out = np.zeros((ny, nx), dtype=np.uint16)
+        out[forest] = rescale(theta, st["min_val"], st["max_val"])
+        rates[win_size] = out
+    return (x_off, y_off, rates)
+
+
+def create_output(output_file, ref_ds):
+    """Create an output raster of local deforestation rates."""
+    driver = gdal.GetDriverByName("GTiff")
+    out = driver.Create(output_file, ref_ds.RasterXSize,
+                        ref_ds.RasterYSize, 1, gdal.GDT_UInt16, COPTS)
+    out.SetProjection(ref_ds.GetProjection())
+    out.SetGeoTransform(ref_ds.GetGeoTransform())
+    out.GetRasterBand(1).SetNoDataValue(0)
+    return out
+
+
+def local_defor_rate(fcc_file, defor_values, ldefrate_files,
+                     time_interval, rescale_min_val=1,
+                     rescale_max_val=10000, blk_rows=128,
+                     n_workers=1, is_canceled=None):
+    """Compute local deforestation rates with moving windows.
+
+    This gives the same rasters as ``riskmapjnr.local_defor_rate``
+    for each window size, with one read of the forest cover change
+    raster for all the window sizes. Blocks are computed in parallel
+    by ``n_workers`` processes and written to the output GeoTIFFs by
+    the calling process.
+
+    :param fcc_file: Raster of forest cover change (123), 0 for
+        nodata.
+    :param defor_values: Raster values for deforestation (1 or
+        [1, 2]).
+    :param ldefrate_files: Dictionary of output rasters (UInt16, 0
+        for nodata) with window sizes (odd numbers of pixels) as keys.
+    :param time_interval: Time interval (in years).
+    :param rescale_min_val: Minimal value of rescaled rates.
+    :param rescale_max_val: Maximal value of rescaled rates.
+    :param blk_rows: Number of rows of each block (without overlap).
+    :param n_workers: Number of worker processes. If 1, blocks are
+        computed in the calling process.
+    :param is_canceled: Function returning True to stop computations.
+
+    :return: True if computations are complete, False if canceled.
+
+    """
+    win_sizes = sorted(int(i) for i in ldefrate_files)
+    if any(i % 2 == 0 for i in win_sizes):
+        raise ValueError("Window sizes must be odd numbers.")
+    # Workers do not share the working directory of the calling
+    # process, which may be changed by other tasks
+    initargs = (os.path.abspath(fcc_file), defor_values, win_sizes,
+                time_interval, rescale_min_val, rescale_max_val)
+    fcc = gdal.Open(fcc_file)
+    (ncol, nrow) = (fcc.RasterXSize, fcc.RasterYSize)
+    outs = {win_size: create_output(ldefrate_files[win_size], fcc)
+            for win_size in win_sizes}
+    del fcc
+    bands = {win_size: out.GetRasterBand(1)
+             for (win_size, out) in outs.items()}
+    blocks = make_blocks(ncol, nrow, blk_rows)
+    pool = None
+    if n_workers > 1 and len(blocks) > 1:
+        pool = process_pool(min(n_workers, len(blocks)),
+                            initializer=init_worker, initargs=initargs)
+        futures = [pool.submit(defor_rate_block, *blk) for blk in blocks]
+        results = (future.result() for future in as_completed(futures))
+    else:
+        init_worker(*initargs)
+        results = (defor_rate_block(*blk) for blk in blocks)
+    complete = True
+    try:
+        for (x_off, y_off, rates) in results:
+            if is_canceled is not None and is_canceled():
+                complete = False
+                break
+            for (win_size, rate) in rates.items():
+                bands[win_size].WriteArray(rate, x_off, y_off)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        else:
+            _STATE.clear()
+    if complete:
+        for band in bands.values():
+            band.FlushCache()
+            band.ComputeStatistics(False)
+    bands = None
+    outs = None
+    return complete
+
+# End of file
@@ -3,7 +3,7 @@
 import matplotlib
 
 from .far_get_fcc_grid_args import FarGetFccGridArgsTask
-from .far_get_fcc_tile import FarGetFccTileTask
+from .far_get_fcc_tiles import FarGetFccTilesTask
 from .far_get_variables import FarGetVariablesTask
 from .far_sample_obs import FarSampleObsTask
 from .far_calibrate import FarCalibrateTask
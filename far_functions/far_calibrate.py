@@ -19,14 +19,16 @@ from qgis.core import Qgis, QgsTask, QgsMessageLog
 
 import numpy as np
 import matplotlib.pyplot as plt
-from patsy.highlevel import dmatrices
 import pandas as pd
-import joblib
-from sklearn.linear_model import LogisticRegression
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import log_loss
 import forestatrisk as far
 
+# Local import
+from ..artifact_cache import ArtifactCache
+from ..engines import (process_pool, fit_icar_chains, select_variables,
+                       cellneigh, submit_models, COMPARISON_MODELS,
+                       design_spec, save_design_spec, read_sample,
+                       sample_file)
+
 # Alias
 opj = os.path.join
 
@@ -40,7 +42,9 @@ class FarCalibrateTask(QgsTask):
     N_STEPS = 6
 
     def __init__(self, description, iface, workdir, csize, variables,
-                 beta_start, prior_vrho, mcmc, varselection, period):
+                 beta_start, prior_vrho, mcmc, varselection, period,
+                 n_chains=1, burnin_max=0, varselection_mode="icar",
+                 seed=1234):
         super().__init__(description, QgsTask.CanCancel)
         self.iface = iface
         self.workdir = workdir
@@ -51,10 +55,35 @@ class FarCalibrateTask(QgsTask):
         self.mcmc = mcmc
         self.varselection = varselection
         self.period = period
+        self.n_chains = max(1, int(n_chains))
+        self.burnin_max = int(burnin_max)
+        self.varselection_mode = varselection_mode
+        self.seed = seed
         self.datadir = f"data_{self.period}"
         self.outdir = opj(self.OUT, self.period)
         self.exception = None
 
+    def get_artifacts(self):
+        """Get stage name, inputs, parameters and outputs."""
+        inputs = [sample_file(self.outdir),
+                  opj(self.datadir, "fcc.tif")]
+        params = {"csize": self.csize, "variables": self.variables,
+                  "beta_start": self.beta_start,
+                  "prior_vrho": self.prior_vrho, "mcmc": self.mcmc,
+                  "varselection": self.varselection,
+                  "n_chains": self.n_chains,
+                  "burnin_max": self.burnin_max,
+                  "varselection_mode": self.varselection_mode,
+                  "seed": self.seed}
+        out_files = ["summary_icar.txt", "mcmc.pdf", "mod_icar.pickle",
+                     "design_info.json", "mod_null.pickle", "mod_glm.pickle",
+                     "mod_rf.joblib", "model_deviances.csv"]
+        outputs = [opj(self.outdir, i) for i in out_files]
+        artifacts = {"stage": f"far_calibrate_{self.period}",
+                     "inputs": inputs, "params": params,
+                     "outputs": outputs}
+        return artifacts
+
     def set_progress(self, progress, n_steps):
         """Set progress."""
         if progress == 0:
@@ -64,6 +93,59 @@ class FarCalibrateTask(QgsTask):
             prog_perc = int(prog_perc * 100)
             self.setProgress(prog_perc)
 
+    def fit_icar(self, formula, dataset, nneigh, adj, beta_start,
+                 mcmc, thin):
+        """Fit the binomial iCAR model.
+
+        :return: The model, or None if canceled.
+
+        """
+        if self.n_chains == 1:
+            mod_icar = far.model_binomial_iCAR(
+                # Observations
+                suitability_formula=formula, data=dataset,
+                # Spatial structure
+                n_neighbors=nneigh, neighbors=adj,
+                # Priors
+                priorVrho=self.prior_vrho,
+                # Chains
+                burnin=mcmc,
+                mcmc=mcmc,
+                thin=thin,
+                # Starting values
+                beta_start=beta_start,
+                # Verbose = False for QGIS task
+                verbose=0)
+        else:
+            # Parallel chains with dispersed starting values, short
+            # burn-in extended until chains have converged, with a
+            # total burn-in up to burnin_max (by default, the burn-in
+            # of one chain)
+            with process_pool(self.n_chains) as pool:
+                mod_icar = fit_icar_chains(
+                    pool=pool,
+                    formula=formula, data=dataset,
+                    n_neighbors=nneigh, neighbors=adj,
+                    prior_vrho=self.prior_vrho,
+                    mcmc=mcmc, thin=thin,
+                    beta_start=beta_start,
+                    n_chains=self.n_chains,
+                    burnin_max=self.burnin_max or mcmc,
+                    is_canceled=self.isCanceled)
+            if mod_icar is None:
+                return None
+            msg = ("{n} chains, burn-in {burnin} (total {total}), "
+                   "max. Rhat {rhat:.3f}, min. ESS {ess:.0f}, "
+                   "converged: {conv}")
+            msg = msg.format(n=self.n_chains, burnin=mod_icar.burnin,
+                             total=mod_icar.total_burnin,
+                             rhat=np.nanmax(mod_icar.rhat),
+                             ess=np.nanmin(mod_icar.ess),
+                             conv=mod_icar.converged)
+            level = Qgis.Info if mod_icar.converged else Qgis.Warning
+            QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY, level)
+        return mod_icar
+
     def run(self):
         """Estimate forestatrisk model parameters."""
 
@@ -85,7 +167,7 @@ class FarCalibrateTask(QgsTask):
             os.chdir(self.workdir)
 
             # Dataset
-            dataset_file = opj(self.outdir, "sample.txt")
+            dataset_file = sample_file(self.outdir)
             if not os.path.isfile(dataset_file):
                 msg = ("No data file in the outputs folder "
                        "of the working directory. "
@@ -93,9 +175,17 @@ class FarCalibrateTask(QgsTask):
                 self.exception = msg
                 return False
 
-            dataset = pd.read_csv(dataset_file)
-            dataset = dataset.dropna(axis=0)
-            dataset["trial"] = 1
+            # Skip calibration if models are up to date
+            cache = ArtifactCache(self.workdir)
+            artifacts = self.get_artifacts()
+            if cache.is_fresh(**artifacts):
+                msg = 'Models of task "{name}" are up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
+
+            dataset = read_sample(self.outdir)
 
             # Check isCanceled() to handle cancellation
             if self.isCanceled():
@@ -110,9 +200,10 @@ class FarCalibrateTask(QgsTask):
             # -------------------
 
             # Neighborhood for spatial-autocorrelation
+            # (cached next to the raster for a given csize)
             ifile = opj(self.datadir, "fcc.tif")
-            nneigh, adj = far.cellneigh(raster=ifile,
-                                        csize=self.csize, rank=1)
+            nneigh, adj = cellneigh(raster=ifile,
+                                    csize=self.csize, rank=1)
 
             # Check isCanceled() to handle cancellation
             if self.isCanceled():
@@ -136,37 +227,19 @@ class FarCalibrateTask(QgsTask):
             # -------------------
 
             if self.varselection:
-                # Run model while there is non-significant variables
-                var_remove = True
-                while np.any(var_remove):
-                    # Formula
-                    right_part = " + ".join(variables) + " + cell"
-                    left_part = "I(1-fcc) + trial ~ "
-                    formula = left_part + right_part
-                    # Model
-                    mod_icar = far.model_binomial_iCAR(
-                        # Observations
-                        suitability_formula=formula,
-                        data=dataset,
-                        # Spatial structure
-                        n_neighbors=nneigh, neighbors=adj,
-                        # Priors
-                        priorVrho=self.prior_vrho,
-                        # Chains
-                        burnin=1000, mcmc=1000, thin=1,
-                        # Starting values
-                        beta_start=self.beta_start,
-                        # Verbose = False for QGIS task
-                        verbose=0)
-                    # Ecological and statistical significance
-                    effects = mod_icar.betas[1:]
-                    positive_effects = effects >= 0
-                    var_remove = positive_effects
-                    var_keep = np.logical_not(var_remove)
-                    variables = variables[var_keep]
-                    # Check isCanceled() to handle cancellation
-                    if self.isCanceled():
-                        return False
+                # Remove variables with positive effects with full
+                # iCAR chains (or optionally, a penalized glm or
+                # short iCAR chains)
+                selection = select_variables(
+                    data=dataset, variables=variables,
+                    mode=self.varselection_mode,
+                    n_neighbors=nneigh, neighbors=adj,
+                    prior_vrho=self.prior_vrho,
+                    beta_start=self.beta_start,
+                    is_canceled=self.isCanceled)
+                if selection is None:
+                    return False
+                (variables, betas_selection) = selection
 
             # Progress
             progress += 1
@@ -183,7 +256,7 @@ class FarCalibrateTask(QgsTask):
 
             # Initial values for beta_start
             if self.varselection:
-                beta_start = mod_icar.betas
+                beta_start = betas_selection
             else:
                 beta_start = self.beta_start
 
@@ -194,21 +267,20 @@ class FarCalibrateTask(QgsTask):
             else:
                 mcmc = self.mcmc
                 thin = 1
-            mod_icar = far.model_binomial_iCAR(
-                # Observations
-                suitability_formula=formula, data=dataset,
-                # Spatial structure
-                n_neighbors=nneigh, neighbors=adj,
-                # Priors
-                priorVrho=self.prior_vrho,
-                # Chains
-                burnin=mcmc,
-                mcmc=mcmc,
-                thin=thin,
-                # Starting values
-                beta_start=beta_start,
-                # Verbose = False for QGIS task
-                verbose=0)
+
+            # Comparison models are fitted in separate processes
+            # while the iCAR model is estimated
+            with process_pool(len(COMPARISON_MODELS)) as pool_cmp:
+                futures_cmp = submit_models(
+                    pool=pool_cmp, formula=formula, data=dataset,
+                    outdir=self.outdir, seed=self.seed)
+                mod_icar = self.fit_icar(formula, dataset, nneigh, adj,
+                                         beta_start, mcmc, thin)
+                if mod_icar is None or self.isCanceled():
+                    pool_cmp.shutdown(cancel_futures=True)
+                    return False
+                deviances = {name: future.result()
+                             for (name, future) in futures_cmp.items()}
 
             # Check isCanceled() to handle cancellation
             if self.isCanceled():
@@ -263,60 +335,19 @@ class FarCalibrateTask(QgsTask):
             with open(ofile, "wb") as file:
                 pickle.dump(mod_icar_pickle, file)
 
+            # Save the design (stateful transforms and categorical
+            # levels) so that predictions don't need the dataset
+            save_design_spec(design_spec(formula, dataset),
+                             opj(self.outdir, "design_info.json"))
+
             # -------------------
             # Model comparison
             # -------------------
 
-            # Null model
-            formula_null = "I(1-fcc) ~ 1"
-            y, x = dmatrices(formula_null, data=dataset, NA_action="drop")
-            Y = y[:, 0]
-            X_null = x[:, :]
-            mod_null = LogisticRegression(solver="lbfgs")
-            mod_null = mod_null.fit(X_null, Y)
-            pred_null = mod_null.predict_proba(X_null)
-            ofile = opj(self.outdir, "mod_null.pickle")
-            with open(ofile, "wb") as file:
-                pickle.dump(mod_null, file)
-
-            # Simple glm with no spatial random effects
-            formula_glm = formula
-            y, x = dmatrices(formula_glm, data=dataset, NA_action="drop")
-            Y = y[:, 0]
-            # We remove the last column (cells)
-            X_glm = x[:, :-1]
-            mod_glm = LogisticRegression(solver="lbfgs")
-            mod_glm = mod_glm.fit(X_glm, Y)
-            pred_glm = mod_glm.predict_proba(X_glm)
-            ofile = opj(self.outdir, "mod_glm.pickle")
-            with open(ofile, "wb") as file:
-                pickle.dump(mod_glm, file)
-
-            # Random forest model
-            formula_rf = formula
-            y, x = dmatrices(formula_rf, data=dataset, NA_action="drop")
-            Y = y[:, 0]
-            # We remove the first (intercept, 0 col) and last column (cells)
-            X_rf = x[:, 1:-1]
-            # I suggest using n_cpu=1 to avoid problems in QGis with tasks.
-            # n_cpu = max(3, os.cpu_count() - 4)
-            n_cpu = 1
-            mod_rf = RandomForestClassifier(n_estimators=50,
-                                            min_samples_leaf=2,
-                                            max_depth=15,
-                                            n_jobs=n_cpu)
-            mod_rf = mod_rf.fit(X_rf, Y)
-            pred_rf = mod_rf.predict_proba(X_rf)
-            # Use joblib for persistence
-            # https://scikit-learn.org/stable/model_persistence.html
-            ofile = opj(self.outdir, "mod_rf.joblib")
-            with open(ofile, "wb") as file:
-                joblib.dump(mod_rf, file, compress=True)
-
             # Deviances
-            deviance_null = 2*log_loss(Y, pred_null, normalize=False)
-            deviance_glm = 2*log_loss(Y, pred_glm, normalize=False)
-            deviance_rf = 2*log_loss(Y, pred_rf, normalize=False)
+            deviance_null = deviances["null"]
+            deviance_glm = deviances["glm"]
+            deviance_rf = deviances["rf"]
             deviance_icar = mod_icar.deviance
             deviance_full = 0
             dev = [deviance_null, deviance_glm, deviance_rf,
@@ -332,6 +363,9 @@ class FarCalibrateTask(QgsTask):
             ofile = opj(self.outdir, "model_deviances.csv")
             mod_dev.to_csv(ofile, header=True, index=False)
 
+            # Record artifacts
+            cache.record(**artifacts)
+
             # Progress
             progress += 1
             self.set_progress(progress, self.N_STEPS)
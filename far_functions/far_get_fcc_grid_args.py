@@ -92,7 +92,8 @@ class FarGetFccGridArgsTask(QgsTask):
         gfa["years"] = years
         # default buffer of ~10km in dd
         gfa["buff"] = 0.08983152841195216
-        # parallel (False with QGis)
+        # parallel (False with QGis, tiles are downloaded
+        # concurrently by FarGetFccTilesTask)
         gfa["parallel"] = False
         # output_file
         gfa["output_file"] = opj(self.DATA_RAW,
@@ -188,6 +189,8 @@ class FarGetFccGridArgsTask(QgsTask):
                 "forest": forest,
                 "proj": proj, "scale": scale,
                 "out_dir_tiles": out_dir_tiles,
+                "source": source, "years": years,
+                "perc": perc,
             }
 
             # Check isCanceled() to handle cancellation
@@ -1,12 +1,9 @@
 """Get forest cover change tile."""
 
 import os
+import time
 
-from qgis.core import (
-    Qgis, QgsTask,
-    QgsMessageLog
-)
-
+from osgeo import gdal
 from geefcc.geeic2geotiff import geeic2geotiff
 
 
@@ -15,99 +12,82 @@ opj = os.path.join
 opb = os.path.basename
 
 
-class FarGetFccTileTask(QgsTask):
-    """Get forest cover change tile."""
-
-    # Constants
-    MESSAGE_CATEGORY = "Deforisk"
-    N_STEPS = 1
-
-    def __init__(self, description, index, ext, grid_args):
-        super().__init__(description, QgsTask.CanCancel)
-        self.index = index
-        self.ext = ext
-        self.ntiles = grid_args["ntiles"]
-        self.forest = grid_args["forest"]
-        self.proj = grid_args["proj"]
-        self.scale = grid_args["scale"]
-        self.out_dir_tiles = grid_args["out_dir_tiles"]
-        self.exception = None
-
-    def set_progress(self, progress, n_steps):
-        """Set progress."""
-        if progress == 0:
-            self.setProgress(1)
-        else:
-            prog_perc = progress / n_steps
-            prog_perc = int(prog_perc * 100)
-            self.setProgress(prog_perc)
-
-    def run(self):
-        """Get forest cover change."""
+def download_tile(index, ext, grid_args, max_retries=3, backoff=2.0):
+    """Download one forest cover tile with retry.
 
-        try:
-            # Starting message
-            msg = 'Started task "{name}"'
-            msg = msg.format(name=self.description())
-            QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY, Qgis.Info)
+    Earth Engine requests fail transiently (quota, 429, network
+    drops). The tile is requested again after an exponential backoff
+    delay (``backoff * 2 ** attempt`` seconds). A partially written
+    file is removed before each new attempt, as ``geeic2geotiff``
+    skips the download if the file exists and is not empty.
 
-            # Progress
-            progress = 0
-            self.set_progress(progress, self.N_STEPS)
+    :param index: Tile index.
+    :param ext: Tile extent.
+    :param grid_args: Dictionary of grid arguments.
+    :param max_retries: Number of retries after the first attempt.
+    :param backoff: Base delay (in seconds) for the backoff.
 
-            # Download tile
+    :return: Number of attempts used to download the tile. If all
+        the attempts fail, the number of attempts is given by the
+        ``attempts`` attribute of the raised exception.
+
+    """
+    ofile = opj(grid_args["out_dir_tiles"], f"forest_{index}.tif")
+    attempt = 0
+    while True:
+        try:
             geeic2geotiff(
-                self.index, self.ext, self.ntiles,
-                self.forest, self.proj, self.scale,
-                self.out_dir_tiles
+                index, ext, grid_args["ntiles"],
+                grid_args["forest"], grid_args["proj"],
+                grid_args["scale"], grid_args["out_dir_tiles"]
             )
-
-            # Check isCanceled() to handle cancellation
-            if self.isCanceled():
-                return False
-
-            # Progress
-            progress += 1
-            self.set_progress(progress, self.N_STEPS)
-
+            return attempt + 1
         except Exception as exc:
-            self.exception = exc
-            return False
-
-        return True
-
-    def finished(self, result):
-        """Show messages and add layers."""
-
-        if result:
-            # Message
-            msg = 'Successful task "{name}"'
-            msg = msg.format(name=self.description())
-            QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY, Qgis.Success)
-
-        else:
-            if self.exception is None:
-                msg = ('FarGetFccTileTask "{name}" not successful but without '
-                       'exception (probably the task was manually '
-                       'canceled by the user)')
-                msg = msg.format(name=self.description())
-                QgsMessageLog.logMessage(
-                    msg, self.MESSAGE_CATEGORY, Qgis.Warning)
-            else:
-                msg = 'FarGetFccTileTask "{name}" Exception: {exception}'
-                msg = msg.format(
-                        name=self.description(),
-                        exception=self.exception)
-                QgsMessageLog.logMessage(
-                    msg, self.MESSAGE_CATEGORY, Qgis.Critical)
-                raise self.exception
-
-    def cancel(self):
-        """Cancelation message."""
-        msg = 'FarGetFccTileTask "{name}" was canceled'
-        msg = msg.format(name=self.description())
-        QgsMessageLog.logMessage(
-            msg, self.MESSAGE_CATEGORY, Qgis.Info)
-        super().cancel()
+            if os.path.isfile(ofile):
+                os.remove(ofile)
+            if attempt >= max_retries:
+                exc.attempts = attempt + 1
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            attempt += 1
+
+
+def check_tile(ifile, ext, scale):
+    """Check that a tile is a valid raster covering its extent.
+
+    ``geeic2geotiff`` can leave a truncated or invalid file without
+    raising an exception. The tile is opened with GDAL, its size and
+    extent are compared to the extent of the grid cell (with a
+    tolerance of one pixel), and all its bands are read.
+
+    :param ifile: Tile file.
+    :param ext: Tile extent (xmin, ymin, xmax, ymax).
+    :param scale: Resolution of the tile.
+
+    :return: Error message, or None if the tile is valid.
+
+    """
+    try:
+        ds = gdal.Open(ifile)
+        if ds is None:
+            return "Tile cannot be opened"
+        (xmin, ymin, xmax, ymax) = ext
+        ncol = round((xmax - xmin) / scale)
+        nrow = round((ymax - ymin) / scale)
+        if (abs(ds.RasterXSize - ncol) > 1
+                or abs(ds.RasterYSize - nrow) > 1):
+            return (f"Tile size ({ds.RasterXSize}, {ds.RasterYSize}) "
+                    f"does not match its extent ({ncol}, {nrow})")
+        gt = ds.GetGeoTransform()
+        x_min = min(gt[0], gt[0] + gt[1] * ds.RasterXSize)
+        y_max = max(gt[3], gt[3] + gt[5] * ds.RasterYSize)
+        if abs(x_min - xmin) > scale or abs(y_max - ymax) > scale:
+            return "Tile origin does not match its extent"
+        for k in range(ds.RasterCount):
+            if ds.GetRasterBand(k + 1).ReadAsArray() is None:
+                return f"Band {k + 1} of the tile cannot be read"
+    except RuntimeError as exc:
+        return str(exc)
+    return None
 
 # End of file
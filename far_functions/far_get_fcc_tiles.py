@@ -0,0 +1,293 @@
+"""Get forest cover change tiles with a download scheduler."""
+
+import os
+import json
+import hashlib
+import threading
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from qgis.core import (
+    Qgis, QgsTask,
+    QgsMessageLog
+)
+
+from .far_get_fcc_tile import download_tile, check_tile
+
+# Alias
+opj = os.path.join
+opb = os.path.basename
+
+
+def file_sha256(ifile, chunk_size=1 << 20):
+    """Compute the sha256 checksum of a file."""
+    sha = hashlib.sha256()
+    with open(ifile, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class TileCache:
+    """Resumable, checksum-verified cache of forest tiles.
+
+    The cache is described by a json manifest in the tile directory.
+    The manifest stores a cache key (source, years, perc, scale and
+    proj) and, for each tile index, the status ("done" or "failed"),
+    the number of attempts, the last error message, the tile extent,
+    and the byte size and sha256 checksum of the downloaded file. A
+    tile is recorded as done only if it is a valid raster covering
+    its extent, and it is reused only if its entry matches the
+    current key and extent and if the file on disk has the recorded
+    size and checksum. The manifest is rewritten atomically after
+    each tile so that an interrupted download can be resumed.
+    """
+
+    FILE_NAME = "tiles_manifest.json"
+
+    def __init__(self, out_dir_tiles, key):
+        self.out_dir_tiles = out_dir_tiles
+        self.manifest_file = opj(out_dir_tiles, self.FILE_NAME)
+        self.lock = threading.Lock()
+        self.key = key
+        self.tiles = {}
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except ValueError:
+                manifest = {}
+            # Tiles are only valid for the same key
+            if manifest.get("key") == key:
+                self.tiles = manifest.get("tiles", {})
+
+    @staticmethod
+    def format_extent(ext):
+        """Format extent for comparison."""
+        return [round(float(i), 9) for i in ext]
+
+    def tile_file(self, index):
+        """Path to tile file."""
+        return opj(self.out_dir_tiles, f"forest_{index}.tif")
+
+    def is_valid(self, index, ext):
+        """Check tile entry, size and checksum."""
+        entry = self.tiles.get(str(index), {})
+        ofile = self.tile_file(index)
+        if (entry.get("status") != "done"
+                or entry.get("extent") != self.format_extent(ext)
+                or not os.path.isfile(ofile)):
+            return False
+        if os.path.getsize(ofile) != entry.get("size"):
+            return False
+        return file_sha256(ofile) == entry.get("sha256")
+
+    def prune(self, ntiles):
+        """Remove tile files which do not belong to the grid."""
+        for ifile in glob(opj(self.out_dir_tiles, "forest_*.tif")):
+            index = opb(ifile)[len("forest_"):-len(".tif")]
+            if not index.isdigit() or int(index) >= ntiles:
+                os.remove(ifile)
+        self.tiles = {i: entry for (i, entry) in self.tiles.items()
+                      if int(i) < ntiles}
+
+    def update(self, index, ext, status, attempts, error=None):
+        """Update tile entry and save manifest.
+
+        A downloaded tile is checked (see ``check_tile``) before its
+        checksum is recorded. An invalid tile is removed and recorded
+        as failed so that it is downloaded again.
+
+        :return: Status of the tile.
+
+        """
+        ofile = self.tile_file(index)
+        if status == "done":
+            error = check_tile(ofile, ext, self.key["scale"])
+            if error is not None:
+                status = "failed"
+                if os.path.isfile(ofile):
+                    os.remove(ofile)
+        entry = {
+            "status": status,
+            "attempts": attempts,
+            "error": error,
+            "extent": self.format_extent(ext),
+        }
+        if status == "done":
+            entry["size"] = os.path.getsize(ofile)
+            entry["sha256"] = file_sha256(ofile)
+        with self.lock:
+            self.tiles[str(index)] = entry
+            self.save()
+        return status
+
+    def save(self):
+        """Save manifest atomically."""
+        manifest = {"key": self.key, "tiles": self.tiles}
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)
+
+
+class FarGetFccTilesTask(QgsTask):
+    """Get forest cover change tiles.
+
+    Tiles are downloaded by a pool of ``n_workers`` threads (downloads
+    are I/O bound). Each tile is retried with exponential backoff and
+    recorded in a checksum-verified cache so that only missing,
+    failed or corrupt tiles are downloaded when the task is run again.
+    """
+
+    # Constants
+    MESSAGE_CATEGORY = "Deforisk"
+
+    def __init__(self, description, grid_args, n_workers=4,
+                 max_retries=3):
+        super().__init__(description, QgsTask.CanCancel)
+        self.grid_args = grid_args
+        self.n_workers = max(1, int(n_workers))
+        self.max_retries = max_retries
+        self.n_failed = 0
+        self.exception = None
+
+    def set_progress(self, progress, n_steps):
+        """Set progress."""
+        if progress == 0:
+            self.setProgress(1)
+        else:
+            prog_perc = progress / n_steps
+            prog_perc = int(prog_perc * 100)
+            self.setProgress(prog_perc)
+
+    def get_cache_key(self):
+        """Get the cache key from grid arguments."""
+        gra = self.grid_args
+        key = {
+            "source": gra.get("source"),
+            "years": list(gra.get("years", [])),
+            "perc": gra.get("perc"),
+            "scale": gra["scale"],
+            "proj": gra["proj"],
+        }
+        return key
+
+    def download(self, index, ext, cache):
+        """Download one tile and update the cache."""
+        if self.isCanceled():
+            return False
+        try:
+            attempts = download_tile(
+                index, ext, self.grid_args,
+                max_retries=self.max_retries)
+        except Exception as exc:
+            cache.update(index, ext, "failed",
+                         getattr(exc, "attempts", 1), error=str(exc))
+            raise
+        if cache.update(index, ext, "done", attempts) != "done":
+            msg = "Invalid tile: {error}"
+            raise RuntimeError(msg.format(
+                error=cache.tiles[str(index)]["error"]))
+        return True
+
+    def run(self):
+        """Get forest cover change tiles."""
+
+        try:
+            # Starting message
+            msg = 'Started task "{name}"'
+            msg = msg.format(name=self.description())
+            QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY, Qgis.Info)
+
+            # Tiles to download
+            grid = self.grid_args["grid"]
+            out_dir_tiles = self.grid_args["out_dir_tiles"]
+            cache = TileCache(out_dir_tiles, self.get_cache_key())
+            cache.prune(len(grid))
+            todo = []
+            for (i, ext) in enumerate(grid):
+                if not cache.is_valid(i, ext):
+                    # Remove missing, stale or corrupt tile
+                    ofile = cache.tile_file(i)
+                    if os.path.isfile(ofile):
+                        os.remove(ofile)
+                    todo.append((i, ext))
+            cache.save()
+
+            # Progress
+            n_steps = len(grid)
+            progress = n_steps - len(todo)
+            self.set_progress(progress, n_steps)
+
+            # Download tiles with bounded concurrency
+            with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+                futures = {
+                    pool.submit(self.download, i, ext, cache): i
+                    for (i, ext) in todo
+                }
+                for future in as_completed(futures):
+                    # Check isCanceled() to handle cancellation
+                    if self.isCanceled():
+                        for fut in futures:
+                            fut.cancel()
+                        return False
+                    if future.exception() is not None:
+                        self.n_failed += 1
+                        msg = "Tile {index} failed: {exception}"
+                        msg = msg.format(index=futures[future],
+                                         exception=future.exception())
+                        QgsMessageLog.logMessage(
+                            msg, self.MESSAGE_CATEGORY, Qgis.Warning)
+                    # Progress
+                    progress += 1
+                    self.set_progress(progress, n_steps)
+
+            # Raise if some tiles are missing
+            if self.n_failed > 0:
+                msg = ("{n} tile(s) could not be downloaded, "
+                       "run the task again to resume (see {file})")
+                msg = msg.format(n=self.n_failed, file=cache.manifest_file)
+                raise RuntimeError(msg)
+
+        except Exception as exc:
+            self.exception = exc
+            return False
+
+        return True
+
+    def finished(self, result):
+        """Show messages."""
+
+        if result:
+            # Message
+            msg = 'Successful task "{name}"'
+            msg = msg.format(name=self.description())
+            QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY, Qgis.Success)
+
+        else:
+            if self.exception is None:
+                msg = ('FarGetFccTilesTask "{name}" not successful but without '
+                       'exception (probably the task was manually '
+                       'canceled by the user)')
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(
+                    msg, self.MESSAGE_CATEGORY, Qgis.Warning)
+            else:
+                msg = 'FarGetFccTilesTask "{name}" Exception: {exception}'
+                msg = msg.format(
+                        name=self.description(),
+                        exception=self.exception)
+                QgsMessageLog.logMessage(
+                    msg, self.MESSAGE_CATEGORY, Qgis.Critical)
+                raise self.exception
+
+    def cancel(self):
+        """Cancelation message."""
+        msg = 'FarGetFccTilesTask "{name}" was canceled'
+        msg = msg.format(name=self.description())
+        QgsMessageLog.logMessage(
+            msg, self.MESSAGE_CATEGORY, Qgis.Info)
+        super().cancel()
+
+# End of file
@@ -28,6 +28,13 @@ import forestatrisk as far
 
 # Local import
 from ..utilities import add_layer, add_layer_to_group
+from ..engines import (get_aoi_extent, compute_forest_from_tiles,
+                       preview_workdir, build_level)
+from ..engines.variables import (SOURCES, GROUPS, FOREST_FILES,
+                                 source_files, group_files,
+                                 download_source, compute_aoi,
+                                 compute_groups)
+from ..artifact_cache import ArtifactCache
 
 # Alias
 opj = os.path.join
@@ -74,10 +81,11 @@ class FarGetVariablesTask(QgsTask):
     DATA = "data"
     DATA_RAW = "data_raw"
     MESSAGE_CATEGORY = "Deforisk"
-    N_STEPS = 3
+    N_STEPS = 4
 
     def __init__(self, description, iface, workdir, get_fcc_args,
-                 isocode, gc_project, wdpa_key, proj):
+                 isocode, gc_project, wdpa_key, proj, pyramid_levels=None,
+                 n_workers=1):
         super().__init__(description, QgsTask.CanCancel)
         self.iface = iface
         self.workdir = workdir
@@ -86,6 +94,8 @@ class FarGetVariablesTask(QgsTask):
         self.gc_project = gc_project
         self.wdpa_key = wdpa_key
         self.proj = proj
+        self.pyramid_levels = pyramid_levels or []
+        self.n_workers = n_workers
         self.exception = None
 
     def ee_initialize(self):
@@ -144,6 +154,76 @@ class FarGetVariablesTask(QgsTask):
                                  "forest_latlon.tif")
         return gfa
 
+    def get_aoi_artifacts(self, gadm):
+        """Get artifacts of the area of interest."""
+        if gadm:
+            inputs = source_files("gadm", self.DATA_RAW, self.isocode)
+        else:
+            inputs = [opj(self.DATA_RAW, "aoi_latlon.gpkg")]
+        artifacts = {"stage": "variables_aoi", "inputs": inputs,
+                     "params": {"proj": self.proj, "gadm": gadm},
+                     "outputs": [opj(self.DATA, "aoi_proj.gpkg")]}
+        return artifacts
+
+    def get_group_artifacts(self, group):
+        """Get artifacts of a group of variables.
+
+        Variables depend on their raw data, the area of interest
+        (extent) and the projection only.
+        """
+        inputs = [opj(self.DATA, "aoi_proj.gpkg")]
+        source = GROUPS[group]["source"]
+        if source is not None:
+            inputs += source_files(source, self.DATA_RAW, self.isocode)
+        artifacts = {"stage": f"variables_{group}", "inputs": inputs,
+                     "params": {"proj": self.proj,
+                                "isocode": self.isocode},
+                     "outputs": group_files(group, self.DATA,
+                                            self.isocode)}
+        return artifacts
+
+    def get_forest_artifacts(self):
+        """Get artifacts of forest variables."""
+        # Tile manifest includes tile checksums
+        inputs = [opj(self.DATA_RAW, "forest_tiles",
+                      "tiles_manifest.json"),
+                  opj(self.DATA, "aoi_proj.gpkg")]
+        artifacts = {"stage": "variables_forest", "inputs": inputs,
+                     "params": {"proj": self.proj},
+                     "outputs": [opj(self.DATA, i) for i in FOREST_FILES]}
+        return artifacts
+
+    def get_level_artifacts(self, res):
+        """Get artifacts of a pyramid level."""
+        level_dir = os.path.relpath(preview_workdir(self.workdir, res),
+                                    self.workdir)
+        artifacts = {"stage": f"pyramid_{float(res):g}m",
+                     "inputs": [self.DATA],
+                     "params": {"res": res, "forest": "fcc123"},
+                     "outputs": [opj(level_dir, self.DATA)]}
+        return artifacts
+
+    def build_pyramid(self, cache, style_dir):
+        """Build aggregated levels of variables for preview runs."""
+        for res in self.pyramid_levels:
+            level_workdir = preview_workdir(self.workdir, res)
+            artifacts = self.get_level_artifacts(res)
+            if not cache.is_fresh(**artifacts):
+                build_level(self.DATA, opj(level_workdir, self.DATA), res)
+                cache.record(**artifacts)
+            # Layer styles and data for each period
+            dst_dir = opj(level_workdir, "qgis_layer_style")
+            if os.path.exists(dst_dir):
+                shutil.rmtree(dst_dir)
+            shutil.copytree(style_dir, dst_dir)
+            os.chdir(level_workdir)
+            far.create_symbolic_links(self.DATA)
+            os.chdir(self.workdir)
+            # Check isCanceled() to handle cancellation
+            if self.isCanceled():
+                return False
+        return True
+
     def set_progress(self, progress, n_steps):
         """Set progress."""
         if progress == 0:
@@ -183,59 +263,99 @@ class FarGetVariablesTask(QgsTask):
                 shutil.rmtree(dst_dir)
             shutil.copytree(src_dir, dst_dir)
 
-            # Check existence of rasters
-            fcc_file = opj(self.DATA, "fcc12.tif")
-            if not os.path.isfile(fcc_file):
-
-                # Initialize EE
-                self.ee_initialize()
-
-                # Set WDPA_KEY
-                self.set_wdpa_key()
-
-                # Check if we need GADM
-                # If aoi is file, copy it to data_raw
-                # and set gadm to False
-                gadm = True
-                aoi = self.get_fcc_args["aoi"]
-                if os.path.isfile(aoi):
-                    gadm = False
-                    ofile = opj(self.DATA_RAW, "aoi_latlon.gpkg")
-                    shutil.copy(aoi, ofile)
-
-                # Download data
-                far.data.country_download(
-                    get_fcc_args=self.reformat_get_fcc_args(),
-                    iso3=self.isocode,
-                    output_dir=self.DATA_RAW,
-                    gadm=gadm,
-                    forest=False)  # See task with geefcc
+            # Each group of variables is skipped if up to date
+            # (see engines.variables)
+            cache = ArtifactCache(self.workdir)
+
+            # If aoi is file, copy it to data_raw
+            # and set gadm to False
+            gadm = True
+            aoi = self.get_fcc_args["aoi"]
+            if os.path.isfile(aoi):
+                gadm = False
+                ofile = opj(self.DATA_RAW, "aoi_latlon.gpkg")
+                shutil.copy(aoi, ofile)
+
+            # Download missing data only (raw files replaced by
+            # the user, e.g. a new WDPA snapshot, are kept)
+            sources = [i for i in SOURCES if gadm or i != "gadm"]
+            credentials_set = False
+            for source in sources:
+                raw_files = source_files(source, self.DATA_RAW,
+                                         self.isocode)
+                if all(os.path.isfile(i) for i in raw_files):
+                    continue
+                if not credentials_set:
+                    # Initialize EE and set WDPA_KEY once
+                    self.ee_initialize()
+                    self.set_wdpa_key()
+                    credentials_set = True
+                download_source(source, self.reformat_get_fcc_args(),
+                                self.isocode, self.DATA_RAW)
 
                 # Check isCanceled() to handle cancellation
                 if self.isCanceled():
                     return False
 
-                # Progress
-                progress += 1
-                self.set_progress(progress, self.N_STEPS)
+            # Progress
+            progress += 1
+            self.set_progress(progress, self.N_STEPS)
 
-                # Compute explanatory variables
-                far.data.country_compute(
-                    iso3=self.isocode,
-                    temp_dir=self.DATA_RAW,
-                    output_dir=self.DATA,
-                    proj=self.proj,
-                    data_country=True,
-                    data_forest=True,
-                    keep_temp_dir=True)
+            # Area of interest
+            artifacts = self.get_aoi_artifacts(gadm)
+            if not cache.is_fresh(**artifacts):
+                compute_aoi(self.DATA_RAW, self.DATA, self.proj,
+                            self.isocode, gadm)
+                cache.record(**artifacts)
+            aoi_file = opj(self.DATA_RAW, "aoi_proj.gpkg")
+            extent = get_aoi_extent(aoi_file)
+
+            # Compute explanatory variables of outdated groups
+            # in parallel
+            groups = [i for i in GROUPS
+                      if not cache.is_fresh(**self.get_group_artifacts(i))]
+            if groups:
+                msg = f"Computing variables of groups {groups}"
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+            for group in compute_groups(groups, self.DATA_RAW, self.DATA,
+                                        self.proj, extent, self.isocode,
+                                        n_workers=self.n_workers):
+                cache.record(**self.get_group_artifacts(group))
 
                 # Check isCanceled() to handle cancellation
                 if self.isCanceled():
                     return False
 
-                # Progress
-                progress += 1
-                self.set_progress(progress, self.N_STEPS)
+            # Progress
+            progress += 1
+            self.set_progress(progress, self.N_STEPS)
+
+            # Compute forest variables streaming forest tiles
+            # (no full-size intermediate rasters)
+            artifacts = self.get_forest_artifacts()
+            if not cache.is_fresh(**artifacts):
+                compute_forest_from_tiles(
+                    tiles_dir=opj(self.DATA_RAW, "forest_tiles"),
+                    aoi_file=aoi_file,
+                    proj=self.proj,
+                    extent=extent,
+                    output_dir=self.DATA,
+                    temp_dir=self.DATA_RAW,
+                    n_workers=self.n_workers)
+                cache.record(**artifacts)
+
+            # Check isCanceled() to handle cancellation
+            if self.isCanceled():
+                return False
+
+            # Progress
+            progress += 1
+            self.set_progress(progress, self.N_STEPS)
+
+            # Aggregated variables for preview runs
+            if not self.build_pyramid(cache, src_dir):
+                return False
 
         except Exception as exc:
             self.exception = exc
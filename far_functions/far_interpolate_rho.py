@@ -22,6 +22,9 @@ from qgis.core import (
 
 import forestatrisk as far
 
+# Local import
+from ..artifact_cache import ArtifactCache
+
 # Alias
 opj = os.path.join
 
@@ -60,6 +63,17 @@ class FarInterpolateRhoTask(QgsTask):
             mod_icar_pickle = pickle.load(file)
             return mod_icar_pickle
 
+    def get_artifacts(self):
+        """Get stage name, inputs, parameters and outputs."""
+        inputs = [opj(self.outdir, "mod_icar.pickle"),
+                  opj(self.outdir, "csize_icar.txt"),
+                  opj(self.datadir, "fcc.tif")]
+        params = {"csize_interpolate": self.csize_interpolate}
+        artifacts = {"stage": f"far_interpolate_rho_{self.period}",
+                     "inputs": inputs, "params": params,
+                     "outputs": [opj(self.outdir, "rho.tif")]}
+        return artifacts
+
     def set_progress(self, progress, n_steps):
         """Set progress."""
         if progress == 0:
@@ -97,7 +111,9 @@ class FarInterpolateRhoTask(QgsTask):
                 csize_icar = f.read()
                 csize_icar = float(csize_icar)
             ofile = opj(self.outdir, "rho.tif")
-            if not os.path.isfile(ofile):
+            cache = ArtifactCache(self.workdir)
+            artifacts = self.get_artifacts()
+            if not cache.is_fresh(**artifacts):
                 rho = mod_icar_pickle["rho"]
                 far.interpolate_rho(
                     rho=rho,
@@ -105,6 +121,7 @@ class FarInterpolateRhoTask(QgsTask):
                     output_file=ofile,
                     csize_orig=csize_icar,
                     csize_new=self.csize_interpolate)
+                cache.record(**artifacts)
 
             # Check isCanceled() to handle cancellation
             if self.isCanceled():
@@ -20,14 +20,17 @@ from qgis.core import (
     QgsVectorLayer, QgsRasterLayer, QgsMessageLog
 )
 
+import numpy as np
+from osgeo import gdal
 import matplotlib.pyplot as plt
-from patsy.highlevel import dmatrices
-import pandas as pd
-import joblib
 import forestatrisk as far
 
 # Local import
 from ..utilities import add_layer, add_layer_to_group
+from ..artifact_cache import ArtifactCache
+from ..engines import (predict_raster, predict_block_memory,
+                       plan_blk_rows, N_CAT, write_defrate_per_cat,
+                       design_spec, load_design_spec, read_sample)
 
 # Alias
 opj = os.path.join
@@ -42,15 +45,16 @@ class FarPredictTask(QgsTask):
     MESSAGE_CATEGORY = "Deforisk"
     N_STEPS = 3
 
-    def __init__(self, description, iface, workdir, years, model,
-                 period):
+    def __init__(self, description, iface, workdir, years, models,
+                 period, n_workers=1):
         """Initialize the class."""
         super().__init__(description, QgsTask.CanCancel)
         self.iface = iface
         self.workdir = workdir
         self.years = years
-        self.model = model
+        self.models = [models] if isinstance(models, str) else list(models)
         self.period = period
+        self.n_workers = max(1, int(n_workers))
         self.datadir = f"data_{self.period}"
         self.moddir = self.get_moddir()
         self.outdir = opj(self.OUT, self.period)
@@ -104,37 +108,50 @@ class FarPredictTask(QgsTask):
             mod_icar_pickle = pickle.load(file)
             return mod_icar_pickle
 
-    def get_design_info(self, mod_icar_pickle, dataset_file):
-        """Get design info from patsy."""
-        formula_icar = mod_icar_pickle["formula"]
-        dataset = pd.read_csv(dataset_file)
-        dataset = dataset.dropna(axis=0)
-        dataset["trial"] = 1
-        y, x = dmatrices(formula_icar, dataset, 0, "drop")
-        y_design_info = y.design_info
-        x_design_info = x.design_info
-        return (y_design_info, x_design_info)
-
-    def get_model(self, mod_icar_pickle,
-                  y_design_info, x_design_info):
-        """Get model."""
-        if self.model == "icar":
-            # Create icar_model object for predictions
-            mod = far.icarModelPred(
-                formula=mod_icar_pickle["formula"],
-                _y_design_info=y_design_info,
-                _x_design_info=x_design_info,
-                betas=mod_icar_pickle["betas"],
-                rho=mod_icar_pickle["rho"])
-        if self.model == "glm":
-            ifile = opj(self.moddir, "mod_glm.pickle")
-            with open(ifile, "rb") as file:
-                mod = pickle.load(file)
-        if self.model == "rf":
-            ifile = opj(self.moddir, "mod_rf.joblib")
-            with open(ifile, "rb") as file:
-                mod = joblib.load(file)
-        return mod
+    def get_design_spec(self, formula):
+        """Get the design specification of the models."""
+        ifile = opj(self.moddir, "design_info.json")
+        if os.path.isfile(ifile):
+            return load_design_spec(ifile)
+        # Models calibrated without design specification
+        return design_spec(formula, read_sample(self.moddir))
+
+    def get_pixel_area(self, ifile):
+        """Get pixel area (in ha)."""
+        r = gdal.Open(ifile)
+        gt = r.GetGeoTransform()
+        del r
+        return gt[1] * (-gt[5]) / 10000
+
+    def get_model_file(self, model):
+        """Get model file."""
+        model_files = {"icar": "mod_icar.pickle",
+                       "glm": "mod_glm.pickle",
+                       "rf": "mod_rf.joblib"}
+        return opj(self.moddir, model_files[model])
+
+    def get_artifacts(self, model):
+        """Get stage name, inputs, parameters and outputs of a model."""
+        date = self.get_date()
+        inputs = [self.datadir,
+                  opj(self.DATA, f"forest_{date}.tif"),
+                  opj(self.DATA, "fcc123.tif"),
+                  opj(self.moddir, "mod_icar.pickle"),
+                  opj(self.moddir, "design_info.json")]
+        if model == "icar":
+            inputs.append(opj(self.moddir, "rho.tif"))
+        elif model == "glm":
+            inputs.append(opj(self.moddir, "mod_glm.pickle"))
+        elif model == "rf":
+            inputs.append(opj(self.moddir, "mod_rf.joblib"))
+        params = {"years": self.years}
+        outputs = [
+            opj(self.outdir, f"prob_{model}_{date}.tif"),
+            opj(self.outdir, f"defrate_cat_{model}_{self.period}.csv")]
+        artifacts = {"stage": f"far_predict_{model}_{self.period}",
+                     "inputs": inputs, "params": params,
+                     "outputs": outputs}
+        return artifacts
 
     def plot_prob(self, model, date):
         """Plot probability of deforestation."""
@@ -175,51 +192,60 @@ class FarPredictTask(QgsTask):
             # Set working directory
             os.chdir(self.workdir)
 
+            # Skip models whose outputs are up to date
+            cache = ArtifactCache(self.workdir)
+            artifacts = {model: self.get_artifacts(model)
+                         for model in self.models}
+            models = [model for model in self.models
+                      if not cache.is_fresh(**artifacts[model])]
+            if len(models) == 0:
+                msg = 'Predictions of task "{name}" are up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
+
             # Compute time interval from years
             time_interval = self.get_time_interval()
 
-            # Get design info
+            # Get iCAR model (for the formula)
             mod_icar_pickle = self.get_icar_model(
                 pickle_file=opj(self.moddir, "mod_icar.pickle"))
             if not mod_icar_pickle:
                 return False
-            (y_design_info, x_design_info) = self.get_design_info(
-                mod_icar_pickle, dataset_file=opj(self.moddir, "sample.txt"))
-
-            # Get model
-            mod = self.get_model(mod_icar_pickle, y_design_info,
-                                 x_design_info)
 
             # Date
             date = self.get_date()
 
-            # Compute predictions
-            if self.model == "icar":
-                far.predict_raster_binomial_iCAR(
-                    model=mod,
-                    var_dir=self.datadir,
-                    input_cell_raster=opj(self.moddir, "rho.tif"),
-                    input_forest_raster=opj(
-                        self.DATA,
-                        f"forest_{date}.tif"),
-                    output_file=opj(
-                        self.outdir,
-                        f"prob_icar_{date}.tif"),
-                    blk_rows=10,
-                    verbose=False)
-            elif self.model in ["glm", "rf"]:
-                far.predict_raster(
-                    model=mod,
-                    _x_design_info=x_design_info,
-                    var_dir=self.datadir,
-                    input_forest_raster=opj(
-                        self.DATA,
-                        f"forest_{date}.tif"),
-                    output_file=opj(
-                        self.outdir,
-                        f"prob_{self.model}_{date}.tif"),
-                    blk_rows=10,
-                    verbose=False)
+            # Compute predictions of all models in one pass by block
+            # in parallel, counting pixels per category of
+            # deforestation risk on the fly
+            forest_file = opj(self.DATA, f"forest_{date}.tif")
+            cell_file = opj(self.moddir, "rho.tif")
+            fcc_file = opj(self.DATA, "fcc123.tif")
+            blk_rows = plan_blk_rows(
+                [self.datadir, forest_file, cell_file, fcc_file],
+                n_workers=self.n_workers, **predict_block_memory(len(models)))
+            counts = {model: np.zeros((2, N_CAT + 1), dtype=np.int64)
+                      for model in models}
+            complete = predict_raster(
+                models={model: self.get_model_file(model)
+                        for model in models},
+                spec=self.get_design_spec(mod_icar_pickle["formula"]),
+                var_dir=self.datadir,
+                forest_raster=forest_file,
+                output_files={
+                    model: opj(self.outdir, f"prob_{model}_{date}.tif")
+                    for model in models},
+                cell_raster=cell_file,
+                fcc_raster=fcc_file,
+                period=self.period,
+                counts=counts,
+                blk_rows=blk_rows,
+                n_workers=self.n_workers,
+                is_canceled=self.isCanceled)
+            if not complete:
+                return False
 
             # Check isCanceled() to handle cancellation
             if self.isCanceled():
@@ -230,18 +256,18 @@ class FarPredictTask(QgsTask):
             self.set_progress(progress, self.N_STEPS)
 
             # Compute deforestation rate per category
-            far.defrate_per_cat(
-                fcc_file=opj(self.DATA, "fcc123.tif"),
-                riskmap_file=opj(
-                    self.outdir,
-                    f"prob_{self.model}_{date}.tif"),
-                time_interval=time_interval,
-                period=self.period,
-                tab_file_defrate=opj(
-                    self.outdir,
-                    f"defrate_cat_{self.model}_{self.period}.csv"),
-                blk_rows=128,
-                verbose=False)
+            # (same table as far.defrate_per_cat)
+            pixel_area = self.get_pixel_area(fcc_file)
+            for model in models:
+                write_defrate_per_cat(
+                    counts=counts[model],
+                    time_interval=time_interval,
+                    pixel_area=pixel_area,
+                    tab_file_defrate=opj(
+                        self.outdir,
+                        f"defrate_cat_{model}_{self.period}.csv"))
+                # Record artifacts
+                cache.record(**artifacts[model])
 
             # Progress
             progress += 1
@@ -259,7 +285,8 @@ class FarPredictTask(QgsTask):
         if result:
             # Plot
             date = self.get_date()
-            self.plot_prob(model=self.model, date=date)
+            for model in self.models:
+                self.plot_prob(model=model, date=date)
 
             # Qgis project and group
             far_project = QgsProject.instance()
@@ -277,15 +304,16 @@ class FarPredictTask(QgsTask):
             add_layer(far_project, border_layer)
 
             # Add prob layers to QGis project
-            prob_file = opj(self.outdir, f"prob_{self.model}_{date}.tif")
-            prob_layer = QgsRasterLayer(
-                prob_file,
-                f"prob_{self.model}_{date}_{self.period}",
-            )
-            prob_layer.loadNamedStyle(opj("qgis_layer_style",
-                                          "prob.qml"))
-            add_layer_to_group(far_project, predict_group,
-                               prob_layer)
+            for model in self.models:
+                prob_file = opj(self.outdir, f"prob_{model}_{date}.tif")
+                prob_layer = QgsRasterLayer(
+                    prob_file,
+                    f"prob_{model}_{date}_{self.period}",
+                )
+                prob_layer.loadNamedStyle(opj("qgis_layer_style",
+                                              "prob.qml"))
+                add_layer_to_group(far_project, predict_group,
+                                   prob_layer)
 
             # Progress
             self.set_progress(self.N_STEPS, self.N_STEPS)
@@ -26,6 +26,10 @@ import forestatrisk as far
 
 # Local import
 from ..utilities import add_layer_to_group
+from ..artifact_cache import ArtifactCache
+from ..engines import (write_sample, read_sample, sample_observations,
+                       plan_blk_rows)
+from ..engines.samples import PARQUET_FILE, CSV_FILE
 
 # Alias
 opj = os.path.join
@@ -41,7 +45,8 @@ class FarSampleObsTask(QgsTask):
     N_STEPS = 2
 
     def __init__(self, description, iface, workdir, period, proj,
-                 nsamp, adapt, seed, csize):
+                 nsamp, adapt, seed, csize, export_csv=True,
+                 n_workers=1):
         super().__init__(description, QgsTask.CanCancel)
         self.iface = iface
         self.workdir = workdir
@@ -51,11 +56,28 @@ class FarSampleObsTask(QgsTask):
         self.adapt = adapt
         self.seed = seed
         self.csize = csize
+        self.export_csv = export_csv
+        self.n_workers = n_workers
         self.dataset = pd.DataFrame()
         self.datadir = f"data_{self.period}"
         self.outdir = opj(self.OUT, self.period)
         self.exception = None
 
+    def get_artifacts(self):
+        """Get stage name, inputs, parameters and outputs."""
+        params = {"nsamp": self.nsamp, "adapt": self.adapt,
+                  "seed": self.seed, "csize": self.csize,
+                  "export_csv": self.export_csv}
+        outputs = [opj(self.outdir, PARQUET_FILE),
+                   opj(self.outdir, "sample_size.csv"),
+                   opj(self.outdir, "csize_icar.txt")]
+        if self.export_csv:
+            outputs.append(opj(self.outdir, CSV_FILE))
+        artifacts = {"stage": f"sample_obs_{self.period}",
+                     "inputs": [self.datadir],
+                     "params": params, "outputs": outputs}
+        return artifacts
+
     def set_progress(self, progress, n_steps):
         """Set progress."""
         if progress == 0:
@@ -92,15 +114,40 @@ class FarSampleObsTask(QgsTask):
                 self.exception = msg
                 return False
 
-            # Sample observations
-            dataset = far.sample(
+            # Skip sampling if observations are up to date
+            cache = ArtifactCache(self.workdir)
+            artifacts = self.get_artifacts()
+            if cache.is_fresh(**artifacts):
+                self.dataset = read_sample(self.outdir)
+                msg = 'Observations of task "{name}" are up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
+
+            # Sample observations by block in parallel (the sample
+            # does not depend on the block size)
+            blk_rows = plan_blk_rows([self.datadir],
+                                     n_workers=self.n_workers)
+            dataset = sample_observations(
                 nsamp=self.nsamp, adapt=self.adapt,
                 seed=self.seed, csize=self.csize,
                 var_dir=self.datadir,
-                input_forest_raster="fcc.tif",
-                output_file=opj(self.outdir, "sample.txt"),
-                blk_rows=0,
-                verbose=True)
+                forest_raster=fcc_file,
+                blk_rows=blk_rows,
+                n_workers=self.n_workers,
+                is_canceled=self.isCanceled)
+            if dataset is None:
+                return False
+
+            # Save csize for interpolation of rhos
+            ifile = opj(self.outdir, "csize_icar.txt")
+            with open(ifile, "w", encoding="utf-8") as file:
+                file.write(str(float(self.csize)))
+
+            # Typed columnar storage, the CSV file is only kept
+            # for display in QGis
+            write_sample(dataset, self.outdir, export_csv=self.export_csv)
 
             # Remove NA from data-set (otherwise scale() and
             # model_binomial_iCAR don't work)
@@ -125,6 +172,9 @@ class FarSampleObsTask(QgsTask):
             print("\n"
                   f"Sample size: ndefor = {ndefor}, nfor = {nfor}")
 
+            # Record artifacts
+            cache.record(**artifacts)
+
             # Check isCanceled() to handle cancellation
             if self.isCanceled():
                 return False
@@ -173,21 +223,23 @@ class FarSampleObsTask(QgsTask):
                 var_group = root.addGroup("Variables")
 
             # Add layer of sampled observations to QGis project
-            samp_file = opj(self.workdir, self.outdir,
-                            "sample.txt")
-            encoding = "UTF-8"
-            delimiter = ","
-            decimal = "."
-            x = "X"
-            y = "Y"
-            uri = (f"file:///{samp_file}?encoding={encoding}"
-                   f"&delimiter={delimiter}&decimalPoint={decimal}"
-                   f"&crs={self.proj}&xField={x}&yField={y}")
-            layer_name = f"sampled_obs_{self.period}"
-            samp_layer = QgsVectorLayer(uri, layer_name, "delimitedtext")
-            samp_layer.loadNamedStyle(opj("qgis_layer_style",
-                                          "sample.qml"))
-            add_layer_to_group(far_project, var_group, samp_layer)
+            # (only with the CSV export)
+            samp_file = opj(self.workdir, self.outdir, CSV_FILE)
+            if self.export_csv and os.path.isfile(samp_file):
+                encoding = "UTF-8"
+                delimiter = ","
+                decimal = "."
+                x = "X"
+                y = "Y"
+                uri = (f"file:///{samp_file}?encoding={encoding}"
+                       f"&delimiter={delimiter}&decimalPoint={decimal}"
+                       f"&crs={self.proj}&xField={x}&yField={y}")
+                layer_name = f"sampled_obs_{self.period}"
+                samp_layer = QgsVectorLayer(uri, layer_name,
+                                            "delimitedtext")
+                samp_layer.loadNamedStyle(opj("qgis_layer_style",
+                                              "sample.qml"))
+                add_layer_to_group(far_project, var_group, samp_layer)
 
             # Progress
             self.set_progress(self.N_STEPS, self.N_STEPS)
@@ -4,6 +4,7 @@ import matplotlib
 
 from .bm_calibrate import BmCalibrateTask
 from .bm_predict import BmPredictTask
+from .dist_thresh import DistThreshTask
 from .mw_calibrate import MwCalibrateTask
 from .mw_predict import MwPredictTask
 
@@ -10,13 +10,20 @@ from qgis.core import (
     QgsVectorLayer, QgsRasterLayer, QgsMessageLog
 )
 
-import numpy as np
 import pandas as pd
+from osgeo import gdal
 import matplotlib.pyplot as plt
 import riskmapjnr as rmj
 
 # Local import
 from ..utilities import add_layer, add_layer_to_group
+from ..artifact_cache import ArtifactCache
+from ..engines import plan_blk_rows
+from ..engines.riskmap import (
+    riskmap_defrate, pixel_area_ha,
+    write_bm_defrate_per_class
+)
+from .dist_thresh import copy_dist_thresh
 
 # Alias
 opj = os.path.join
@@ -29,16 +36,13 @@ class BmCalibrateTask(QgsTask):
     DATA = "data"
     OUT = opj("outputs", "rmj_benchmark")
     MESSAGE_CATEGORY = "Deforisk"
-    N_STEPS = 5
+    N_STEPS = 4
 
-    def __init__(self, description, workdir, years, defor_thresh,
-                 max_dist, period):
+    def __init__(self, description, workdir, years, period):
         """Initialize the class."""
         super().__init__(description, QgsTask.CanCancel)
         self.workdir = workdir
         self.years = years
-        self.defor_thresh = defor_thresh
-        self.max_dist = max_dist
         self.period = period
         self.datadir = f"data_{self.period}"
         self.outdir = opj(self.OUT, self.period)
@@ -66,14 +70,61 @@ class BmCalibrateTask(QgsTask):
             time_interval = years[2] - years[0]
         return time_interval
 
-    def get_defor_values(self):
-        """Get defor values from period."""
-        defor_values = None
-        if self.period == "calibration":
-            defor_values = 1
-        elif self.period == "historical":
-            defor_values = [1, 2]
-        return defor_values
+    def get_subj_file(self):
+        """Get the raster of subjurisdictions (shared by periods)."""
+        return opj(self.OUT, "subj.tif")
+
+    def get_subj_artifacts(self):
+        """Get artifacts of the subjurisdiction stage.
+
+        The raster only depends on the area of interest and on the
+        grid of the forest rasters, which is given as parameters.
+        """
+        fcc_ds = gdal.Open(opj(self.DATA, "fcc123.tif"))
+        grid = {"gt": list(fcc_ds.GetGeoTransform()),
+                "size": [fcc_ds.RasterXSize, fcc_ds.RasterYSize],
+                "proj": fcc_ds.GetProjectionRef()}
+        del fcc_ds
+        artifacts = {"stage": "bm_subj",
+                     "inputs": [opj(self.DATA, "aoi_proj.gpkg")],
+                     "params": {"grid": grid},
+                     "outputs": [self.get_subj_file()]}
+        return artifacts
+
+    def rasterize_subj(self, cache):
+        """Rasterize subjurisdictions if the raster is not up to date.
+
+        Periods may be calibrated concurrently: the raster is written
+        to a temporary file which then replaces the raster.
+        """
+        artifacts = self.get_subj_artifacts()
+        if cache.is_fresh(**artifacts):
+            return
+        subj_file = self.get_subj_file()
+        tmp_file = f"{subj_file}.{self.period}.tmp.tif"
+        rmj.benchmark.rasterize_subjurisdictions(
+            input_file=opj(self.DATA, "aoi_proj.gpkg"),
+            fcc_file=opj(self.DATA, "fcc123.tif"),
+            output_file=tmp_file,
+            verbose=False)
+        os.replace(tmp_file, subj_file)
+        cache.record(**artifacts)
+
+    def get_artifacts(self):
+        """Get stage name, inputs, parameters and outputs."""
+        inputs = [opj(self.DATA, "fcc123.tif"),
+                  opj(self.DATA, "forest_t1.tif"),
+                  self.get_subj_file(),
+                  opj(self.datadir, "dist_edge.tif"),
+                  opj(self.outdir, "dist_edge_threshold.csv")]
+        params = {"years": self.years}
+        outputs = [opj(self.outdir, "dist_bins.csv"),
+                   opj(self.outdir, "prob_bm_t1.tif"),
+                   opj(self.outdir, f"defrate_cat_bm_{self.period}.csv")]
+        artifacts = {"stage": f"bm_calibrate_{self.period}",
+                     "inputs": inputs, "params": params,
+                     "outputs": outputs}
+        return artifacts
 
     def plot_prob(self, model, date):
         """Plot probability of deforestation."""
@@ -117,47 +168,12 @@ class BmCalibrateTask(QgsTask):
             # Output directory
             rmj.make_dir(self.outdir)
 
-            # Distance to forest edge threshold
-            fcc_file = opj(self.DATA, "fcc123.tif")
-            ofile = opj(self.outdir, "dist_edge_threshold.csv")
-            if not os.path.isfile(ofile):
-                dist_thresh = rmj.dist_edge_threshold(
-                    fcc_file=fcc_file,
-                    defor_values=self.get_defor_values(),
-                    defor_threshold=self.defor_thresh,
-                    dist_file=opj(self.datadir,
-                                  "dist_edge.tif"),
-                    dist_bins=np.arange(0, self.max_dist, step=30),
-                    tab_file_dist=opj(self.outdir, "tab_dist.csv"),
-                    fig_file_dist=opj(self.outdir,
-                                      "perc_dist.png"),
-                    blk_rows=128,
-                    dist_file_available=True,
-                    check_fcc=False,
-                    verbose=True)
-
-                # Save result
-                dist_edge_data = pd.DataFrame(dist_thresh,
-                                              index=[0])
-                dist_edge_data.to_csv(
-                    ofile,
-                    sep=",", header=True,
-                    index=False, index_label=False)
-
-            # Check isCanceled() to handle cancellation
-            if self.isCanceled():
-                return False
-
-            # Progress
-            progress += 1
-            self.set_progress(progress, self.N_STEPS)
+            # Distance to forest edge threshold (shared stage)
+            copy_dist_thresh(self.period, self.outdir)
+            cache = ArtifactCache(self.workdir)
 
-            # Rasterize subjurisdictions
-            rmj.benchmark.rasterize_subjurisdictions(
-                input_file=opj(self.DATA, "aoi_proj.gpkg"),
-                fcc_file=opj(self.datadir, "fcc.tif"),
-                output_file=opj(self.outdir, "subj.tif"),
-                verbose=False)
+            # Rasterize subjurisdictions (once for all periods)
+            self.rasterize_subj(cache)
 
             # Check isCanceled() to handle cancellation
             if self.isCanceled():
@@ -167,6 +183,15 @@ class BmCalibrateTask(QgsTask):
             progress += 1
             self.set_progress(progress, self.N_STEPS)
 
+            # Skip the model if outputs are up to date
+            artifacts = self.get_artifacts()
+            if cache.is_fresh(**artifacts):
+                msg = 'Outputs of task "{name}" are up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
+
             # Compute bins
             dist_bins = rmj.benchmark.compute_dist_bins(
                 dist_file=opj(self.datadir, "dist_edge.tif"),
@@ -179,40 +204,43 @@ class BmCalibrateTask(QgsTask):
             with open(ofile, "w", encoding="utf-8") as f:
                 f.write("\n".join(dist_bins_str))
 
-            # Compute vulnerability classes at t1
-            rmj.benchmark.vulnerability_map(
-                forest_file=opj(self.DATA, "forest_t1.tif"),
-                dist_file=opj(self.datadir, "dist_edge.tif"),
-                dist_bins=dist_bins,
-                subj_file=opj(self.outdir, "subj.tif"),
+            # Compute vulnerability classes at t1 and count pixels
+            # per class in one pass (same outputs as
+            # rmj.benchmark.vulnerability_map and defrate_per_class)
+            fcc_file = opj(self.DATA, "fcc123.tif")
+            input_files = [opj(self.DATA, "forest_t1.tif"),
+                           opj(self.datadir, "dist_edge.tif"),
+                           self.get_subj_file()]
+            counts = riskmap_defrate(
+                model="bm",
+                input_files=input_files,
+                params={"dist_bins": dist_bins},
                 output_file=opj(self.outdir, "prob_bm_t1.tif"),
-                blk_rows=128,
-                verbose=False)
+                fcc_file=fcc_file,
+                period=self.period,
+                blk_rows=plan_blk_rows(input_files + [fcc_file],
+                                       overhead=8),
+                is_canceled=self.isCanceled)
 
             # Check isCanceled() to handle cancellation
-            if self.isCanceled():
+            if counts is None or self.isCanceled():
                 return False
 
             # Progress
             progress += 1
             self.set_progress(progress, self.N_STEPS)
 
-            # Compute time interval from years
-            time_interval = self.get_time_interval()
-
             # Compute deforestation rate per vulnerability class
-            rmj.benchmark.defrate_per_class(
-                fcc_file=opj(self.DATA, "fcc123.tif"),
-                vulnerability_file=opj(
-                    self.outdir,
-                    "prob_bm_t1.tif"),
-                time_interval=time_interval,
-                period=self.period,
+            write_bm_defrate_per_class(
+                counts=counts,
+                time_interval=self.get_time_interval(),
+                pixel_area=pixel_area_ha(fcc_file),
                 tab_file_defrate=opj(
                     self.outdir,
-                    f"defrate_cat_bm_{self.period}.csv"),
-                blk_rows=128,
-                verbose=False)
+                    f"defrate_cat_bm_{self.period}.csv"))
+
+            # Record artifacts
+            cache.record(**artifacts)
 
             # Progress
             progress += 1
@@ -24,6 +24,12 @@ import riskmapjnr as rmj
 
 # Local import
 from ..utilities import add_layer, add_layer_to_group
+from ..artifact_cache import ArtifactCache
+from ..engines import plan_blk_rows
+from ..engines.riskmap import (
+    riskmap_defrate, pixel_area_ha,
+    write_bm_defrate_per_class
+)
 
 # Alias
 opj = os.path.join
@@ -94,6 +100,28 @@ class BmPredictTask(QgsTask):
             dist_bins = [float(line.rstrip()) for line in f]
         return dist_bins
 
+    def get_artifacts(self):
+        """Get stage name, inputs, parameters and outputs."""
+        date = self.get_date()
+        inputs = [opj(self.DATA, f"forest_{date}.tif"),
+                  opj(self.DATA, "fcc123.tif"),
+                  self.get_dist_file(),
+                  opj(self.moddir, "dist_bins.csv"),
+                  opj(self.OUT, "subj.tif")]
+        if self.period == "validation":
+            inputs.append(opj(self.OUT, "calibration",
+                              "defrate_cat_bm_calibration.csv"))
+        elif self.period == "forecast":
+            inputs.append(opj(self.OUT, "historical",
+                              "defrate_cat_bm_historical.csv"))
+        params = {"years": self.years}
+        outputs = [opj(self.outdir, f"prob_bm_{date}.tif"),
+                   opj(self.outdir, f"defrate_cat_bm_{self.period}.csv")]
+        artifacts = {"stage": f"bm_predict_{self.period}",
+                     "inputs": inputs, "params": params,
+                     "outputs": outputs}
+        return artifacts
+
     def plot_prob(self, model, date):
         """Plot probability of deforestation."""
         prob_file = opj(self.outdir, f"prob_{model}_{date}.tif")
@@ -136,33 +164,46 @@ class BmPredictTask(QgsTask):
             # Create directory
             rmj.make_dir(self.outdir)
 
+            # Skip prediction if outputs are up to date
+            cache = ArtifactCache(self.workdir)
+            artifacts = self.get_artifacts()
+            if cache.is_fresh(**artifacts):
+                msg = 'Predictions of task "{name}" are up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
+
             # Date
             date = self.get_date()
 
-            # Compute vulnerability classes
-            rmj.benchmark.vulnerability_map(
-                forest_file=opj(self.DATA,
-                                f"forest_{date}.tif"),
-                dist_file=self.get_dist_file(),
-                dist_bins=self.get_dist_bins(
-                    opj(self.moddir, "dist_bins.csv")),
-                subj_file=opj(self.moddir, "subj.tif"),
-                output_file=opj(self.outdir,
-                                f"prob_bm_{date}.tif"),
-                blk_rows=128,
-                verbose=False)
+            # Compute vulnerability classes and count pixels per
+            # class in one pass (same outputs as
+            # rmj.benchmark.vulnerability_map and defrate_per_class)
+            fcc_file = opj(self.DATA, "fcc123.tif")
+            input_files = [opj(self.DATA, f"forest_{date}.tif"),
+                           self.get_dist_file(),
+                           opj(self.OUT, "subj.tif")]
+            counts = riskmap_defrate(
+                model="bm",
+                input_files=input_files,
+                params={"dist_bins": self.get_dist_bins(
+                    opj(self.moddir, "dist_bins.csv"))},
+                output_file=opj(self.outdir, f"prob_bm_{date}.tif"),
+                fcc_file=fcc_file,
+                period=self.period,
+                blk_rows=plan_blk_rows(input_files + [fcc_file],
+                                       overhead=8),
+                is_canceled=self.isCanceled)
 
             # Check isCanceled() to handle cancellation
-            if self.isCanceled():
+            if counts is None or self.isCanceled():
                 return False
 
             # Progress
             progress += 1
             self.set_progress(progress, self.N_STEPS)
 
-            # Compute time interval from years
-            time_interval = self.get_time_interval()
-
             # Deforestation rate on model's period
             deforate_model = None
             if self.period == "validation":
@@ -175,19 +216,17 @@ class BmPredictTask(QgsTask):
                     "defrate_cat_bm_historical.csv")
 
             # Compute deforestation rate per vulnerability class
-            rmj.benchmark.defrate_per_class(
-                fcc_file=opj(self.DATA, "fcc123.tif"),
-                vulnerability_file=opj(
-                    self.outdir,
-                    f"prob_bm_{date}.tif"),
-                time_interval=time_interval,
-                period=self.period,
-                deforate_model=deforate_model,
+            write_bm_defrate_per_class(
+                counts=counts,
+                time_interval=self.get_time_interval(),
+                pixel_area=pixel_area_ha(fcc_file),
                 tab_file_defrate=opj(
                     self.outdir,
                     f"defrate_cat_bm_{self.period}.csv"),
-                blk_rows=128,
-                verbose=False)
+                deforate_model=deforate_model)
+
+            # Record artifacts
+            cache.record(**artifacts)
 
             # Progress
             progress += 1
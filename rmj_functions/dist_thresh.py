@@ -0,0 +1,195 @@
+"""
+Distance to forest edge threshold shared by the riskmapjnr models.
+"""
+
+import os
+import shutil
+
+from qgis.core import (
+    Qgis, QgsTask,
+    QgsMessageLog
+)
+
+import numpy as np
+import pandas as pd
+import riskmapjnr as rmj
+
+# Local import
+from ..artifact_cache import ArtifactCache
+from ..engines import plan_blk_rows
+
+# Alias
+opj = os.path.join
+
+# Output directory and files of the distance threshold stage
+OUT = opj("outputs", "rmj_dist_edge")
+FILES = ["dist_edge_threshold.csv", "tab_dist.csv", "perc_dist.png"]
+
+
+def copy_dist_thresh(period, outdir):
+    """Copy the results of the distance threshold stage of a period.
+
+    The benchmark and moving window models keep a copy of the
+    threshold in their output directory. Modification times are kept
+    so that downstream stages are not invalidated.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    for ifile in FILES:
+        shutil.copy2(opj(OUT, period, ifile), outdir)
+
+
+class DistThreshTask(QgsTask):
+    """Compute the distance to forest edge threshold.
+
+    The threshold of a period is computed once and shared by the
+    benchmark model and all the moving window models.
+    """
+
+    # Constants
+    DATA = "data"
+    MESSAGE_CATEGORY = "Deforisk"
+    N_STEPS = 1
+
+    def __init__(self, description, workdir, defor_thresh,
+                 max_dist, period):
+        """Initialize the class."""
+        super().__init__(description, QgsTask.CanCancel)
+        self.workdir = workdir
+        self.defor_thresh = defor_thresh
+        self.max_dist = max_dist
+        self.period = period
+        self.datadir = f"data_{self.period}"
+        self.outdir = opj(OUT, self.period)
+        self.exception = None
+
+    def get_defor_values(self):
+        """Get defor values from period."""
+        defor_values = None
+        if self.period == "calibration":
+            defor_values = 1
+        elif self.period == "historical":
+            defor_values = [1, 2]
+        return defor_values
+
+    def get_artifacts(self):
+        """Get stage name, inputs, parameters and outputs."""
+        inputs = [opj(self.DATA, "fcc123.tif"),
+                  opj(self.datadir, "dist_edge.tif")]
+        params = {"period": self.period,
+                  "defor_thresh": self.defor_thresh,
+                  "max_dist": self.max_dist}
+        outputs = [opj(self.outdir, ifile) for ifile in FILES]
+        artifacts = {"stage": f"dist_thresh_{self.period}",
+                     "inputs": inputs, "params": params,
+                     "outputs": outputs}
+        return artifacts
+
+    def set_progress(self, progress, n_steps):
+        """Set progress."""
+        if progress == 0:
+            self.setProgress(1)
+        else:
+            prog_perc = progress / n_steps
+            prog_perc = int(prog_perc * 100)
+            self.setProgress(prog_perc)
+
+    def run(self):
+        """Compute the distance to forest edge threshold."""
+
+        try:
+            # Starting message
+            msg = 'Started task "{name}"'
+            msg = msg.format(name=self.description())
+            QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY, Qgis.Info)
+
+            # Progress
+            progress = 0
+            self.set_progress(progress, self.N_STEPS)
+
+            # Set working directory
+            os.chdir(self.workdir)
+
+            # Skip the stage if outputs are up to date
+            cache = ArtifactCache(self.workdir)
+            artifacts = self.get_artifacts()
+            if cache.is_fresh(**artifacts):
+                msg = 'Outputs of task "{name}" are up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
+
+            # Output directory
+            os.makedirs(self.outdir, exist_ok=True)
+
+            # Distance to forest edge threshold
+            fcc_file = opj(self.DATA, "fcc123.tif")
+            dist_file = opj(self.datadir, "dist_edge.tif")
+            dist_thresh = rmj.dist_edge_threshold(
+                fcc_file=fcc_file,
+                defor_values=self.get_defor_values(),
+                defor_threshold=self.defor_thresh,
+                dist_file=dist_file,
+                dist_bins=np.arange(0, self.max_dist, step=30),
+                tab_file_dist=opj(self.outdir, "tab_dist.csv"),
+                fig_file_dist=opj(self.outdir, "perc_dist.png"),
+                blk_rows=plan_blk_rows([fcc_file, dist_file]),
+                dist_file_available=True,
+                check_fcc=False,
+                verbose=True)
+
+            # Save result
+            dist_edge_data = pd.DataFrame(dist_thresh, index=[0])
+            dist_edge_data.to_csv(
+                opj(self.outdir, "dist_edge_threshold.csv"),
+                sep=",", header=True,
+                index=False, index_label=False)
+
+            # Record artifacts
+            cache.record(**artifacts)
+
+            # Progress
+            progress += 1
+            self.set_progress(progress, self.N_STEPS)
+
+        except Exception as exc:
+            self.exception = exc
+            return False
+
+        return True
+
+    def finished(self, result):
+        """Show messages."""
+
+        if result:
+            # Message
+            msg = 'Successful task "{name}"'
+            msg = msg.format(name=self.description())
+            QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY, Qgis.Success)
+
+        else:
+            if self.exception is None:
+                msg = ('DistThreshTask "{name}" not successful but without '
+                       'exception (probably the task was manually '
+                       'canceled by the user)')
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(
+                    msg, self.MESSAGE_CATEGORY, Qgis.Warning)
+            else:
+                msg = 'DistThreshTask "{name}" Exception: {exception}'
+                msg = msg.format(
+                        name=self.description(),
+                        exception=self.exception)
+                QgsMessageLog.logMessage(
+                    msg, self.MESSAGE_CATEGORY, Qgis.Critical)
+                raise self.exception
+
+    def cancel(self):
+        """Cancelation message."""
+        msg = 'DistThreshTask "{name}" was canceled'
+        msg = msg.format(name=self.description())
+        QgsMessageLog.logMessage(
+            msg, self.MESSAGE_CATEGORY, Qgis.Info)
+        super().cancel()
+
+# End of file
@@ -19,9 +19,11 @@ from qgis.core import (
     QgsMessageLog
 )
 
-import numpy as np
-import pandas as pd
-import riskmapjnr as rmj
+# Local import
+from ..artifact_cache import ArtifactCache
+from ..engines import plan_blk_rows
+from ..engines.window import local_defor_rate, block_memory
+from .dist_thresh import copy_dist_thresh
 
 # Alias
 opj = os.path.join
@@ -37,16 +39,16 @@ class MwCalibrateTask(QgsTask):
     MESSAGE_CATEGORY = "Deforisk"
     N_STEPS = 2
 
-    def __init__(self, description, workdir, years, defor_thresh,
-                 max_dist, win_size, period):
+    def __init__(self, description, workdir, years, win_sizes, period,
+                 n_workers=1):
         """Initialize the class."""
         super().__init__(description, QgsTask.CanCancel)
         self.workdir = workdir
         self.years = years
-        self.defor_thresh = defor_thresh
-        self.max_dist = max_dist
-        self.win_size = win_size
+        self.win_sizes = ([win_sizes] if isinstance(win_sizes, int)
+                          else list(win_sizes))
         self.period = period
+        self.n_workers = max(1, int(n_workers))
         self.datadir = f"data_{self.period}"
         self.outdir = opj(self.OUT, self.period)
         self.exception = None
@@ -75,6 +77,20 @@ class MwCalibrateTask(QgsTask):
             defor_values = [1, 2]
         return defor_values
 
+    def get_ldefrate_file(self, win_size):
+        """Get the raster of local deforestation rate."""
+        return opj(self.outdir, f"ldefrate_mw_{win_size}.tif")
+
+    def get_artifacts(self, win_size):
+        """Get stage name, inputs, parameters and outputs."""
+        model = f"mw_{win_size}"
+        params = {"years": self.years, "win_size": win_size}
+        artifacts = {"stage": f"{model}_calibrate_{self.period}",
+                     "inputs": [opj(self.DATA, "fcc123.tif")],
+                     "params": params,
+                     "outputs": [self.get_ldefrate_file(win_size)]}
+        return artifacts
+
     def set_progress(self, progress, n_steps):
         """Set progress."""
         if progress == 0:
@@ -101,32 +117,9 @@ class MwCalibrateTask(QgsTask):
             # Set working directory
             os.chdir(self.workdir)
 
-            # Distance to forest edge threshold
-            fcc_file = opj(self.DATA, "fcc123.tif")
-            ofile = opj(self.outdir, "dist_edge_threshold.csv")
-            if not os.path.isfile(ofile):
-                dist_thresh = rmj.dist_edge_threshold(
-                    fcc_file=fcc_file,
-                    defor_values=self.get_defor_values(),
-                    defor_threshold=self.defor_thresh,
-                    dist_file=opj(self.datadir,
-                                  "dist_edge.tif"),
-                    dist_bins=np.arange(0, self.max_dist, step=30),
-                    tab_file_dist=opj(self.outdir, "tab_dist.csv"),
-                    fig_file_dist=opj(self.outdir,
-                                      "perc_dist.png"),
-                    blk_rows=128,
-                    dist_file_available=True,
-                    check_fcc=False,
-                    verbose=True)
-
-                # Save result
-                dist_edge_data = pd.DataFrame(dist_thresh,
-                                              index=[0])
-                dist_edge_data.to_csv(
-                    ofile,
-                    sep=",", header=True,
-                    index=False, index_label=False)
+            # Distance to forest edge threshold (shared stage)
+            copy_dist_thresh(self.period, self.outdir)
+            cache = ArtifactCache(self.workdir)
 
             # Check isCanceled() to handle cancellation
             if self.isCanceled():
@@ -136,24 +129,45 @@ class MwCalibrateTask(QgsTask):
             progress += 1
             self.set_progress(progress, self.N_STEPS)
 
+            # Skip window sizes whose outputs are up to date
+            artifacts = {win_size: self.get_artifacts(win_size)
+                         for win_size in self.win_sizes}
+            win_sizes = [win_size for win_size in self.win_sizes
+                         if not cache.is_fresh(**artifacts[win_size])]
+            if len(win_sizes) == 0:
+                msg = 'Outputs of task "{name}" are up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
+
             # Compute time interval from years
             time_interval = self.get_time_interval()
 
-            # Model
-            model = f"mw_{self.win_size}"
-
-            # Compute local deforestation rate
-            rmj.local_defor_rate(
+            # Compute local deforestation rates for all window sizes
+            # from one read of the forest cover change raster, by
+            # block in parallel (same rasters as riskmapjnr.local_defor_rate)
+            fcc_file = opj(self.DATA, "fcc123.tif")
+            blk_rows = plan_blk_rows(
+                [fcc_file], n_workers=self.n_workers,
+                **block_memory(len(win_sizes)))
+            complete = local_defor_rate(
                 fcc_file=fcc_file,
                 defor_values=self.get_defor_values(),
-                ldefrate_file=opj(self.outdir,
-                                  f"ldefrate_{model}.tif"),
-                win_size=self.win_size,
+                ldefrate_files={win_size: self.get_ldefrate_file(win_size)
+                                for win_size in win_sizes},
                 time_interval=time_interval,
                 rescale_min_val=2,
                 rescale_max_val=65535,
-                blk_rows=128,
-                verbose=False)
+                blk_rows=blk_rows,
+                n_workers=self.n_workers,
+                is_canceled=self.isCanceled)
+            if not complete:
+                return False
+
+            # Record artifacts
+            for win_size in win_sizes:
+                cache.record(**artifacts[win_size])
 
             # Progress
             progress += 1
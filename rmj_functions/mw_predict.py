@@ -25,6 +25,12 @@ import riskmapjnr as rmj
 
 # Local import
 from ..utilities import add_layer, add_layer_to_group
+from ..artifact_cache import ArtifactCache
+from ..engines import plan_blk_rows
+from ..engines.riskmap import (
+    riskmap_defrate, pixel_area_ha,
+    write_mw_defrate_per_cat
+)
 
 # Alias
 opj = os.path.join
@@ -97,6 +103,22 @@ class MwPredictTask(QgsTask):
         dist_thresh = dist_thresh_data.loc[0, "dist_thresh"]
         return dist_thresh
 
+    def get_artifacts(self):
+        """Get stage name, inputs, parameters and outputs."""
+        model = f"mw_{self.win_size}"
+        date = self.get_date()
+        inputs = [opj(self.DATA, "fcc123.tif"),
+                  self.get_dist_file(),
+                  opj(self.moddir, f"ldefrate_{model}.tif"),
+                  opj(self.moddir, "dist_edge_threshold.csv")]
+        params = {"years": self.years}
+        outputs = [opj(self.outdir, f"prob_{model}_{date}.tif"),
+                   opj(self.outdir, f"defrate_cat_{model}_{self.period}.csv")]
+        artifacts = {"stage": f"{model}_predict_{self.period}",
+                     "inputs": inputs, "params": params,
+                     "outputs": outputs}
+        return artifacts
+
     def plot_prob(self, model, date):
         """Plot probability of deforestation."""
         prob_file = opj(self.outdir, f"prob_{model}_{date}.tif")
@@ -136,8 +158,15 @@ class MwPredictTask(QgsTask):
             # Set working directory
             os.chdir(self.workdir)
 
-            # Compute time interval from years
-            time_interval = self.get_time_interval()
+            # Skip prediction if outputs are up to date
+            cache = ArtifactCache(self.workdir)
+            artifacts = self.get_artifacts()
+            if cache.is_fresh(**artifacts):
+                msg = 'Predictions of task "{name}" are up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
 
             # Date
             date = self.get_date()
@@ -145,20 +174,25 @@ class MwPredictTask(QgsTask):
             # Model
             model = f"mw_{self.win_size}"
 
-            # Compute predictions
-            rmj.set_defor_cat_zero(
-                ldefrate_file=opj(self.moddir,
-                                  f"ldefrate_{model}.tif"),
-                dist_file=self.get_dist_file(),
-                dist_thresh=self.get_dist_thresh(),
-                ldefrate_with_zero_file=opj(
-                    self.outdir,
-                    f"prob_{model}_{date}.tif"),
-                blk_rows=128,
-                verbose=False)
+            # Compute predictions and count pixels per category in
+            # one pass (same outputs as rmj.set_defor_cat_zero and
+            # rmj.defrate_per_cat)
+            fcc_file = opj(self.DATA, "fcc123.tif")
+            input_files = [opj(self.moddir, f"ldefrate_{model}.tif"),
+                           self.get_dist_file()]
+            counts = riskmap_defrate(
+                model="mw",
+                input_files=input_files,
+                params={"dist_thresh": self.get_dist_thresh()},
+                output_file=opj(self.outdir, f"prob_{model}_{date}.tif"),
+                fcc_file=fcc_file,
+                period=self.period,
+                blk_rows=plan_blk_rows(input_files + [fcc_file],
+                                       overhead=8),
+                is_canceled=self.isCanceled)
 
             # Check isCanceled() to handle cancellation
-            if self.isCanceled():
+            if counts is None or self.isCanceled():
                 return False
 
             # Progress
@@ -166,18 +200,16 @@ class MwPredictTask(QgsTask):
             self.set_progress(progress, self.N_STEPS)
 
             # Compute deforestation rate per category
-            rmj.defrate_per_cat(
-                fcc_file=opj(self.DATA, "fcc123.tif"),
-                riskmap_file=opj(
-                    self.outdir,
-                    f"prob_{model}_{date}.tif"),
-                time_interval=time_interval,
-                period=self.period,
+            write_mw_defrate_per_cat(
+                counts=counts,
+                time_interval=self.get_time_interval(),
+                pixel_area=pixel_area_ha(fcc_file),
                 tab_file_defrate=opj(
                     self.outdir,
-                    f"defrate_cat_{model}_{self.period}.csv"),
-                blk_rows=128,
-                verbose=False)
+                    f"defrate_cat_{model}_{self.period}.csv"))
+
+            # Record artifacts
+            cache.record(**artifacts)
 
             # Progress
             progress += 1
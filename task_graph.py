@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# ================================================================
+# author          :Ghislain Vieilledent
+# email           :ghislain.vieilledent@cirad.fr
+# web             :https://ecology.ghislainv.fr
+# python_version  :>=3.6
+# license         :GPLv3
+# ================================================================
+
+"""Directed acyclic graph of tasks.
+
+Stages of the workflow are added to the graph with their
+dependencies. A task is created and added to the QGIS task manager
+as soon as all its dependencies are completed, so that independent
+branches (e.g. benchmark model and FAR models) run concurrently. If a
+task fails or is canceled, all the tasks depending on it are skipped.
+"""
+
+from qgis.core import Qgis, QgsMessageLog
+
+
+class TaskGraph:
+    """Directed acyclic graph of QGIS tasks."""
+
+    # Constants
+    MESSAGE_CATEGORY = "Deforisk"
+
+    def __init__(self, tm, callback=None):
+        """Initialize the graph.
+
+        :param tm: QGIS task manager.
+        :param callback: Function called when all tasks are
+            finished, with the list of failed tasks as argument.
+
+        """
+        self.tm = tm
+        self.callback = callback
+        self.nodes = {}
+        self.tasks = {}
+
+    def __contains__(self, name):
+        return name in self.nodes
+
+    def add(self, name, factory, deps=()):
+        """Add a task to the graph.
+
+        As a task can only depend on tasks already in the graph, the
+        graph is acyclic. Dependencies which are not in the graph are
+        assumed to be satisfied (outputs of a previous run).
+
+        :param name: Unique name of the task in the graph.
+        :param factory: Function returning the QgsTask. The function
+            is called when dependencies are completed, so that
+            results of upstream tasks can be used.
+        :param deps: Names of the tasks it depends on.
+
+        """
+        if name in self.nodes:
+            raise ValueError(f"Task {name} already in graph")
+        self.nodes[name] = {
+            "factory": factory,
+            "deps": [dep for dep in deps if dep in self.nodes],
+            "status": "pending",
+        }
+
+    def start(self):
+        """Start the tasks without dependencies."""
+        if len(self.nodes) == 0:
+            self.check_finished()
+            return
+        self.launch_ready()
+
+    def launch_ready(self):
+        """Launch tasks whose dependencies are completed."""
+        for (name, node) in self.nodes.items():
+            if node["status"] != "pending":
+                continue
+            dep_status = [self.nodes[dep]["status"] for dep in node["deps"]]
+            if all(status == "done" for status in dep_status):
+                self.launch(name)
+
+    def launch(self, name):
+        """Create and launch a task."""
+        node = self.nodes[name]
+        node["status"] = "running"
+        try:
+            task = node["factory"]()
+        except Exception as exc:
+            msg = f'Task "{name}" could not be created: {exc}'
+            QgsMessageLog.logMessage(
+                msg, self.MESSAGE_CATEGORY, Qgis.Critical)
+            self.on_terminated(name)
+            return
+        self.tasks[name] = task
+        task.taskCompleted.connect(lambda: self.on_completed(name))
+        task.taskTerminated.connect(lambda: self.on_terminated(name))
+        self.tm.addTask(task)
+
+    def on_completed(self, name):
+        """Launch downstream tasks."""
+        self.nodes[name]["status"] = "done"
+        self.tasks.pop(name, None)
+        self.launch_ready()
+        self.check_finished()
+
+    def on_terminated(self, name):
+        """Skip downstream tasks."""
+        self.nodes[name]["status"] = "failed"
+        self.tasks.pop(name, None)
+        for desc in self.descendants(name):
+            if self.nodes[desc]["status"] == "pending":
+                self.nodes[desc]["status"] = "skipped"
+                msg = f'Task "{desc}" skipped as "{name}" failed'
+                QgsMessageLog.logMessage(
+                    msg, self.MESSAGE_CATEGORY, Qgis.Warning)
+        self.check_finished()
+
+    def descendants(self, name):
+        """Get all tasks depending on a task."""
+        desc = set()
+        stack = [name]
+        while stack:
+            current = stack.pop()
+            for (other, node) in self.nodes.items():
+                if current in node["deps"] and other not in desc:
+                    desc.add(other)
+                    stack.append(other)
+        return desc
+
+    def check_finished(self):
+        """Call callback when all tasks are finished."""
+        status = [node["status"] for node in self.nodes.values()]
+        if any(i in ["pending", "running"] for i in status):
+            return
+        failed = [name for (name, node) in self.nodes.items()
+                  if node["status"] in ["failed", "skipped"]]
+        if self.callback:
+            self.callback(failed)
+
+# End of file
@@ -0,0 +1,152 @@
+# coding=utf-8
+"""Block size planner test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from engines import blocks
+from engines.blocks import plan_blk_rows
+from engines.predict import block_memory
+
+# Data type sizes (in bits) of the fake GDAL data types
+DTYPE_BITS = {"Byte": 8, "Int16": 16, "Float32": 32}
+
+
+class FakeBand:
+    """Fake GDAL band."""
+
+    def __init__(self, dtype, block_height):
+        self.DataType = dtype
+        self.block_height = block_height
+
+    def GetBlockSize(self):
+        """Internal block size (columns, rows)."""
+        return [256, self.block_height]
+
+
+class FakeDataset:
+    """Fake GDAL dataset."""
+
+    def __init__(self, ncol, nrow, dtype, nband=1, block_height=1):
+        self.RasterXSize = ncol
+        self.RasterYSize = nrow
+        self.RasterCount = nband
+        self.band = FakeBand(dtype, block_height)
+
+    def GetRasterBand(self, k):
+        """Get band."""
+        return self.band
+
+
+class PlanBlkRowsTest(unittest.TestCase):
+    """Test the number of rows of blocks."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.datasets = {}
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def add_raster(self, name, *args, **kwargs):
+        """Add a fake raster (an empty file is created on disk)."""
+        ifile = os.path.join(self.tmpdir, name)
+        open(ifile, "wb").close()
+        self.datasets[ifile] = FakeDataset(*args, **kwargs)
+        return ifile
+
+    def plan(self, rasters, **kwargs):
+        """Plan block rows with the fake rasters."""
+        fake_gdal = mock.Mock()
+        fake_gdal.Open.side_effect = self.datasets.get
+        fake_gdal.GetDataTypeSize.side_effect = DTYPE_BITS.get
+        with mock.patch.object(blocks, "gdal", fake_gdal):
+            return plan_blk_rows(rasters, **kwargs)
+
+    def test_budget(self):
+        """Rows fill the memory budget."""
+        ifile = self.add_raster("fcc.tif", 1000, 5000, "Byte")
+        # 1000 bytes per row and 5000 bytes with overhead
+        self.assertEqual(self.plan([ifile], budget=50000), 10)
+        self.assertEqual(self.plan([ifile], overhead=0, budget=40000), 40)
+
+    def test_pixel_bytes(self):
+        """Memory of intermediate arrays per pixel and per band."""
+        ifile = self.add_raster("var.tif", 1000, 5000, "Int16", nband=2)
+        # 2 bands * (2 + 8) bytes + 20 bytes per pixel
+        rows = self.plan([ifile], overhead=0, band_bytes=8,
+                         pixel_bytes=20, budget=400000)
+        self.assertEqual(rows, 10)
+
+    def test_directory(self):
+        """All the rasters of a directory are planned."""
+        for i in range(4):
+            self.add_raster(f"var_{i}.tif", 1000, 5000, "Byte")
+        rows = self.plan([self.tmpdir], overhead=0, budget=40000)
+        self.assertEqual(rows, 10)
+
+    def test_block_height(self):
+        """Rows are aligned on internal blocks."""
+        ifile = self.add_raster("fcc.tif", 1000, 5000, "Byte",
+                                block_height=16)
+        self.assertEqual(self.plan([ifile], overhead=0, budget=40000), 32)
+
+    def test_floor(self):
+        """Blocks have at least one internal block, whatever the
+        budget."""
+        ifile = self.add_raster("fcc.tif", 1000, 5000, "Byte",
+                                block_height=16)
+        self.assertEqual(self.plan([ifile], budget=1000), 16)
+        self.assertEqual(self.plan([ifile], budget=1000, min_rows=21), 21)
+
+    def test_workers(self):
+        """Each worker gets at least four blocks."""
+        ifile = self.add_raster("fcc.tif", 1000, 400, "Byte")
+        rows = self.plan([ifile], overhead=0, n_workers=4,
+                         budget=4 * 10 ** 6)
+        self.assertEqual(rows, 25)
+
+    def test_nrow(self):
+        """Rows are bounded by the number of rows of the raster."""
+        ifile = self.add_raster("fcc.tif", 1000, 50, "Byte")
+        self.assertEqual(self.plan([ifile], budget=10 ** 9), 50)
+
+    def test_predict(self):
+        """Large rasters with many variables are not read by a few
+        rows."""
+        files = [self.add_raster(f"var_{i}.tif", 50000, 20000, "Float32")
+                 for i in range(10)]
+        files.append(self.add_raster("forest.tif", 50000, 20000, "Byte"))
+        files.append(self.add_raster("rho.tif", 50000, 20000, "Float32"))
+        files.append(self.add_raster("fcc123.tif", 50000, 20000, "Byte"))
+        rows = self.plan(files, n_workers=4, budget=1024 ** 3,
+                         **block_memory(n_models=3))
+        self.assertGreaterEqual(rows, 8)
+
+    def test_no_raster(self):
+        """Default number of rows without rasters."""
+        self.assertEqual(self.plan([]), 128)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PlanBlkRowsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
@@ -0,0 +1,92 @@
+# coding=utf-8
+"""Model design test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from patsy.highlevel import dmatrices
+from patsy.build import build_design_matrices
+
+from engines.design import (design_spec, design_info_from_spec,
+                            save_design_spec, load_design_spec)
+
+# Formula of the iCAR model
+FORMULA = ("I(1-fcc) + trial ~ C(pa) + scale(dist_edge) "
+           "+ scale(altitude) + np.log(dist_road + 1) + cell")
+
+
+class DesignSpecTest(unittest.TestCase):
+    """Test the design info built from the design specification."""
+
+    def setUp(self):
+        """Runs before each test."""
+        rng = np.random.default_rng(1234)
+        nobs = 1000
+        self.dataset = pd.DataFrame({
+            "fcc": rng.integers(0, 2, nobs),
+            "trial": 1,
+            "pa": rng.integers(0, 2, nobs).astype(float),
+            "dist_edge": rng.gamma(2, 300, nobs).astype(np.float32),
+            "altitude": rng.normal(500, 200, nobs),
+            "dist_road": rng.gamma(2, 1000, nobs),
+            "cell": rng.integers(0, 100, nobs)})
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_spec(self):
+        """Variables and categorical levels of the specification."""
+        spec = design_spec(FORMULA, self.dataset)
+        self.assertEqual(spec["formula"], FORMULA)
+        self.assertEqual(spec["variables"],
+                         ["altitude", "cell", "dist_edge", "dist_road",
+                          "fcc", "pa", "trial"])
+        self.assertEqual(spec["levels"], {"pa": [0.0, 1.0]})
+        self.assertEqual(len(spec["transforms"]), 2)
+
+    def test_round_trip(self):
+        """Design matrices are the same as with the fitted design."""
+        ofile = os.path.join(self.tmpdir, "design_info.json")
+        save_design_spec(design_spec(FORMULA, self.dataset), ofile)
+        x_design_info = design_info_from_spec(load_design_spec(ofile))
+        _, x = dmatrices(FORMULA, self.dataset, 0, "drop")
+        # New data with a different mean and variance
+        new_data = self.dataset.sample(100, random_state=1)
+        new_data["altitude"] *= 2
+        (x_ref,) = build_design_matrices([x.design_info], new_data)
+        (x_new,) = build_design_matrices([x_design_info], new_data)
+        self.assertEqual(x_design_info.column_names,
+                         x.design_info.column_names)
+        np.testing.assert_array_equal(np.asarray(x_new),
+                                      np.asarray(x_ref))
+
+    def test_categorical(self):
+        """Categorical factors depend on one variable."""
+        formula = "I(1-fcc) + trial ~ C(pa + fcc) + cell"
+        with self.assertRaises(ValueError):
+            design_spec(formula, self.dataset)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DesignSpecTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
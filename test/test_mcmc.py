@@ -0,0 +1,168 @@
+# coding=utf-8
+"""MCMC diagnostics test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from engines import mcmc
+from engines.mcmc import rhat, ess, diagnostics, fit_icar_chains
+
+
+def ar1_chains(phi, nchain=4, ndraw=4000, seed=1234):
+    """Autoregressive chains of order 1 with unit variance."""
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, np.sqrt(1 - phi ** 2), (nchain, ndraw))
+    chains = np.zeros((nchain, ndraw))
+    chains[:, 0] = rng.normal(0, 1, nchain)
+    for t in range(1, ndraw):
+        chains[:, t] = phi * chains[:, t - 1] + noise[:, t]
+    return chains
+
+
+class McmcDiagnosticsTest(unittest.TestCase):
+    """Test convergence diagnostics on chains with known properties."""
+
+    def test_rhat_converged(self):
+        """R-hat is close to 1 for independent draws."""
+        chains = ar1_chains(0)
+        self.assertLess(rhat(chains), 1.01)
+
+    def test_rhat_not_converged(self):
+        """R-hat is large for chains with different means."""
+        chains = ar1_chains(0) + np.arange(4)[:, None]
+        self.assertGreater(rhat(chains), 1.5)
+
+    def test_rhat_trend(self):
+        """Split R-hat detects a trend within chains."""
+        chains = ar1_chains(0) + np.linspace(0, 3, 4000)[None, :]
+        self.assertGreater(rhat(chains), 1.1)
+
+    def test_ess_independent(self):
+        """ESS is close to the number of draws for independent draws."""
+        chains = ar1_chains(0)
+        self.assertAlmostEqual(ess(chains) / chains.size, 1, delta=0.1)
+
+    def test_ess_autocorrelated(self):
+        """ESS of an AR(1) process is n (1 - phi) / (1 + phi)."""
+        phi = 0.9
+        chains = ar1_chains(phi)
+        expected = chains.size * (1 - phi) / (1 + phi)
+        self.assertAlmostEqual(ess(chains) / expected, 1, delta=0.2)
+
+    def test_constant(self):
+        """Diagnostics are not defined for constant chains."""
+        chains = np.ones((4, 100))
+        self.assertTrue(np.isnan(rhat(chains)))
+        self.assertTrue(np.isnan(ess(chains)))
+
+    def test_diagnostics(self):
+        """Diagnostics are computed for each parameter."""
+        samples = np.stack([ar1_chains(0), ar1_chains(0.9)], axis=2)
+        (rhats, esss) = diagnostics(samples)
+        self.assertEqual(rhats.shape, (2,))
+        self.assertAlmostEqual(rhats[0], rhat(samples[:, :, 0]))
+        self.assertAlmostEqual(esss[1], ess(samples[:, :, 1]))
+        self.assertGreater(esss[0], esss[1])
+
+
+class FakeFuture:
+    """Future of a function computed at submission."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        """Result of the function."""
+        return self.value
+
+
+class FakePool:
+    """Pool running functions in the calling process."""
+
+    def submit(self, func, *args):
+        """Run a function."""
+        return FakeFuture(func(*args))
+
+
+class FitIcarChainsTest(unittest.TestCase):
+    """Test the burn-in of parallel chains."""
+
+    def setUp(self):
+        """Runs before each test."""
+        rng = np.random.default_rng(1234)
+        self.data = pd.DataFrame({"y": rng.integers(0, 2, 100),
+                                  "x": rng.normal(0, 1, 100),
+                                  "cell": np.arange(100)})
+        self.burnins = []
+
+    def fake_chain(self, converged):
+        """Fake run of one chain recording the burn-in."""
+        def run(formula, data, n_neighbors, neighbors, prior_vrho,
+                burnin, n_mcmc, thin, beta_start, vrho_start, seed):
+            self.burnins.append(burnin)
+            rng = np.random.default_rng(seed)
+            samples = rng.normal(0, 1, (n_mcmc, 4))
+            if not converged:
+                # Chains with different means
+                samples += seed % 100
+            return {"mcmc": samples, "rho": np.zeros(10)}
+        return run
+
+    def fit(self, converged, burnin_max=1000):
+        """Fit the model with fake chains (burn-in of one chain:
+        1000)."""
+        with mock.patch.object(mcmc, "run_icar_chain",
+                               self.fake_chain(converged)):
+            return fit_icar_chains(
+                FakePool(), "y ~ x + cell", self.data,
+                n_neighbors=None, neighbors=None, prior_vrho=-1,
+                mcmc=1000, thin=1, beta_start=0, n_chains=2,
+                burnin_max=burnin_max)
+
+    def test_converged(self):
+        """The fit stops after a short burn-in when chains have
+        converged."""
+        mod = self.fit(converged=True)
+        self.assertTrue(mod.converged)
+        self.assertEqual(self.burnins, [250, 250])
+        self.assertEqual(mod.total_burnin, 250)
+        self.assertLess(mod.total_burnin, 1000)
+
+    def test_extended(self):
+        """Burn-in is doubled while the total burn-in is lower than
+        the burn-in of one chain."""
+        mod = self.fit(converged=False)
+        self.assertFalse(mod.converged)
+        self.assertEqual(self.burnins[::2], [250, 500])
+        self.assertEqual(mod.burnin, 500)
+        self.assertEqual(mod.total_burnin, 750)
+        self.assertEqual(mod.chains.shape, (2, 1000, 4))
+
+    def test_burnin_max(self):
+        """Burn-in is extended up to a longer total burn-in."""
+        mod = self.fit(converged=False, burnin_max=4000)
+        self.assertEqual(self.burnins[::2], [250, 500, 1000, 2000])
+        self.assertEqual(mod.burnin, 2000)
+        self.assertEqual(mod.total_burnin, 3750)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(McmcDiagnosticsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
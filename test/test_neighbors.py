@@ -0,0 +1,91 @@
+# coding=utf-8
+"""Neighborhood of spatial cells test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import os
+import io
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import numpy as np
+import forestatrisk as far
+
+from engines.neighbors import cellneigh, compute_cellneigh
+
+from .utilities import write_raster
+
+
+def far_cellneigh(raster, csize, rank):
+    """Neighborhood computed with far.cellneigh (without messages)."""
+    with redirect_stdout(io.StringIO()):
+        return far.cellneigh(raster=raster, csize=csize, rank=rank)
+
+
+class CellneighTest(unittest.TestCase):
+    """Test the neighborhood of spatial cells against far.cellneigh."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        # 3.3 km x 2.4 km, cells are partial on the edges
+        self.raster = os.path.join(self.tmpdir, "fcc.tif")
+        write_raster(self.raster, np.ones((80, 110), dtype=np.uint8),
+                     nodata=0)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_far(self):
+        """Same arrays as far.cellneigh."""
+        for csize in [0.3, 0.5, 1, 10]:
+            for rank in [1, 2]:
+                (nneigh, adj) = cellneigh(
+                    self.raster, csize, rank,
+                    cache_file=os.path.join(self.tmpdir,
+                                            f"cache_{csize}_{rank}.npz"))
+                (nneigh_ref, adj_ref) = far_cellneigh(self.raster, csize,
+                                                      rank)
+                np.testing.assert_array_equal(nneigh, nneigh_ref)
+                np.testing.assert_array_equal(adj, adj_ref)
+
+    def test_one_cell(self):
+        """A single cell has no neighbors."""
+        (nneigh, adj) = compute_cellneigh(1, 1)
+        np.testing.assert_array_equal(nneigh, [0])
+        self.assertEqual(len(adj), 0)
+
+    def test_cache(self):
+        """Arrays are cached for a raster geometry, csize and rank."""
+        (nneigh, adj) = cellneigh(self.raster, csize=0.5)
+        cache_file = os.path.join(self.tmpdir, ".cellneigh_0.5km.npz")
+        self.assertTrue(os.path.isfile(cache_file))
+        mtime = os.path.getmtime(cache_file)
+        (nneigh_cache, adj_cache) = cellneigh(self.raster, csize=0.5)
+        self.assertEqual(os.path.getmtime(cache_file), mtime)
+        np.testing.assert_array_equal(nneigh_cache, nneigh)
+        np.testing.assert_array_equal(adj_cache, adj)
+        # A new rank gives new arrays
+        (nneigh_rank, _) = cellneigh(self.raster, csize=0.5, rank=2)
+        (nneigh_ref, _) = far_cellneigh(self.raster, 0.5, 2)
+        np.testing.assert_array_equal(nneigh_rank, nneigh_ref)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(CellneighTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
@@ -0,0 +1,173 @@
+# coding=utf-8
+"""Prediction of the deforestation probability test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from patsy.highlevel import dmatrices
+import joblib
+import forestatrisk as far
+
+from engines.predict import predict_raster
+from engines.design import design_spec
+from engines.comparison import fit_model
+from engines.defrate import N_CAT, count_per_cat
+
+from .utilities import write_raster, read_raster
+
+# Formula of the iCAR model
+FORMULA = ("I(1-fcc) + trial ~ C(pa) + scale(altitude) "
+           "+ np.log(dist_edge + 1) + cell")
+
+
+class PredictTest(unittest.TestCase):
+    """Test predictions against far.predict_raster_binomial_iCAR."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.var_dir = os.path.join(self.tmpdir, "data")
+        os.mkdir(self.var_dir)
+        rng = np.random.default_rng(1234)
+        shape = (57, 43)
+        # Variables with nodata pixels
+        altitude = rng.normal(500, 200, shape).astype(np.float32)
+        altitude[rng.random(shape) < 0.05] = -9999
+        dist_edge = rng.integers(1, 3000, shape).astype(np.uint32)
+        dist_edge[rng.random(shape) < 0.05] = 0
+        pa = rng.integers(0, 2, shape).astype(np.uint8)
+        pa[rng.random(shape) < 0.05] = 255
+        # Forest (0 for non-forest)
+        forest = (rng.random(shape) < 0.8).astype(np.uint8)
+        # Spatial random effects with nodata pixels
+        rho = rng.normal(0, 1, shape).astype(np.float32)
+        rho[rng.random(shape) < 0.05] = -9999
+        self.files = {}
+        for (name, data, nodata) in [("altitude", altitude, -9999),
+                                     ("dist_edge", dist_edge, 0),
+                                     ("pa", pa, 255),
+                                     ("forest", forest, 0)]:
+            self.files[name] = os.path.join(self.var_dir, f"{name}.tif")
+            write_raster(self.files[name], data, nodata=nodata)
+        self.files["rho"] = os.path.join(self.tmpdir, "rho.tif")
+        write_raster(self.files["rho"], rho, nodata=-9999)
+        # Dataset of observations to fit the models
+        valid = ((altitude != -9999) & (dist_edge != 0) & (pa != 255)
+                 & (forest == 1))
+        self.dataset = pd.DataFrame({
+            "fcc": rng.integers(0, 2, np.sum(valid)),
+            "trial": 1,
+            "pa": pa[valid].astype(float),
+            "altitude": altitude[valid],
+            "dist_edge": dist_edge[valid],
+            "cell": 0})
+        _, x = dmatrices(FORMULA, self.dataset, 0, "drop")
+        self.mod_icar = SimpleNamespace(
+            _x_design_info=x.design_info,
+            betas=rng.normal(0, 1, x.shape[1] - 1))
+        self.spec = design_spec(FORMULA, self.dataset)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def output(self, name):
+        """Path to an output raster."""
+        return os.path.join(self.tmpdir, name)
+
+    def test_icar(self):
+        """Same raster as far.predict_raster_binomial_iCAR, including
+        nodata pixels of variables, forest and spatial random effects,
+        whatever the block size."""
+        far.predict_raster_binomial_iCAR(
+            self.mod_icar, var_dir=self.var_dir,
+            input_cell_raster=self.files["rho"],
+            input_forest_raster=self.files["forest"],
+            output_file=self.output("prob_far.tif"),
+            blk_rows=10, verbose=False)
+        ref = read_raster(self.output("prob_far.tif"))
+        model_file = self.output("mod_icar.pickle")
+        with open(model_file, "wb") as file:
+            pickle.dump({"betas": self.mod_icar.betas}, file)
+        for blk_rows in [1, 7, 100]:
+            output_file = self.output(f"prob_icar_{blk_rows}.tif")
+            complete = predict_raster(
+                {"icar": model_file}, self.spec, self.var_dir,
+                self.files["forest"], {"icar": output_file},
+                cell_raster=self.files["rho"], blk_rows=blk_rows)
+            self.assertTrue(complete)
+            np.testing.assert_array_equal(read_raster(output_file), ref)
+        # Nodata pixels are in the raster
+        self.assertTrue(np.any(ref == 0))
+        self.assertTrue(np.any(ref > 0))
+
+    def test_models(self):
+        """Same rasters as far for all the models predicted in one
+        pass, and same counts per category as with the rasters."""
+        model_files = {"icar": self.output("mod_icar.pickle"),
+                       "glm": self.output("mod_glm.pickle"),
+                       "rf": self.output("mod_rf.joblib")}
+        with open(model_files["icar"], "wb") as file:
+            pickle.dump({"betas": self.mod_icar.betas}, file)
+        for model in ["glm", "rf"]:
+            fit_model(model, FORMULA, self.dataset, model_files[model])
+        rng = np.random.default_rng(1234)
+        fcc = rng.choice([0, 1, 2, 3], size=(57, 43)).astype(np.uint8)
+        fcc_file = self.output("fcc123.tif")
+        write_raster(fcc_file, fcc, nodata=0)
+        output_files = {model: self.output(f"prob_{model}.tif")
+                        for model in model_files}
+        counts = {model: np.zeros((2, N_CAT + 1), dtype=np.int64)
+                  for model in model_files}
+        complete = predict_raster(
+            model_files, self.spec, self.var_dir, self.files["forest"],
+            output_files, cell_raster=self.files["rho"],
+            fcc_raster=fcc_file, period="calibration", counts=counts,
+            blk_rows=7)
+        self.assertTrue(complete)
+        far.predict_raster_binomial_iCAR(
+            self.mod_icar, var_dir=self.var_dir,
+            input_cell_raster=self.files["rho"],
+            input_forest_raster=self.files["forest"],
+            output_file=self.output("prob_icar_far.tif"),
+            blk_rows=10, verbose=False)
+        for model in ["glm", "rf"]:
+            with open(model_files[model], "rb") as file:
+                mod = (pickle.load(file) if model == "glm"
+                       else joblib.load(file))
+            far.predict_raster(
+                mod, self.mod_icar._x_design_info, var_dir=self.var_dir,
+                input_forest_raster=self.files["forest"],
+                output_file=self.output(f"prob_{model}_far.tif"),
+                blk_rows=10, verbose=False)
+        for model in model_files:
+            pred = read_raster(output_files[model])
+            np.testing.assert_array_equal(
+                pred, read_raster(self.output(f"prob_{model}_far.tif")))
+            np.testing.assert_array_equal(
+                counts[model], count_per_cat(pred, fcc, "calibration"))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PredictTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
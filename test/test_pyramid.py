@@ -0,0 +1,109 @@
+# coding=utf-8
+"""Pyramid levels of variables test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from engines.pyramid import (resampling, derive_from_fcc123, build_level,
+                             FROM_FCC123)
+from engines.forest import fcc_code
+
+from .utilities import write_raster, read_raster
+
+
+class PyramidTest(unittest.TestCase):
+    """Test the forest rasters of pyramid levels."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmpdir, "data")
+        os.mkdir(self.data_dir)
+        rng = np.random.default_rng(1234)
+        shape = (90, 120)
+        # Forest at three dates with deforestation as a minority class
+        forest_t1 = (rng.random(shape) < 0.7).astype(np.uint8)
+        forest_t2 = forest_t1 * (rng.random(shape) > 0.1)
+        forest_t3 = forest_t2 * (rng.random(shape) > 0.1)
+        self.forest = {"forest_t1": forest_t1,
+                       "forest_t2": forest_t2.astype(np.uint8),
+                       "forest_t3": forest_t3.astype(np.uint8)}
+        self.fcc = {"fcc12": fcc_code(forest_t1, forest_t2),
+                    "fcc13": fcc_code(forest_t1, forest_t3)}
+        self.fcc123 = (forest_t1 + forest_t2 + forest_t3).astype(np.uint8)
+        for (name, data) in {**self.forest, **self.fcc}.items():
+            write_raster(os.path.join(self.data_dir, f"{name}.tif"),
+                         data, nodata=255)
+        write_raster(os.path.join(self.data_dir, "fcc123.tif"),
+                     self.fcc123, nodata=0)
+        write_raster(os.path.join(self.data_dir, "pa.tif"),
+                     rng.integers(0, 2, shape).astype(np.uint8),
+                     nodata=255)
+        with open(os.path.join(self.data_dir, "aoi.gpkg"), "w",
+                  encoding="utf-8") as f:
+            f.write("aoi")
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_resampling(self):
+        """Forest rasters are decimated, categorical variables are
+        aggregated with the mode."""
+        self.assertEqual(resampling("data/fcc123.tif"), "near")
+        self.assertEqual(resampling("data/forest_t1.tif"), "near")
+        self.assertEqual(resampling("data/pa.tif"), "mode")
+        self.assertEqual(resampling("data/dist_edge_t1.tif"), "average")
+
+    def test_derive(self):
+        """Forest rasters derived from fcc123 are the same as the ones
+        computed from forest tiles."""
+        fcc123_file = os.path.join(self.data_dir, "fcc123.tif")
+        for name in FROM_FCC123:
+            ofile = os.path.join(self.tmpdir, f"{name}.tif")
+            derive_from_fcc123(fcc123_file, ofile, name, blk_rows=7)
+            ref = {**self.forest, **self.fcc}[name]
+            np.testing.assert_array_equal(read_raster(ofile), ref)
+
+    def test_level(self):
+        """Forest rasters of a level agree with the aggregated fcc123,
+        which keeps the proportion of deforested pixels."""
+        level_dir = os.path.join(self.tmpdir, "preview_90m", "data")
+        build_level(self.data_dir, level_dir, 90)
+        fcc123 = read_raster(os.path.join(level_dir, "fcc123.tif"))
+        self.assertEqual(fcc123.shape, (30, 40))
+        forest_t1 = read_raster(os.path.join(level_dir, "forest_t1.tif"))
+        fcc12 = read_raster(os.path.join(level_dir, "fcc12.tif"))
+        np.testing.assert_array_equal(forest_t1, fcc123 > 0)
+        np.testing.assert_array_equal(
+            fcc12, fcc_code(forest_t1, fcc123 > 1))
+        # Deforestation is not removed as with the mode
+        for value in [1, 2]:
+            self.assertAlmostEqual(np.mean(fcc123 == value),
+                                   np.mean(self.fcc123 == value),
+                                   delta=0.02)
+        self.assertTrue(os.path.isfile(os.path.join(level_dir,
+                                                    "aoi.gpkg")))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PyramidTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
@@ -0,0 +1,138 @@
+# coding=utf-8
+"""Risk maps of the riskmapjnr models test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import os
+import math
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from engines.riskmap import (vulnerability_classes, set_cat_zero,
+                             riskmap_defrate)
+from engines.defrate import count_per_cat
+
+from .utilities import write_raster, read_raster
+
+
+def vulnerability_ref(forest, dist, subj, dist_bins):
+    """Vulnerability classes as in riskmapjnr.vulnerability_map."""
+    n_classes = len(dist_bins) - 1
+    dist_thresh = dist_bins[-1]
+    cat = pd.cut(dist.flatten(), bins=dist_bins, labels=False,
+                 include_lowest=True, right=True)
+    cat = cat.reshape(dist.shape)
+    cat = n_classes + 1 - cat
+    cat[dist > dist_thresh] = 1
+    cat[forest == 0] = 0
+    cat = cat * 1000 + subj
+    cat[cat <= 1000] = 0
+    return np.nan_to_num(cat, nan=0).astype(np.uint16)
+
+
+def cat_zero_ref(ldefrate, dist, dist_thresh):
+    """Risk map as in riskmapjnr.set_defor_cat_zero."""
+    cat = ldefrate.copy()
+    cat[(dist >= dist_thresh) & (cat != 0)] = 1
+    cat[dist == 0] = 0
+    return cat
+
+
+def dist_bins_ref(dist_thresh=600, n_classes=29, res=30):
+    """Geometric distance bins as in riskmapjnr.benchmark."""
+    ratio = math.pow(res / dist_thresh, 1 / n_classes)
+    bins = [dist_thresh * math.pow(ratio, n_classes - i)
+            for i in range(n_classes + 1)]
+    bins[0] = res
+    return bins
+
+
+class RiskmapTest(unittest.TestCase):
+    """Test the risk maps of the benchmark and moving window models."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(1234)
+        shape = (61, 47)
+        self.dist_bins = dist_bins_ref()
+        # Distances on and between bins, and beyond the threshold
+        values = np.r_[0, 10, self.dist_bins, np.arange(0, 1500, 30)]
+        self.dist = rng.choice(values, size=shape).astype(np.uint32)
+        self.forest = rng.integers(0, 2, shape).astype(np.uint8)
+        self.subj = rng.integers(0, 4, shape).astype(np.uint16)
+        self.ldefrate = rng.choice(
+            np.r_[0, rng.integers(2, 10000, 50)], size=shape
+        ).astype(np.uint16)
+        self.fcc = rng.choice([0, 1, 2, 3, 3], size=shape).astype(np.uint8)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def raster(self, name, data):
+        """Write a raster in the temporary directory."""
+        ofile = os.path.join(self.tmpdir, name)
+        write_raster(ofile, data)
+        return ofile
+
+    def test_vulnerability_classes(self):
+        """Same classes as riskmapjnr (pd.cut)."""
+        cat = vulnerability_classes(self.forest, self.dist.astype(float),
+                                    self.subj, self.dist_bins)
+        ref = vulnerability_ref(self.forest, self.dist, self.subj,
+                                self.dist_bins)
+        self.assertEqual(cat.dtype, np.uint16)
+        np.testing.assert_array_equal(cat, ref)
+
+    def test_set_cat_zero(self):
+        """Same risk map as riskmapjnr.set_defor_cat_zero."""
+        for dist_thresh in [30, 600, 1200]:
+            np.testing.assert_array_equal(
+                set_cat_zero(self.ldefrate, self.dist, dist_thresh),
+                cat_zero_ref(self.ldefrate, self.dist, dist_thresh))
+
+    def test_riskmap_defrate(self):
+        """Risk maps and counts do not depend on the block size."""
+        fcc_file = self.raster("fcc123.tif", self.fcc)
+        dist_file = self.raster("dist_edge.tif", self.dist)
+        inputs = {
+            "bm": ([self.raster("forest.tif", self.forest), dist_file,
+                    self.raster("subj.tif", self.subj)],
+                   {"dist_bins": self.dist_bins},
+                   vulnerability_ref(self.forest, self.dist, self.subj,
+                                     self.dist_bins)),
+            "mw": ([self.raster("ldefrate.tif", self.ldefrate), dist_file],
+                   {"dist_thresh": 600},
+                   cat_zero_ref(self.ldefrate, self.dist, 600))}
+        for (model, (input_files, params, ref)) in inputs.items():
+            ref_counts = count_per_cat(ref, self.fcc, "calibration")
+            for blk_rows in [1, 10, 100]:
+                output_file = os.path.join(
+                    self.tmpdir, f"prob_{model}_{blk_rows}.tif")
+                counts = riskmap_defrate(model, input_files, params,
+                                         output_file, fcc_file,
+                                         "calibration", blk_rows)
+                np.testing.assert_array_equal(read_raster(output_file), ref)
+                np.testing.assert_array_equal(counts, ref_counts)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RiskmapTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
@@ -0,0 +1,131 @@
+# coding=utf-8
+"""Sampling of observations test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import unittest
+
+import numpy as np
+
+from engines import sampling
+from engines.sampling import (pixel_keys, smallest_keys, adapt_nsamp,
+                              sample_block, CLASSES)
+from engines.predict import make_blocks
+
+
+class FakeBand:
+    """Fake GDAL band of an array."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def ReadAsArray(self, x_off, y_off, nx, ny):
+        """Read a block."""
+        return self.data[y_off:y_off + ny, x_off:x_off + nx].copy()
+
+
+class FakeDataset:
+    """Fake GDAL dataset of an array."""
+
+    def __init__(self, data):
+        self.band = FakeBand(data)
+
+    def GetRasterBand(self, k):
+        """Get band."""
+        return self.band
+
+
+class SamplingTest(unittest.TestCase):
+    """Test bottom-k sampling by block."""
+
+    def setUp(self):
+        """Runs before each test."""
+        rng = np.random.default_rng(1234)
+        # 0: deforested, 1: forest, 255: nodata
+        self.forest = rng.choice([0, 1, 1, 255], size=(97, 83))
+        sampling._STATE.update({"fmask": FakeDataset(self.forest),
+                                "ncol": self.forest.shape[1]})
+
+    def tearDown(self):
+        """Runs after each test."""
+        sampling._STATE.clear()
+
+    def merged_sample(self, blk_rows, seed, k):
+        """Sample of each class merging the reservoirs of blocks."""
+        (nrow, ncol) = self.forest.shape
+        reservoirs = {cls: (np.empty(0, dtype=np.int64),
+                            np.empty(0, dtype=np.uint64))
+                      for cls in CLASSES}
+        npix = dict.fromkeys(CLASSES, 0)
+        for blk in make_blocks(ncol, nrow, blk_rows):
+            for (cls, (idx, keys, n)) in sample_block(
+                    *blk, seed, k).items():
+                reservoirs[cls] = smallest_keys(
+                    np.concatenate((reservoirs[cls][0], idx)),
+                    np.concatenate((reservoirs[cls][1], keys)), k)
+                npix[cls] += n
+        return ({cls: np.sort(res[0]) for (cls, res) in reservoirs.items()},
+                npix)
+
+    def test_keys(self):
+        """Keys are distinct and depend on the seed."""
+        idx = np.arange(100000)
+        keys = pixel_keys(idx, 1234)
+        self.assertEqual(keys.dtype, np.uint64)
+        self.assertEqual(len(np.unique(keys)), len(idx))
+        self.assertFalse(np.array_equal(keys, pixel_keys(idx, 1)))
+        np.testing.assert_array_equal(keys[10:20],
+                                      pixel_keys(idx[10:20], 1234))
+
+    def test_smallest_keys(self):
+        """The k pixels with the smallest keys are kept."""
+        idx = np.arange(10)
+        keys = np.array([9, 3, 7, 1, 8, 0, 6, 2, 5, 4], dtype=np.uint64)
+        (sel, sel_keys) = smallest_keys(idx, keys, 3)
+        self.assertEqual(sorted(sel), [3, 5, 7])
+        self.assertEqual(sorted(sel_keys), [0, 1, 2])
+        self.assertEqual(len(smallest_keys(idx, keys, 20)[0]), 10)
+
+    def test_sample(self):
+        """The sample is the k pixels of each class with the smallest
+        keys."""
+        (sample, npix) = self.merged_sample(blk_rows=10, seed=1234, k=50)
+        for (cls, value) in CLASSES.items():
+            idx = np.flatnonzero(self.forest == value)
+            keys = pixel_keys(idx, 1234)
+            expected = np.sort(idx[np.argsort(keys)[:50]])
+            np.testing.assert_array_equal(sample[cls], expected)
+            self.assertEqual(npix[cls], len(idx))
+
+    def test_block_size(self):
+        """The sample does not depend on the block size."""
+        (ref, _) = self.merged_sample(blk_rows=97, seed=1234, k=50)
+        for blk_rows in [1, 7, 32]:
+            (sample, _) = self.merged_sample(blk_rows, seed=1234, k=50)
+            for cls in CLASSES:
+                np.testing.assert_array_equal(sample[cls], ref[cls])
+
+    def test_adapt_nsamp(self):
+        """Sample size adapted to forest area (as in far.sample)."""
+        pixel_area = 30 * 30
+        # 1000 pixels per Mha with bounds
+        self.assertEqual(adapt_nsamp(10 ** 6, pixel_area), 10000)
+        self.assertEqual(adapt_nsamp(25 * 10 ** 7, pixel_area), 22500)
+        self.assertEqual(adapt_nsamp(10 ** 9, pixel_area), 50000)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(SamplingTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
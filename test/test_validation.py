@@ -0,0 +1,139 @@
+# coding=utf-8
+"""Validation of risk maps on coarse grids test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from engines.validation import (column_sums, RowSums, observed,
+                                aggregate_raster, aggregate_observed,
+                                defor_lookup)
+
+from .utilities import write_raster
+
+
+def square_sums(data, csize):
+    """Sums over squares as in far.validation_udef_arp."""
+    (nrow, ncol) = data.shape
+    (nsy, nsx) = (-(-nrow // csize), -(-ncol // csize))
+    sums = np.zeros((nsy, nsx), dtype=data.dtype)
+    for py in range(nsy):
+        for px in range(nsx):
+            sums[py, px] = data[py * csize:(py + 1) * csize,
+                                px * csize:(px + 1) * csize].sum()
+    return sums
+
+
+class CoarseGridTest(unittest.TestCase):
+    """Test sums over squares by block of rows."""
+
+    def setUp(self):
+        """Runs before each test."""
+        rng = np.random.default_rng(1234)
+        self.data = rng.integers(0, 10, size=(53, 41))
+
+    def test_column_sums(self):
+        """Sums over groups of columns with a partial last group."""
+        for size in [1, 5, 41, 50]:
+            np.testing.assert_array_equal(
+                column_sums(self.data, size),
+                np.add.reduceat(self.data, np.arange(0, 41, size), axis=1))
+
+    def test_row_sums(self):
+        """Sums do not depend on the rows of blocks."""
+        for csize in [1, 7, 30, 53, 60]:
+            cols = column_sums(self.data, csize)
+            ref = square_sums(self.data, csize)
+            for blk_rows in [1, 4, 7, 29, 100]:
+                acc = RowSums(csize)
+                for y_off in range(0, 53, blk_rows):
+                    acc.add(cols[y_off:y_off + blk_rows])
+                np.testing.assert_array_equal(acc.sums(), ref)
+
+
+class AggregateTest(unittest.TestCase):
+    """Test the aggregation of observations and predictions."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(1234)
+        self.fcc = rng.choice([0, 1, 2, 3, 3], size=(233, 171))
+        self.fcc_file = os.path.join(self.tmpdir, "fcc123.tif")
+        write_raster(self.fcc_file, self.fcc.astype(np.uint8), nodata=0)
+        self.risk = rng.integers(0, 50, size=(233, 171))
+        self.risk_file = os.path.join(self.tmpdir, "prob_bm_t1.tif")
+        write_raster(self.risk_file, self.risk.astype(np.uint16))
+        self.tab_file = os.path.join(self.tmpdir, "defrate_cat_bm.csv")
+        defor_dens = rng.random(39)
+        defor_dens[5] = np.nan
+        pd.DataFrame({"cat": np.arange(1, 40),
+                      "defor_dens": defor_dens}).to_csv(self.tab_file,
+                                                        index=False)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_observed(self):
+        """Same observations as with sums over each square for mixed
+        cell sizes and block sizes."""
+        for period in ["calibration", "validation", "historical"]:
+            (forest, defor) = [i.astype(np.int64)
+                               for i in observed(self.fcc, period)]
+            for csizes in [[50, 100], [7, 30, 45], [233, 300]]:
+                for blk_rows in [1, 13, 64, 500]:
+                    obs = aggregate_observed(self.fcc_file, period, csizes,
+                                             blk_rows)
+                    for csize in csizes:
+                        np.testing.assert_array_equal(
+                            obs[csize][0],
+                            square_sums(forest, csize).ravel())
+                        np.testing.assert_array_equal(
+                            obs[csize][1],
+                            square_sums(defor, csize).ravel())
+
+    def test_predicted(self):
+        """Same predictions as with sums over each square."""
+        lookup = defor_lookup(self.tab_file, 10)
+        df = pd.read_csv(self.tab_file)
+        self.assertEqual(lookup[6], 0)
+        self.assertEqual(lookup[0], 0)
+        self.assertAlmostEqual(lookup[1], df["defor_dens"][0] * 10)
+        pred = lookup[self.risk]
+        csizes = [7, 30, 45]
+        for blk_rows in [1, 13, 500]:
+            sums = aggregate_raster(self.risk_file, csizes,
+                                    lambda cat: [lookup[cat]], blk_rows)
+            for csize in csizes:
+                np.testing.assert_allclose(sums[csize][0],
+                                           square_sums(pred, csize))
+
+    def test_canceled(self):
+        """Aggregation stops when canceled."""
+        self.assertIsNone(aggregate_observed(
+            self.fcc_file, "calibration", [10], 10,
+            is_canceled=lambda: True))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(AggregateTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
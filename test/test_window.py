@@ -0,0 +1,119 @@
+# coding=utf-8
+"""Local deforestation rate test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'ghislain.vieilledent@cirad.fr'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2026, Ghislain Vieilledent (Cirad)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from scipy.ndimage import uniform_filter
+
+from engines.window import (summed_area_table, window_sum, rescale,
+                            local_defor_rate)
+
+from .utilities import write_raster, read_raster
+
+
+def uniform_sum(data, win_size):
+    """Sum over windows as in riskmapjnr.local_defor_rate."""
+    win = uniform_filter(data.astype(int), size=win_size, mode="constant",
+                         cval=0, output=float) * win_size ** 2
+    return np.rint(win).astype(int)
+
+
+def ldefrate_ref(fcc, defor_values, win_size, time_interval):
+    """Local deforestation rate as in riskmapjnr.local_defor_rate."""
+    win_defor = uniform_sum(np.isin(fcc, defor_values), win_size)
+    win_for = uniform_sum(fcc > 0, win_size)
+    w = np.where(fcc > 0)
+    out = np.zeros(fcc.shape, dtype=int)
+    theta = 1 - (1 - win_defor[w] / win_for[w]) ** (1 / time_interval)
+    out[w] = rescale(theta, 2, 10000)
+    return out
+
+
+class WindowSumTest(unittest.TestCase):
+    """Test sums over moving windows."""
+
+    def test_window_sum(self):
+        """Sums from summed-area tables are the same as with
+        uniform_filter."""
+        rng = np.random.default_rng(1234)
+        data = rng.integers(0, 2, size=(40, 37))
+        halo = 10
+        # Rows above and below the raster are zeros
+        padded = np.zeros((40 + 2 * halo, 37), dtype=int)
+        padded[halo:halo + 40] = data
+        sat = summed_area_table(padded, halo)
+        for win_size in [1, 3, 7, 21]:
+            np.testing.assert_array_equal(
+                window_sum(sat, win_size, halo, 40, 37),
+                uniform_sum(data, win_size))
+
+
+class LocalDeforRateTest(unittest.TestCase):
+    """Test local deforestation rates of several window sizes."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(1234)
+        self.fcc = rng.choice([0, 1, 2, 3, 3, 3],
+                              size=(157, 93)).astype(np.uint8)
+        self.fcc_file = os.path.join(self.tmpdir, "fcc123.tif")
+        write_raster(self.fcc_file, self.fcc, nodata=0)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_local_defor_rate(self):
+        """Same rasters as riskmapjnr for all window sizes and block
+        sizes."""
+        win_sizes = [3, 7, 21]
+        for blk_rows in [1, 13, 200]:
+            files = {win_size: os.path.join(
+                self.tmpdir, f"ldefrate_{win_size}_{blk_rows}.tif")
+                     for win_size in win_sizes}
+            complete = local_defor_rate(
+                self.fcc_file, [1, 2], files, time_interval=10,
+                rescale_min_val=2, rescale_max_val=10000,
+                blk_rows=blk_rows)
+            self.assertTrue(complete)
+            for win_size in win_sizes:
+                np.testing.assert_array_equal(
+                    read_raster(files[win_size]),
+                    ldefrate_ref(self.fcc, [1, 2], win_size, 10))
+
+    def test_canceled(self):
+        """Computations stop when canceled."""
+        files = {3: os.path.join(self.tmpdir, "ldefrate_3.tif")}
+        complete = local_defor_rate(self.fcc_file, 1, files, 10,
+                                    blk_rows=10, is_canceled=lambda: True)
+        self.assertFalse(complete)
+
+    def test_even_window(self):
+        """Window sizes must be odd numbers."""
+        files = {4: os.path.join(self.tmpdir, "ldefrate_4.tif")}
+        with self.assertRaises(ValueError):
+            local_defor_rate(self.fcc_file, 1, files, 10)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(LocalDeforRateTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
+
+# End of file
@@ -59,3 +59,36 @@ def get_qgis_app():
         IFACE = QgisInterface(CANVAS)
 
     return QGIS_APP, CANVAS, IFACE, PARENT
+
+
+def write_raster(ofile, data, nodata=None, pixel_size=30):
+    """Write an array to a GeoTIFF raster (one band).
+
+    :param ofile: Output file.
+    :param data: Array (uint8, uint16, uint32 or float32).
+    :param nodata: NoData value.
+    :param pixel_size: Pixel size (in m).
+    """
+    from osgeo import gdal
+    dtypes = {"uint8": gdal.GDT_Byte, "uint16": gdal.GDT_UInt16,
+              "uint32": gdal.GDT_UInt32, "float32": gdal.GDT_Float32}
+    (nrow, ncol) = data.shape
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(ofile, ncol, nrow, 1, dtypes[str(data.dtype)])
+    ds.SetGeoTransform((0, pixel_size, 0, nrow * pixel_size, 0,
+                        -pixel_size))
+    band = ds.GetRasterBand(1)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    band.WriteArray(data)
+    band.FlushCache()
+    del band, ds
+
+
+def read_raster(ifile):
+    """Read the first band of a raster as an array."""
+    from osgeo import gdal
+    ds = gdal.Open(ifile)
+    data = ds.GetRasterBand(1).ReadAsArray()
+    del ds
+    return data
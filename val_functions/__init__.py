@@ -1,2 +1,3 @@
 from .empty_task import EmptyTask
 from .validate import ValidateTask
+from .combine_results import combine_model_results
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# ================================================================
+# author          :Ghislain Vieilledent
+# email           :ghislain.vieilledent@cirad.fr
+# web             :https://ecology.ghislainv.fr
+# python_version  :>=3.6
+# license         :GPLv3
+# ================================================================
+
+"""
+Combine model validation results.
+"""
+
+import os
+
+import pandas as pd
+
+# Alias
+opj = os.path.join
+
+
+def combine_model_results(workdir, csizes_val, models, periods):
+    """Combine model results for comparison.
+
+    Indices of all models, periods and coarse grid cell sizes are
+    gathered in ``outputs/model_validation/indices_all.csv``.
+
+    :param workdir: Working directory.
+    :param csizes_val: List of coarse grid cell sizes.
+    :param models: List of models.
+    :param periods: List of validation periods.
+
+    """
+    os.chdir(workdir)
+    out_dir = opj("outputs", "model_validation")
+    indices_list = []
+    # Loop on periods and models
+    for csize_val in csizes_val:
+        for period in periods:
+            for model in models:
+                ifile = opj(
+                    out_dir, period, "tables",
+                    f"indices_{model}_{period}_{csize_val}.csv"
+                )
+                if os.path.isfile(ifile):
+                    df = pd.read_csv(ifile)
+                    df["model"] = model
+                    df["period"] = period
+                    indices_list.append(df)
+    # Concat indices
+    indices = pd.concat(indices_list, axis=0)
+    indices.sort_values(by=["csize_coarse_grid", "period", "model"])
+    indices = indices[["csize_coarse_grid", "csize_coarse_grid_ha",
+                       "ncell", "period", "model",
+                       "MedAE", "R2", "RMSE", "wRMSE"]]
+    indices.to_csv(
+        opj(out_dir, "indices_all.csv"),
+        sep=",", header=True,
+        index=False, index_label=False)
+
+# End of file
@@ -18,7 +18,10 @@ from qgis.core import (
     Qgis, QgsTask, QgsMessageLog
 )
 
-import forestatrisk as far
+# Local import
+from ..artifact_cache import ArtifactCache
+from ..engines import plan_blk_rows
+from ..engines.validation import validate, block_memory
 
 # Alias
 opj = os.path.join
@@ -34,28 +37,18 @@ class ValidateTask(QgsTask):
     FAR_MODELS = ["icar", "glm", "rf"]
     N_STEPS = 1
 
-    def __init__(self, description, iface, workdir, years, csize_val,
-                 model, period):
+    def __init__(self, description, iface, workdir, years, csizes_val,
+                 models, period, n_workers=1):
         super().__init__(description, QgsTask.CanCancel)
         self.iface = iface
         self.workdir = workdir
         self.years = years
-        self.csize_val = csize_val
-        self.model = model
+        self.csizes_val = ([csizes_val] if isinstance(csizes_val, int)
+                           else list(csizes_val))
+        self.models = [models] if isinstance(models, str) else list(models)
         self.period = period
+        self.n_workers = max(1, int(n_workers))
         self.exception = None
-        if self.model in self.FAR_MODELS:
-            self.resdir = opj(
-                self.OUT, "far_models", self.period
-            )
-        elif self.model == "bm":
-            self.resdir = opj(
-                self.OUT, "rmj_benchmark", self.period
-            )
-        else:
-            self.resdir = opj(
-                self.OUT, "rmj_moving_window", self.period
-            )
         self.out_fig = opj(self.OUT, "model_validation",
                            self.period, "figures")
         self.out_tab = opj(self.OUT, "model_validation",
@@ -85,6 +78,41 @@ class ValidateTask(QgsTask):
             date = "t3"
         return date
 
+    def get_resdir(self, model):
+        """Get the directory of the risk map of a model."""
+        if model in self.FAR_MODELS:
+            resdir = opj(self.OUT, "far_models", self.period)
+        elif model == "bm":
+            resdir = opj(self.OUT, "rmj_benchmark", self.period)
+        else:
+            resdir = opj(self.OUT, "rmj_moving_window", self.period)
+        return resdir
+
+    def get_inputs(self, model):
+        """Get the risk map and the table of deforestation density."""
+        resdir = self.get_resdir(model)
+        return (opj(resdir, f"prob_{model}_{self.get_date()}.tif"),
+                opj(resdir, f"defrate_cat_{model}_{self.period}.csv"))
+
+    def get_outputs(self, model, csize_val):
+        """Get the indices, table and figure files."""
+        suffix = f"{model}_{self.period}_{csize_val}"
+        return (opj(self.out_tab, f"indices_{suffix}.csv"),
+                opj(self.out_tab, f"pred_obs_{suffix}.csv"),
+                opj(self.out_fig, f"pred_obs_{suffix}.png"))
+
+    def get_artifacts(self, model, csize_val):
+        """Get stage name, inputs, parameters and outputs."""
+        suffix = f"{model}_{self.period}_{csize_val}"
+        inputs = [opj(self.DATA, "fcc123.tif")]
+        inputs.extend(self.get_inputs(model))
+        params = {"years": self.years}
+        outputs = list(self.get_outputs(model, csize_val))
+        artifacts = {"stage": f"validate_{suffix}",
+                     "inputs": inputs, "params": params,
+                     "outputs": outputs}
+        return artifacts
+
     def set_progress(self, progress, n_steps):
         """Set progress."""
         if progress == 0:
@@ -110,37 +138,46 @@ class ValidateTask(QgsTask):
             # Set working directory
             os.chdir(self.workdir)
 
-            # Compute time intervals from years
-            time_interval = self.get_time_interval()
-
-            # Date
-            date = self.get_date()
-
-            # Validation
-            far.validation_udef_arp(
-                fcc_file=opj(self.DATA, "fcc123.tif"),
+            # Skip validations whose outputs are up to date
+            cache = ArtifactCache(self.workdir)
+            artifacts = {(model, csize_val): self.get_artifacts(model,
+                                                                csize_val)
+                         for model in self.models
+                         for csize_val in self.csizes_val}
+            stale = [key for key in artifacts
+                     if not cache.is_fresh(**artifacts[key])]
+            if len(stale) == 0:
+                msg = 'Validation of task "{name}" is up to date'
+                msg = msg.format(name=self.description())
+                QgsMessageLog.logMessage(msg, self.MESSAGE_CATEGORY,
+                                         Qgis.Info)
+                return True
+
+            # Validation of all models and coarse grids, fcc123.tif
+            # being read once (same outputs as far.validation_udef_arp)
+            models = {}
+            for (model, csize_val) in stale:
+                if model not in models:
+                    models[model] = self.get_inputs(model) + ({},)
+                models[model][2][csize_val] = self.get_outputs(
+                    model, csize_val)
+            fcc_file = opj(self.DATA, "fcc123.tif")
+            complete = validate(
+                fcc_file=fcc_file,
                 period=self.period,
-                time_interval=time_interval,
-                riskmap_file=opj(
-                    self.resdir,
-                    f"prob_{self.model}_{date}.tif"),
-                tab_file_defor=opj(
-                    self.resdir,
-                    f"defrate_cat_{self.model}_{self.period}.csv"),
-                csize_coarse_grid=self.csize_val,
-                indices_file_pred=opj(
-                    self.out_tab,
-                    f"indices_{self.model}_{self.period}_{self.csize_val}.csv"
-                ),
-                tab_file_pred=opj(
-                    self.out_tab,
-                    f"pred_obs_{self.model}_{self.period}_{self.csize_val}.csv"
-                ),
-                fig_file_pred=opj(
-                    self.out_fig,
-                    f"pred_obs_{self.model}_{self.period}_{self.csize_val}.png"
-                ),
-                verbose=False)
+                time_interval=self.get_time_interval(),
+                models=models,
+                blk_rows=plan_blk_rows([fcc_file],
+                                       n_workers=self.n_workers,
+                                       **block_memory()),
+                n_workers=self.n_workers,
+                is_canceled=self.isCanceled)
+            if not complete:
+                return False
+
+            # Record artifacts
+            for key in stale:
+                cache.record(**artifacts[key])
 
             # Check isCanceled() to handle cancellation
             if self.isCanceled():